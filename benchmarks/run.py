@@ -0,0 +1,567 @@
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import os
+import sys
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from benchmarks.stub import StubState, StubServer, fake_profile
+from cofollows import CoFollowIndex
+from config import (
+    USERS_DB_FILE,
+    USERS_JOURNAL_FILE,
+    PROFILES_DB_FILE,
+    PROFILES_JOURNAL_FILE,
+    COFOLLOW_RETENTION_DAYS
+)
+from database import Database, SQLiteDatabase
+from ratelimit import ApiDispatcher
+from tracker import check_user
+from twitter_api import AsyncTwitterAPI
+from utils import (
+    format_date,
+    format_following_list,
+    format_tracked_users,
+    iter_following_list,
+    render_profile
+)
+
+SCENARIOS = ('track', 'recheck', 'delta', 'handler', 'stress', 'database', 'format', 'trending', 'replay')
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'recorded.json')
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def report(scenario, size, samples, counters=None, **extra):
+    """Summarise one scenario run"""
+    row = {
+        'scenario': scenario,
+        'size': size,
+        'ops': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 2),
+        'p90_ms': round(percentile(samples, 90) * 1000, 2),
+        'p99_ms': round(percentile(samples, 99) * 1000, 2),
+        'max_ms': round(max(samples, default=0) * 1000, 2),
+        'api_calls': counters['calls'] if counters else 0,
+        'credits': counters['credits'] if counters else 0,
+        'api_errors': counters['errors'] if counters else 0
+    }
+    row.update(extra)
+    return row
+
+def counter_delta(state, before):
+    """Stub counters accumulated since before"""
+    after = state.counters()
+    return {key: after[key] - before[key] for key in after}
+
+def new_api(stub):
+    """API client pointed at the stub with the rate limit lifted"""
+    api = AsyncTwitterAPI()
+    api.base_url = stub.url
+    api.dispatcher = ApiDispatcher(rate=1_000_000, burst=1_000_000)
+    return api
+
+async def timed(func, *args, **kwargs):
+    """Await func and return (seconds, result)"""
+    started = time.perf_counter()
+    result = await func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+async def run_bounded(jobs, concurrency):
+    """Run coroutine factories with at most concurrency at once"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            return await job()
+
+    return await asyncio.gather(*(run(job) for job in jobs))
+
+async def bench_track(stub, state, size, args):
+    """First-time tracking (baseline snapshots) of size accounts"""
+    db = SQLiteDatabase(f"track-{size}.db")
+    api = new_api(stub)
+    usernames = [f"track{size}_{i}" for i in range(size)]
+    for username in usernames:
+        state.add_account(username, args.following)
+
+    before = state.counters()
+    timings = await run_bounded(
+        [lambda u=u: timed(check_user, db, api, u) for u in usernames], args.concurrency
+    )
+    await api.close()
+    failed = sum(1 for _, result in timings if not result['success'])
+    return report('track', size, [t for t, _ in timings], counter_delta(state, before), failed=failed)
+
+async def bench_recheck(stub, state, size, args):
+    """Re-check size tracked accounts that did not change"""
+    db = SQLiteDatabase(f"recheck-{size}.db")
+    usernames = [f"recheck{size}_{i}" for i in range(size)]
+    for username in usernames:
+        state.add_account(username, args.following)
+
+    api = new_api(stub)
+    await run_bounded([lambda u=u: check_user(db, api, u) for u in usernames], args.concurrency)
+    await api.close()
+
+    # Fresh client so cached user info does not hide the lookups
+    api = new_api(stub)
+    before = state.counters()
+    timings = await run_bounded(
+        [lambda u=u: timed(check_user, db, api, u) for u in usernames], args.concurrency
+    )
+    await api.close()
+    return report('recheck', size, [t for t, _ in timings], counter_delta(state, before))
+
+async def bench_delta(stub, state, size, args):
+    """One account gains size follows (and loses 1%), checked until complete"""
+    db = SQLiteDatabase(f"delta-{size}.db")
+    username = f"delta{size}"
+    state.add_account(username, args.following)
+
+    api = new_api(stub)
+    await check_user(db, api, username)
+    state.follow(username, size)
+    state.unfollow(username, max(1, size // 100))
+
+    before = state.counters()
+    samples = []
+    first_page = []
+    found = 0
+    for _ in range(args.max_runs):
+        page_started = time.perf_counter()
+
+        async def on_page(page):
+            if not first_page:
+                first_page.append(time.perf_counter() - page_started)
+
+        api.user_info_cache.data.clear()
+        seconds, result = await timed(check_user, db, api, username, on_page=on_page)
+        samples.append(seconds)
+        if result['success']:
+            found += len(result['new_followings'])
+            if result['complete']:
+                break
+
+    await api.close()
+    return report(
+        'delta', size, samples, counter_delta(state, before),
+        runs=len(samples),
+        found=found,
+        first_page_ms=round(first_page[0] * 1000, 2) if first_page else None
+    )
+
+class FakeMessage:
+    """Message stand-in recording what the handler sends"""
+
+    chat_id = 1
+
+    async def reply_text(self, text, **kwargs):
+        return FakeMessage()
+
+    async def edit_text(self, text, **kwargs):
+        return self
+
+    async def delete(self):
+        return True
+
+class FakeBot:
+    """Bot stand-in for the outbox"""
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return FakeMessage()
+
+async def bench_handler(stub, state, size, args):
+    """track_command end to end: first track, then a check with 5 new follows"""
+    import bot
+
+    bot.db = bot.service.db = bot.scheduler.db = SQLiteDatabase(f"handler-{size}.db")
+    bot.twitter_api = bot.service.twitter_api = new_api(stub)
+    bot.outbox.start(FakeBot())
+
+    usernames = [f"handler{size}_{i}" for i in range(size)]
+    for username in usernames:
+        state.add_account(username, args.following)
+
+    def update():
+        return SimpleNamespace(effective_message=FakeMessage(), effective_chat=SimpleNamespace(id=1))
+
+    async def track(username):
+        return await timed(bot.track_command, update(), SimpleNamespace(args=[username]))
+
+    await run_bounded([lambda u=u: track(u) for u in usernames], args.concurrency)
+    for username in usernames:
+        state.follow(username, 5)
+    bot.twitter_api.user_info_cache.data.clear()
+
+    before = state.counters()
+    timings = await run_bounded([lambda u=u: track(u) for u in usernames], args.concurrency)
+    depth = bot.outbox.depth()
+    await bot.outbox.stop()
+    await bot.twitter_api.close()
+    return report('handler', size, [t for t, _ in timings], counter_delta(state, before), outbox_depth=depth)
+
+async def bench_stress(stub, state, size, args):
+    """Hundreds of simultaneous /track and /remove updates on up to size accounts
+
+    Every round fires args.stress_updates /track updates at once from
+    args.stress_chats chats, with background checks mixed in, after the
+    accounts gained new follows. Each account must then have logged
+    every new follow exactly once, and no chat may have been handed an
+    event twice. A last round mixes in /remove; afterwards an account
+    must be stored exactly when some chat still tracks it.
+    """
+    import bot
+
+    db = bot.db = bot.service.db = bot.scheduler.db = SQLiteDatabase(f"stress-{size}.db")
+    bot.twitter_api = bot.service.twitter_api = new_api(stub)
+    bot.outbox.start(FakeBot())
+
+    # At least two updates per account and round
+    accounts = max(1, min(size, args.stress_updates // 2))
+    usernames = [f"stress{size}_{i}" for i in range(accounts)]
+    for username in usernames:
+        state.add_account(username, args.following)
+    chats = range(1, args.stress_chats + 1)
+
+    # Every event handed to a chat, by claim or fan-out
+    claimed = {}
+    claim_events = db.claim_events
+
+    def recording_claim(username, chat_id, upto_seq):
+        events = claim_events(username, chat_id, upto_seq)
+        for event in events:
+            claimed.setdefault((username.lower(), chat_id), []).append(event['seq'])
+        return events
+
+    db.claim_events = recording_claim
+    track = bot.per_account(bot.track_command)
+    remove = bot.per_account(bot.remove_command)
+
+    def update(chat_id):
+        return SimpleNamespace(
+            effective_message=FakeMessage(), message=FakeMessage(), effective_chat=SimpleNamespace(id=chat_id)
+        )
+
+    async def fire(index, with_removes=False):
+        username = usernames[index % accounts]
+        wave = index // accounts
+        chat_id = chats[wave % len(chats)]
+        # Spread background checks and removes over accounts and waves
+        if (index + wave) % 10 == 9:
+            return await timed(bot.service.check, username, track_new=False)
+        if with_removes and (index + wave) % 7 == 6:
+            return await timed(remove, update(chat_id), SimpleNamespace(args=[username]))
+        return await timed(track, update(chat_id), SimpleNamespace(args=[username]))
+
+    before = state.counters()
+    samples = []
+    added = {username.lower(): 0 for username in usernames}
+    tracked = set()
+    for round_number in range(args.stress_rounds):
+        if round_number:
+            for username in usernames:
+                state.follow(username, 5)
+                added[username.lower()] += 5
+        bot.twitter_api.user_info_cache.data.clear()
+        timings = await asyncio.gather(*(fire(index) for index in range(args.stress_updates)))
+        samples.extend(seconds for seconds, _ in timings)
+        if not round_number:
+            # Follows only count for accounts tracked before they happened
+            tracked = {username.lower() for username in usernames if db.get_user(username)}
+
+    violations = 0
+    for key in tracked:
+        follows = [event for event in db.get_events(key) if event['kind'] == 'follow']
+        if len(follows) != added[key] or len({event['user_id'] for event in follows}) != len(follows):
+            violations += 1
+        for chat_id in chats:
+            seqs = claimed.get((key, chat_id), [])
+            if len(seqs) != len(set(seqs)):
+                violations += 1
+
+    timings = await asyncio.gather(*(fire(index, with_removes=True) for index in range(args.stress_updates)))
+    samples.extend(seconds for seconds, _ in timings)
+    for username in usernames:
+        if (db.get_user(username) is None) != (not db.get_subscribers(username)):
+            violations += 1
+
+    depth = bot.outbox.depth()
+    await bot.outbox.stop()
+    await bot.twitter_api.close()
+    return report(
+        'stress', size, samples, counter_delta(state, before),
+        accounts=accounts,
+        updates=args.stress_updates * (args.stress_rounds + 1),
+        violations=violations,
+        outbox_depth=depth
+    )
+
+def bench_database(size, args):
+    """save_user / get_user / get_all_users for both storage backends
+
+    Users have profiles with IDs, so every save_user and get_user goes
+    through the profile store, which also holds args.db_profiles
+    followed accounts.
+    """
+    rows = []
+    profiles = [dict(fake_profile(i), userName=f"db{i}") for i in range(size)]
+    followed = [fake_profile(1_000_000 + i) for i in range(args.db_profiles)]
+
+    for backend in ('sqlite', 'json'):
+        os.makedirs('data', exist_ok=True)
+        if backend == 'sqlite':
+            db = SQLiteDatabase(f"database-{size}.db")
+            for i in range(size):
+                db.save_user(f"db{i}", profiles[i], 150)
+        else:
+            # Seed the file in one write; per-call cost is what is measured
+            db = Database()
+            db.save_data({
+                f"db{i}": {
+                    'username': f"db{i}", 'user_id': str(i), 'following_count': 150,
+                    'last_following_count': 150, 'first_tracked': '', 'last_checked': '',
+                    'check_count': 1
+                }
+                for i in range(size)
+            })
+            db.save_profiles(profiles)
+        db.save_profiles(followed)
+
+        ops = min(size, args.db_ops)
+        for op in ('save_user', 'get_user', 'get_all_users'):
+            samples = []
+            for i in range(ops if op != 'get_all_users' else 5):
+                started = time.perf_counter()
+                if op == 'save_user':
+                    db.save_user(f"db{i}", profiles[i], 151 + i)
+                elif op == 'get_user':
+                    db.get_user(f"db{i}")
+                else:
+                    db.get_all_users()
+                samples.append(time.perf_counter() - started)
+            rows.append(report(f"db-{backend}-{op}", size, samples, profiles=size + len(followed)))
+
+    # Later SQLite databases would migrate them, and later sizes reuse them, otherwise
+    for path in (USERS_DB_FILE, USERS_JOURNAL_FILE, PROFILES_DB_FILE, PROFILES_JOURNAL_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    return rows
+
+def clear_format_caches():
+    """Forget rendered profiles and parsed dates"""
+    render_profile.cache_clear()
+    format_date.cache_clear()
+
+def first_message(followings):
+    """Render only the first message of a following list"""
+    return next(iter_following_list(followings))
+
+def bench_format(size, args):
+    """format_following_list and format_tracked_users over size entries
+
+    Following lists are rendered with empty caches; format-following-first
+    only takes the first message of the lazy renderer.
+    """
+    followings = [fake_profile(1_000_000 + i) for i in range(size)]
+    users = [
+        {'username': f"user{i}", 'following_count': i, 'last_checked': '2026-01-01T10:00:00', 'check_count': 3}
+        for i in range(size)
+    ]
+
+    rows = []
+    for name, func, data, cold in (
+        ('format-following', format_following_list, followings, True),
+        ('format-following-first', first_message, followings, True),
+        ('format-tracked', format_tracked_users, users, False)
+    ):
+        samples = []
+        for _ in range(args.repeat):
+            if cold:
+                clear_format_caches()
+            started = time.perf_counter()
+            func(data)
+            samples.append(time.perf_counter() - started)
+        rows.append(report(name, size, samples, entries_per_sec=round(size / percentile(samples, 50))))
+    return rows
+
+def bench_trending(size, args):
+    """Co-follow index with size tracked users: replaying the log, then /trending windows
+
+    Every user follows args.trending_follows accounts spread over the
+    retention period, out of a pool of 5 * size accounts.
+    """
+    path = os.path.join('data', f"cofollows-{size}.jsonl")
+    rng = random.Random(size)
+    now = datetime.now()
+    retention = COFOLLOW_RETENTION_DAYS * 86400
+    entries = sorted((
+        {
+            'kind': 'follow',
+            'account': f"user{i}",
+            'user_id': str(rng.randrange(5 * size)),
+            'followed_at': (now - timedelta(seconds=rng.uniform(0, retention))).isoformat()
+        }
+        for i in range(size) for _ in range(args.trending_follows)
+    ), key=lambda entry: entry['followed_at'])
+    CoFollowIndex(path).write(entries)
+
+    rows = []
+    samples = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        index = CoFollowIndex(path)
+        index.refresh()
+        samples.append(time.perf_counter() - started)
+    rows.append(report('trending-load', size, samples, follows=index.live))
+
+    for window in ('1h', '24h', '7d'):
+        since = now - timedelta(**{{'h': 'hours', 'd': 'days'}[window[-1]]: int(window[:-1])})
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            trending = index.trending(since, 2, 20)
+            samples.append(time.perf_counter() - started)
+        in_window = len(index.timeline) - bisect.bisect_left(index.timeline, (since.isoformat(),))
+        rows.append(report(f"trending-{window}", size, samples, window_follows=in_window, results=len(trending)))
+    return rows
+
+async def bench_replay(stub, state, args):
+    """Check recorded accounts twice against replayed fixtures"""
+    db = SQLiteDatabase('replay.db')
+    api = new_api(stub)
+    samples = []
+    before = state.counters()
+    for _ in range(2):
+        for username in args.usernames:
+            seconds, _ = await timed(check_user, db, api, username)
+            samples.append(seconds)
+        api.user_info_cache.data.clear()
+    await api.close()
+    return report('replay', len(args.usernames), samples, counter_delta(state, before))
+
+async def run(args):
+    """Run the selected scenarios and return report rows"""
+    if args.mode == 'replay' and not os.path.exists(args.fixtures):
+        print(
+            f"Skipping replay: no fixtures at {args.fixtures}. "
+            "Record some with --mode record --usernames <accounts>.",
+            file=sys.stderr
+        )
+        return []
+
+    state = StubState(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        max_page_size=args.page_size,
+        mode=args.mode,
+        fixtures=args.fixtures
+    )
+    stub = StubServer(state).start()
+    rows = []
+
+    try:
+        if args.mode != 'synthetic':
+            # Recorded data only covers the given accounts
+            if not args.usernames:
+                args.usernames = state.recorded_usernames()
+            rows.append(await bench_replay(stub, state, args))
+            return rows
+
+        for size in args.sizes:
+            for scenario in args.scenarios:
+                if scenario == 'track':
+                    rows.append(await bench_track(stub, state, size, args))
+                elif scenario == 'recheck':
+                    rows.append(await bench_recheck(stub, state, size, args))
+                elif scenario == 'delta':
+                    rows.append(await bench_delta(stub, state, size, args))
+                elif scenario == 'handler':
+                    rows.append(await bench_handler(stub, state, size, args))
+                elif scenario == 'stress':
+                    rows.append(await bench_stress(stub, state, size, args))
+                elif scenario == 'database':
+                    rows.extend(bench_database(size, args))
+                elif scenario == 'format':
+                    rows.extend(bench_format(size, args))
+                elif scenario == 'trending':
+                    rows.extend(bench_trending(size, args))
+                print(json.dumps(rows[-1]), file=sys.stderr)
+    finally:
+        stub.stop()
+
+    return rows
+
+def print_table(rows):
+    """Print report rows as an aligned table"""
+    if not rows:
+        return
+    columns = ['scenario', 'size', 'ops', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'api_calls', 'credits']
+    extras = sorted({key for row in rows for key in row} - set(columns))
+    columns += extras
+    widths = {c: max(len(c), *(len(str(row.get(c, ''))) for row in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(str(row.get(c, '')).ljust(widths[c]) for c in columns))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark xtracker against a local twitterapi.io stub')
+    parser.add_argument('--sizes', default='10,1000,10000',
+                        help='comma separated tracked-user counts / delta sizes')
+    parser.add_argument('--scenarios', default=','.join(s for s in SCENARIOS if s != 'replay'),
+                        help=f"comma separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--latency', type=float, default=0.02, help='stub latency per request (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with 500')
+    parser.add_argument('--page-size', type=int, default=200, help='largest page the stub returns')
+    parser.add_argument('--following', type=int, default=150, help='following count of generated accounts')
+    parser.add_argument('--concurrency', type=int, default=50, help='checks run at once')
+    parser.add_argument('--max-runs', type=int, default=20, help='check runs allowed to finish a delta')
+    parser.add_argument('--stress-updates', type=int, default=500, help='simultaneous updates per stress round')
+    parser.add_argument('--stress-chats', type=int, default=5, help='chats sending the stress updates')
+    parser.add_argument('--stress-rounds', type=int, default=3, help='stress rounds, new follows before each but the first')
+    parser.add_argument('--db-ops', type=int, default=200, help='timed operations per database test')
+    parser.add_argument('--db-profiles', type=int, default=50_000,
+                        help='followed profiles in the profile store of the database test')
+    parser.add_argument('--repeat', type=int, default=5, help='repeats per formatter and trending test')
+    parser.add_argument('--trending-follows', type=int, default=20, help='follows per user in the trending test')
+    parser.add_argument('--mode', choices=('synthetic', 'record', 'replay'), default='synthetic')
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help='fixtures file for record/replay')
+    parser.add_argument('--usernames', default='',
+                        help='accounts to check in record/replay mode (replay: all recorded ones by default)')
+    parser.add_argument('--json', action='store_true', help='print rows as JSON lines')
+    args = parser.parse_args(argv)
+    args.sizes = [int(size) for size in args.sizes.split(',') if size]
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    args.usernames = [u for u in args.usernames.split(',') if u]
+    args.fixtures = os.path.abspath(args.fixtures)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    # Keep benchmark databases away from the real data directory
+    with tempfile.TemporaryDirectory(prefix='xtracker-bench-') as workdir:
+        os.chdir(workdir)
+        rows = asyncio.run(run(args))
+
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        print_table(rows)
+
+if __name__ == '__main__':
+    main()
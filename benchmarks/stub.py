@@ -0,0 +1,240 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+from config import TWITTER_API_KEY, TWITTER_API_BASE_URL, ENDPOINTS
+from ratelimit import estimate_credits
+
+ENDPOINT_NAMES = {path: name for name, path in ENDPOINTS.items()}
+STARTING_CREDITS = 10_000_000
+
+def fake_profile(user_id):
+    """Synthetic followings entry for an account ID"""
+    return {
+        'id': str(user_id),
+        'name': f"Account {user_id}",
+        'userName': f"acct{user_id}",
+        'description': f"Synthetic account #{user_id} used by the benchmark stub (with_some *markdown* chars).",
+        'followers_count': user_id % 250_000,
+        'following_count': user_id % 5_000,
+        'statuses_count': user_id % 90_000,
+        'created_at': 'Wed Oct 10 20:19:24 +0000 2018'
+    }
+
+class StubState:
+    """Accounts, call counters and fault settings shared with the HTTP handler
+
+    mode is 'synthetic' (generated accounts), 'record' (proxy to
+    twitterapi.io and save every response to fixtures) or 'replay'
+    (answer from saved fixtures only).
+    """
+
+    def __init__(self, latency=0.02, error_rate=0.0, max_page_size=200, mode='synthetic',
+                 fixtures=None, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_page_size = max_page_size
+        self.mode = mode
+        self.fixtures_path = fixtures
+        self.fixtures = {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.accounts = {}
+        self.next_id = 1_000_000
+        self.calls = Counter()
+        self.errors = 0
+        self.credits_spent = 0
+
+        if mode == 'replay':
+            with open(fixtures, 'r') as f:
+                self.fixtures = json.load(f)
+
+    def add_account(self, username, following_count):
+        """Create an account following following_count fresh IDs"""
+        with self.lock:
+            ids = list(range(self.next_id + following_count - 1, self.next_id - 1, -1))
+            self.next_id += following_count
+            self.accounts[username.lower()] = ids
+
+    def follow(self, username, count):
+        """Make an account follow count new IDs, newest first"""
+        with self.lock:
+            ids = list(range(self.next_id + count - 1, self.next_id - 1, -1))
+            self.next_id += count
+            self.accounts[username.lower()] = ids + self.accounts[username.lower()]
+
+    def unfollow(self, username, count):
+        """Make an account unfollow count random IDs"""
+        with self.lock:
+            ids = self.accounts[username.lower()]
+            removed = set(self.random.sample(ids, min(count, len(ids))))
+            self.accounts[username.lower()] = [i for i in ids if i not in removed]
+
+    def counters(self):
+        """Snapshot of call and credit counters"""
+        with self.lock:
+            return {
+                'calls': sum(self.calls.values()),
+                'credits': self.credits_spent,
+                'errors': self.errors
+            }
+
+    def respond(self, path, query):
+        """Status code and JSON body for one request"""
+        endpoint = ENDPOINT_NAMES.get(path)
+        if endpoint is None:
+            return 404, {'status': 'error', 'msg': f"Unknown path {path}"}
+
+        time.sleep(self.latency)
+
+        with self.lock:
+            self.calls[endpoint] += 1
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return 500, {'status': 'error', 'msg': 'Injected error'}
+
+        if self.mode == 'synthetic':
+            status, body = self.synthetic(endpoint, query)
+        elif self.mode == 'record':
+            status, body = self.record(path, query)
+        else:
+            status, body = self.replay(path, query)
+
+        if status == 200:
+            with self.lock:
+                self.credits_spent += estimate_credits(endpoint, body)
+        return status, body
+
+    def synthetic(self, endpoint, query):
+        """Answer from the generated accounts"""
+        if endpoint == 'my_info':
+            return 200, {
+                'recharge_credits': STARTING_CREDITS - self.credits_spent,
+                'total_bonus_credits': 0
+            }
+
+        username = query.get('userName', '')
+        with self.lock:
+            ids = self.accounts.get(username.lower())
+        if ids is None:
+            return 200, {'status': 'error', 'msg': 'User not found'}
+
+        if endpoint == 'user_info':
+            return 200, {
+                'status': 'success',
+                'data': {
+                    'userName': username,
+                    'name': username.title(),
+                    'description': 'Benchmark account',
+                    'followers': 1000,
+                    'following': len(ids),
+                    'followers_count': 1000,
+                    'following_count': len(ids),
+                    'statuses_count': 500,
+                    'created_at': 'Wed Oct 10 20:19:24 +0000 2018'
+                }
+            }
+
+        start = int(query.get('cursor') or 0)
+        page_size = min(int(query.get('pageSize', 20)), self.max_page_size)
+        page = ids[start:start + page_size]
+        has_next = start + page_size < len(ids)
+        return 200, {
+            'status': 'success',
+            'followings': [fake_profile(user_id) for user_id in page],
+            'has_next_page': has_next,
+            'next_cursor': str(start + page_size) if has_next else None
+        }
+
+    def recorded_usernames(self):
+        """Accounts whose profile lookup is in the fixtures, in recording order"""
+        prefix = f"{ENDPOINTS['user_info']}?userName="
+        return [key[len(prefix):] for key in self.fixtures if key.startswith(prefix)]
+
+    def fixture_key(self, path, query):
+        """Fixture lookup key for a request"""
+        return f"{path}?{'&'.join(f'{k}={v}' for k, v in sorted(query.items()))}"
+
+    def record(self, path, query):
+        """Proxy to twitterapi.io and keep the response"""
+        response = requests.get(
+            f"{TWITTER_API_BASE_URL}{path}",
+            headers={'X-API-Key': TWITTER_API_KEY},
+            params=query,
+            timeout=30
+        )
+        body = response.json()
+        with self.lock:
+            self.fixtures[self.fixture_key(path, query)] = [response.status_code, body]
+        return response.status_code, body
+
+    def replay(self, path, query):
+        """Answer from recorded fixtures"""
+        fixture = self.fixtures.get(self.fixture_key(path, query))
+        if fixture is None:
+            return 404, {'status': 'error', 'msg': 'No recorded fixture'}
+        return fixture[0], fixture[1]
+
+    def save_fixtures(self):
+        """Write recorded responses to the fixtures file"""
+        if self.mode != 'record':
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.fixtures_path)), exist_ok=True)
+        with open(self.fixtures_path, 'w') as f:
+            json.dump(self.fixtures, f)
+
+class StubHandler(BaseHTTPRequestHandler):
+    """HTTP front of StubState"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        status, body = self.server.state.respond(url.path, query)
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Default backlog of 5 drops connections when 50 checks start at once
+    request_queue_size = 256
+
+class StubServer:
+    """Local stand-in for twitterapi.io on a free port, in a background thread"""
+
+    def __init__(self, state):
+        self.state = state
+        self.httpd = StubHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.httpd.state = state
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.state.save_fixtures()
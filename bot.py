@@ -1,290 +1,756 @@
-import logging
-from telegram import Update
-from telegram.ext import (
-    Application, 
-    CommandHandler, 
-    CallbackQueryHandler,
-    ContextTypes
-)
-from telegram.constants import ParseMode
-
-from config import TELEGRAM_BOT_TOKEN, MESSAGES
-from database import Database
-from twitter_api import TwitterAPI
-from utils import (
-    format_user_card,
-    format_following_list,
-    format_tracked_users,
-    create_user_keyboard,
-    escape_markdown
-)
-
-# Setup logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
-
-# Initialize
-db = Database()
-twitter_api = TwitterAPI()
-
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /start command"""
-    await update.message.reply_text(
-        MESSAGES['welcome'],
-        parse_mode=ParseMode.MARKDOWN
-    )
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /help command"""
-    await update.message.reply_text(
-        MESSAGES['help'],
-        parse_mode=ParseMode.MARKDOWN
-    )
-
-async def track_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /track command"""
-    if not context.args:
-        await update.message.reply_text(
-            "❌ use format: `/track username`\n\nExample: `/track loxous`",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
-    
-    username = context.args[0].replace('@', '')
-    
-    # Send loading message
-    loading_msg = await update.message.reply_text(
-        f"⏳ Fetching data for @{username}...",
-        parse_mode=ParseMode.MARKDOWN
-    )
-    
-    try:
-        # Get user info
-        user_info_result = twitter_api.get_user_info(username)
-        
-        if not user_info_result['success']:
-            await loading_msg.edit_text(
-                f"❌ Error: {escape_markdown(user_info_result['error'])}",
-                parse_mode=ParseMode.MARKDOWN_V2
-            )
-            return
-        
-        user_data = user_info_result['data']
-        current_following = user_data.get('following', 0)
-        
-        # Check if user already tracked
-        existing_user = db.get_user(username)
-        
-        if existing_user:
-            # User already tracked - check for new followings
-            difference = current_following - existing_user['following_count']
-            
-            if difference > 0:
-                # Has new followings
-                fetch_msg = f"🔍 Detected {difference} new following \\! Fetching details"
-                if difference > 200:
-                    pages_needed = (difference + 199) // 200  # Ceiling division
-                    fetch_msg += f" \\({pages_needed} API calls needed\\)"
-                fetch_msg += "\\.\\.\\."
-                
-                await loading_msg.edit_text(
-                    fetch_msg,
-                    parse_mode=ParseMode.MARKDOWN_V2
-                )
-                
-                # Fetch new followings
-                followings_result = twitter_api.fetch_new_followings(username, difference)
-                
-                if followings_result['success']:
-                    # Update database
-                    db.save_user(username, user_data, current_following)
-                    
-                    # Format and send new followings
-                    messages = format_following_list(followings_result['new_followings'])
-                    
-                    await loading_msg.delete()
-                    
-                    for msg in messages:
-                        await update.message.reply_text(
-                            msg,
-                            parse_mode=ParseMode.MARKDOWN_V2,
-                            disable_web_page_preview=True
-                        )
-                    
-                    # Send summary with pagination info
-                    summary = f"✅ *Update Complete*\n\n"
-                    summary += f"User: @{username}\n"
-                    summary += f"Following baru: *{difference}*\n"
-                    summary += f"Total following: *{current_following}*\n"
-                    
-                    # Add pagination info if multiple pages were fetched
-                    if followings_result.get('pages_fetched', 1) > 1:
-                        summary += f"\n📄 Pages fetched: *{followings_result['pages_fetched']}*"
-                        summary += f"\n💳 API calls used: *{followings_result['pages_fetched']}*"
-                    
-                    await update.message.reply_text(
-                        summary,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=create_user_keyboard(username)
-                    )
-                else:
-                    await loading_msg.edit_text(
-                        f"❌ Error fetching followings: {escape_markdown(followings_result['error'])}",
-                        parse_mode=ParseMode.MARKDOWN_V2
-                    )
-            
-            elif difference < 0:
-                # Following decreased (unfollowed)
-                db.save_user(username, user_data, current_following)
-                
-                msg = f"📊 *Update for @{username}*\n\n"
-                msg += f"Following decrease: *{abs(difference)}*\n"
-                msg += f"Total following: *{current_following}*\n\n"
-                msg += "ℹ️ User unfollow"
-                
-                await loading_msg.edit_text(
-                    msg,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=create_user_keyboard(username)
-                )
-            
-            else:
-                # No change
-                db.save_user(username, user_data, current_following)
-                
-                msg = f"✅ *@{username}* up\\-to\\-date\\!\n\n"
-                msg += f"Following: *{current_following}*\n"
-                msg += "Nothing change\\."
-                
-                await loading_msg.edit_text(
-                    msg,
-                    parse_mode=ParseMode.MARKDOWN_V2,
-                    reply_markup=create_user_keyboard(username)
-                )
-        
-        else:
-            # First time tracking
-            db.save_user(username, user_data, current_following)
-            
-            msg = f"✅ *Success tracking @{username}\\!*\n\n"
-            msg += format_user_card(user_data)
-            msg += "\n\n💡 Use `/track {username}` for check update\\."
-            
-            await loading_msg.edit_text(
-                msg,
-                parse_mode=ParseMode.MARKDOWN_V2,
-                reply_markup=create_user_keyboard(username),
-                disable_web_page_preview=True
-            )
-    
-    except Exception as e:
-        logger.error(f"Error in track_command: {e}")
-        await loading_msg.edit_text(
-            f"❌ error: {escape_markdown(str(e))}",
-            parse_mode=ParseMode.MARKDOWN_V2
-        )
-
-async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /list command"""
-    users = db.get_all_users()
-    msg = format_tracked_users(users)
-    
-    await update.message.reply_text(
-        msg,
-        parse_mode=ParseMode.MARKDOWN_V2
-    )
-
-async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /remove command"""
-    if not context.args:
-        await update.message.reply_text(
-            "❌ Use format: `/remove username`\n\nExample: `/remove loxous`",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        return
-    
-    username = context.args[0].replace('@', '')
-    
-    if db.remove_user(username):
-        await update.message.reply_text(
-            f"✅ Success delete tracking for @{username}",
-            parse_mode=ParseMode.MARKDOWN
-        )
-    else:
-        await update.message.reply_text(
-            f"❌ User @{username} not found in tracking list",
-            parse_mode=ParseMode.MARKDOWN
-        )
-
-async def credits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /credits command"""
-    loading_msg = await update.message.reply_text("⏳ Checking credits...")
-    
-    result = twitter_api.get_my_credits()
-    
-    if result['success']:
-        msg = f"💳 *API Credits Information*\n\n"
-        msg += f"💰 Recharge Credits: *{result['recharge_credits']}*\n"
-        msg += f"🎁 Bonus Credits: *{result['total_bonus_credits']}*\n"
-        msg += f"📊 Total Available: *{result['recharge_credits'] + result['total_bonus_credits']}*"
-        
-        await loading_msg.edit_text(
-            msg,
-            parse_mode=ParseMode.MARKDOWN
-        )
-    else:
-        await loading_msg.edit_text(
-            f"❌ Error: {result['error']}",
-            parse_mode=ParseMode.MARKDOWN
-        )
-
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button callbacks"""
-    query = update.callback_query
-    await query.answer()
-    
-    data = query.data
-    
-    if data.startswith('check_'):
-        username = data.replace('check_', '')
-        # Simulate /track command
-        context.args = [username]
-        await track_command(update, context)
-    
-    elif data.startswith('remove_'):
-        username = data.replace('remove_', '')
-        
-        if db.remove_user(username):
-            await query.edit_message_text(
-                f"✅ Success delete tracking for @{username}",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        else:
-            await query.edit_message_text(
-                f"❌ User @{username} not found",
-                parse_mode=ParseMode.MARKDOWN
-            )
-
-def main():
-    """Start the bot"""
-    # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    
-    # Add handlers
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("track", track_command))
-    application.add_handler(CommandHandler("list", list_command))
-    application.add_handler(CommandHandler("remove", remove_command))
-    application.add_handler(CommandHandler("credits", credits_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
-    
-    # Start bot
-    logger.info("Bot started...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
-
-if __name__ == '__main__':
-    main()
\ No newline at end of file
+import asyncio
+import csv
+import functools
+import io
+import logging
+import signal
+import time
+from datetime import datetime, timedelta
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import (
+    Application, 
+    CommandHandler, 
+    CallbackQueryHandler,
+    MessageHandler,
+    ContextTypes,
+    filters
+)
+from telegram.constants import ChatType, ParseMode
+from telegram.request import HTTPXRequest
+
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    CONCURRENT_UPDATES,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET_TOKEN,
+    MESSAGES,
+    SCHEDULER_ENABLED,
+    ADMIN_USER_IDS,
+    METRICS_ENABLED,
+    METRICS_HOST,
+    METRICS_PORT,
+    WORKER_ID,
+    HISTORY_DEFAULT_DAYS,
+    HISTORY_MAX_EVENTS,
+    TRENDING_DEFAULT_WINDOW,
+    BULK_MAX_ACCOUNTS,
+    BULK_PROGRESS_INTERVAL,
+    BULK_MAX_FILE_SIZE
+)
+from database import create_database
+from twitter_api import AsyncTwitterAPI
+from service import CheckService
+from scheduler import CheckScheduler
+from outbox import Outbox
+from leases import LeaseManager, create_lease_store
+from locks import chat_key
+from metrics import (
+    MetricsServer,
+    OUTBOX_BACKLOG,
+    CREDITS_REMAINING,
+    count_error,
+    instrument_handler
+)
+from tracing import exporter, span, trace_handler
+from webhook import WebhookServer
+from utils import (
+    format_user_card,
+    iter_following_list,
+    format_unfollowed_list,
+    iter_check_changes,
+    format_check_summary,
+    format_tracked_users,
+    format_slowest_traces,
+    format_history,
+    format_trending,
+    format_bulk_progress,
+    format_bulk_summary,
+    format_plan,
+    bulk_counts,
+    parse_since,
+    parse_usernames,
+    create_user_keyboard,
+    escape_markdown
+)
+
+# Setup logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def notify_chat(chat_id, result):
+    """Queue the changes of a check for a subscribed chat"""
+    for msg in iter_check_changes(result):
+        outbox.send(
+            chat_id,
+            msg,
+            parse_mode=ParseMode.MARKDOWN_V2,
+            disable_web_page_preview=True
+        )
+    
+    outbox.send(
+        chat_id,
+        format_check_summary(result),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=create_user_keyboard(result['username'])
+    )
+
+# Initialize
+db = create_database()
+twitter_api = AsyncTwitterAPI()
+outbox = Outbox()
+service = CheckService(db, twitter_api, deliver=notify_chat)
+scheduler = CheckScheduler(service, leases=LeaseManager(create_lease_store(), WORKER_ID))
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+
+# The only update types with handlers
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+class TracedRequest(HTTPXRequest):
+    """Bot API transport that records a span for every Telegram call"""
+    
+    async def do_request(self, url, method, *args, **kwargs):
+        with span(f"telegram.{url.rsplit('/', 1)[-1]}"):
+            return await super().do_request(url, method, *args, **kwargs)
+
+def instrumented(name, callback):
+    """Wrap a handler with latency metrics and a trace per update"""
+    return instrument_handler(name, trace_handler(name, callback))
+
+def per_account(callback):
+    """Wrap a handler of one account, the first argument, so a chat's updates about it run in order
+
+    Updates about other accounts, or from other chats, still run in
+    parallel. Inside, checks take the account locks.
+    """
+    
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        if not context.args:
+            return await callback(update, context)
+        username = context.args[0].replace('@', '')
+        async with service.locks.hold(chat_key(update.effective_chat.id, username)):
+            return await callback(update, context)
+    
+    return wrapper
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /start command"""
+    await update.message.reply_text(
+        MESSAGES['welcome'],
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /help command"""
+    await update.message.reply_text(
+        MESSAGES['help'],
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def track_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /track command"""
+    message = update.effective_message
+    
+    if not context.args:
+        await message.reply_text(
+            "❌ use format: `/track username`\n\nExample: `/track loxous`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    username = context.args[0].replace('@', '')
+    
+    # Send loading message
+    loading_msg = await message.reply_text(
+        f"⏳ Fetching data for @{username}...",
+        parse_mode=ParseMode.MARKDOWN
+    )
+    
+    async def on_progress(stage, difference, plan):
+        if stage == 'snapshot':
+            fetch_msg = "📸 Saving following snapshot"
+        elif stage == 'churn':
+            fetch_msg = "🔍 Same following count but the newest follows changed\\! Fetching details"
+        else:
+            fetch_msg = f"🔍 Following changed by {escape_markdown(f'{difference:+d}')}\\! Fetching details"
+        if plan['max_calls'] > 1:
+            calls = plan['calls'] if plan['max_calls'] == plan['calls'] else f"{plan['calls']}-{plan['max_calls']}"
+            fetch_msg += f" \\({escape_markdown(str(calls))} API calls needed\\)"
+        fetch_msg += "\\.\\.\\."
+        
+        await loading_msg.edit_text(
+            fetch_msg,
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+    
+    streamed = []
+    
+    async def on_page(page):
+        # Send each page of new follows while the next one is being fetched
+        if not streamed:
+            outbox.send(
+                message.chat_id,
+                "*🆕 New Following Detected\\!*",
+                parse_mode=ParseMode.MARKDOWN_V2,
+                disable_web_page_preview=True
+            )
+        
+        for msg in iter_following_list(page['new_followings'], start=len(streamed) + 1, header=False):
+            outbox.send(
+                message.chat_id,
+                msg,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                disable_web_page_preview=True
+            )
+        streamed.extend(page['new_followings'])
+    
+    try:
+        result = await service.check(
+            username,
+            chat_id=update.effective_chat.id,
+            claim=True,
+            on_progress=on_progress,
+            on_page=on_page
+        )
+        
+        if not result['success']:
+            await loading_msg.edit_text(
+                f"❌ Error: {escape_markdown(result['error'])}",
+                parse_mode=ParseMode.MARKDOWN_V2
+            )
+            return
+        
+        user_data = result['user_data']
+        current_following = result['current_following']
+        
+        # Changes this chat has not seen yet - this check's and any it
+        # missed; every other subscriber got its own through the fan-out
+        unseen = result['unseen']
+        
+        streamed_ids = {following.get('id') for following in streamed}
+        unseen_followings = [f for f in unseen['new_followings'] if f.get('id') not in streamed_ids]
+        if unseen_followings:
+            await on_page({'new_followings': unseen_followings})
+        
+        # Unfollows are only known once pagination finished
+        if unseen['unfollowed_ids']:
+            for msg in format_unfollowed_list(unseen['unfollowed_ids']):
+                outbox.send(
+                    message.chat_id,
+                    msg,
+                    parse_mode=ParseMode.MARKDOWN_V2,
+                    disable_web_page_preview=True
+                )
+        
+        if result['status'] == 'tracked':
+            # First time tracking
+            msg = f"✅ *Success tracking @{username}\\!*\n\n"
+            msg += format_user_card(user_data)
+            msg += "\n\n💡 Use `/track {username}` for check update\\."
+            
+            await loading_msg.edit_text(
+                msg,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                reply_markup=create_user_keyboard(username),
+                disable_web_page_preview=True
+            )
+        
+        elif result['status'] == 'snapshot':
+            # Tracked before snapshots existed
+            msg = f"📸 *Snapshot saved for @{username}*\n\n"
+            msg += f"Following: *{current_following}*\n"
+            msg += "New follows and unfollows will be listed from the next check\\."
+            
+            await loading_msg.edit_text(
+                msg,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                reply_markup=create_user_keyboard(username)
+            )
+        
+        elif result['status'] == 'changed':
+            await loading_msg.delete()
+            
+            outbox.send(
+                message.chat_id,
+                format_check_summary(result),
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=create_user_keyboard(username)
+            )
+        
+        else:
+            # No change
+            msg = f"✅ *@{username}* up\\-to\\-date\\!\n\n"
+            msg += f"Following: *{current_following}*\n"
+            msg += "Nothing change\\."
+            
+            await loading_msg.edit_text(
+                msg,
+                parse_mode=ParseMode.MARKDOWN_V2,
+                reply_markup=create_user_keyboard(username)
+            )
+    
+    except Exception as e:
+        count_error('handler:track', e)
+        logger.error(f"Error in track_command: {e}")
+        await loading_msg.edit_text(
+            f"❌ error: {escape_markdown(str(e))}",
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+
+async def run_bulk(message, title, usernames, invalid=(), track_new=True):
+    """Check a list of accounts for a chat with one progress message and a summary"""
+    chat_id = message.chat_id
+    skipped = max(len(usernames) - BULK_MAX_ACCOUNTS, 0)
+    usernames = usernames[:BULK_MAX_ACCOUNTS]
+    
+    progress_msg = await message.reply_text(
+        format_bulk_progress(title, 0, len(usernames), {}),
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+    
+    finished = []
+    last_edit = time.monotonic()
+    
+    async def on_result(result):
+        nonlocal last_edit
+        finished.append(result)
+        
+        # Edit in place, but not faster than Telegram allows
+        if len(finished) < len(usernames) and time.monotonic() - last_edit >= BULK_PROGRESS_INTERVAL:
+            last_edit = time.monotonic()
+            try:
+                await progress_msg.edit_text(
+                    format_bulk_progress(title, len(finished), len(usernames), bulk_counts(finished)),
+                    parse_mode=ParseMode.MARKDOWN_V2
+                )
+            except TelegramError as e:
+                logger.warning(f"Could not update bulk progress: {e}")
+    
+    # Changes go to this chat and every other subscriber as checks finish;
+    # each account holds its chat lock only while it is checked
+    results = await service.check_many(
+        usernames,
+        chat_id=chat_id,
+        track_new=track_new,
+        on_result=on_result
+    )
+    
+    await progress_msg.edit_text(
+        format_bulk_summary(title, results, invalid, skipped),
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+
+async def send_plan(message, usernames):
+    """Reply with the predicted calls and credits of checking usernames now"""
+    loading_msg = await message.reply_text(f"⏳ Planning {len(usernames)} account(s)...")
+    
+    plans, failed, total = await service.plan(usernames[:BULK_MAX_ACCOUNTS])
+    credits = await twitter_api.get_my_credits()
+    remaining = credits['recharge_credits'] + credits['total_bonus_credits'] if credits['success'] else None
+    
+    await loading_msg.edit_text(
+        format_plan(plans, failed, total, remaining),
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+
+def dry_run(context):
+    """Drop a --dry-run flag from the command arguments; True if it was there"""
+    args = context.args or []
+    context.args = [arg for arg in args if arg != '--dry-run']
+    return len(context.args) != len(args)
+
+async def plan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /plan command: cost of checking the given users or this chat's users"""
+    usernames, invalid = parse_usernames(' '.join(context.args or []))
+    if not context.args:
+        usernames = service.tracked_usernames(update.effective_chat.id)
+    
+    if not usernames:
+        await update.message.reply_text(
+            "❌ Use format: `/plan [usernames]`\n\nWithout names the users tracked in this chat are planned.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    await send_plan(update.message, usernames)
+
+async def trackmany_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /trackmany command: track a whole list of users"""
+    planning = dry_run(context)
+    usernames, invalid = parse_usernames(' '.join(context.args or []))
+    
+    if not usernames:
+        await update.message.reply_text(
+            "❌ Use format: `/trackmany username1 username2 ...`\n\n"
+            "Names can also be separated by commas or new lines, "
+            "or sent as a .txt / .csv file with /trackmany as its caption "
+            "or in reply to this message.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    if planning:
+        await send_plan(update.message, usernames)
+        return
+    
+    await run_bulk(update.message, 'Tracking accounts', usernames, invalid)
+
+async def checkall_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /checkall command: check every user tracked in this chat"""
+    planning = dry_run(context)
+    usernames = service.tracked_usernames(update.effective_chat.id)
+    
+    if not usernames:
+        await update.message.reply_text(
+            "No users are tracked in this chat yet.\n\nUse `/track username` to start tracking.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    if planning:
+        await send_plan(update.message, usernames)
+        return
+    
+    await run_bulk(update.message, 'Checking accounts', usernames, track_new=False)
+
+def import_caption(message, bot_id):
+    """Words of the /trackmany caption or prompt an upload was sent with, else None
+
+    A list only gets tracked when it was sent as /trackmany: with that
+    as the caption, or in reply to the bot's /trackmany usage message.
+    """
+    words = (message.caption or '').split()
+    if words and words[0].split('@')[0].lower() == '/trackmany':
+        return words[1:]
+    
+    prompt = message.reply_to_message
+    if prompt and prompt.from_user and prompt.from_user.id == bot_id and '/trackmany' in (prompt.text or ''):
+        return words
+    return None
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle a .txt / .csv list of usernames uploaded for /trackmany"""
+    document = update.message.document
+    args = import_caption(update.message, context.bot.id)
+    
+    if args is None:
+        # Files shared in groups for other reasons are left alone
+        if update.effective_chat.type == ChatType.PRIVATE:
+            await update.message.reply_text(
+                "💡 To track the accounts in this file, send it again with `/trackmany` as its caption\.",
+                parse_mode=ParseMode.MARKDOWN_V2
+            )
+        return
+    
+    if document.file_size and document.file_size > BULK_MAX_FILE_SIZE:
+        await update.message.reply_text("❌ File is too large, the limit is 1 MB")
+        return
+    
+    file = await document.get_file()
+    text = (await file.download_as_bytearray()).decode('utf-8', errors='replace')
+    
+    if (document.file_name or '').lower().endswith('.csv'):
+        # Usernames in the first column, without a header row
+        rows = [row[0] for row in csv.reader(io.StringIO(text)) if row]
+        if rows and rows[0].strip().lower() in ('username', 'screen_name', 'handle'):
+            rows = rows[1:]
+        text = '\n'.join(rows)
+    
+    usernames, invalid = parse_usernames(text)
+    if not usernames:
+        await update.message.reply_text("❌ No valid usernames found in the file")
+        return
+    
+    if '--dry-run' in args:
+        await send_plan(update.message, usernames)
+        return
+    
+    await run_bulk(update.message, f"Importing {document.file_name or 'list'}", usernames, invalid)
+
+async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /list command"""
+    users = db.get_chat_users(update.effective_chat.id)
+    msg = format_tracked_users(users)
+    
+    await update.message.reply_text(
+        msg,
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+
+async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /remove command"""
+    if not context.args:
+        await update.message.reply_text(
+            "❌ Use format: `/remove username`\n\nExample: `/remove loxous`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    username = context.args[0].replace('@', '')
+    
+    if await service.unsubscribe(username, update.effective_chat.id):
+        await update.message.reply_text(
+            f"✅ Success delete tracking for @{username}",
+            parse_mode=ParseMode.MARKDOWN
+        )
+    else:
+        await update.message.reply_text(
+            f"❌ User @{username} not found in tracking list",
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /history command: logged follows and unfollows without API calls"""
+    if not context.args:
+        await update.message.reply_text(
+            "❌ Use format: `/history username [since]`\n\n"
+            "Example: `/history loxous 7d` or `/history loxous 2024-05-01`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    username = context.args[0].replace('@', '')
+    
+    subscribed = any(
+        subscription['chat_id'] == update.effective_chat.id
+        for subscription in db.get_subscribers(username)
+    )
+    if not subscribed:
+        await update.message.reply_text(
+            f"❌ User @{username} not found in tracking list",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    since = datetime.now() - timedelta(days=HISTORY_DEFAULT_DAYS)
+    if len(context.args) > 1:
+        since = parse_since(context.args[1])
+        if since is None:
+            await update.message.reply_text(
+                "❌ Use a time like `30m`, `12h`, `7d`, `2w` or a date like `2024-05-01`",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
+    
+    events = db.get_history(username, since=since, limit=HISTORY_MAX_EVENTS)
+    total = db.count_history(username, since) if len(events) == HISTORY_MAX_EVENTS else len(events)
+    
+    for msg in format_history(username, events, since, total=total):
+        outbox.send(
+            update.effective_chat.id,
+            msg,
+            parse_mode=ParseMode.MARKDOWN_V2,
+            disable_web_page_preview=True
+        )
+
+async def trending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /trending command: accounts several tracked users followed, from the co-follow index"""
+    since = parse_since(context.args[0] if context.args else TRENDING_DEFAULT_WINDOW)
+    if since is None:
+        await update.message.reply_text(
+            "❌ Use a time like `30m`, `12h`, `7d`, `2w` or a date like `2024-05-01`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    for msg in format_trending(db.get_trending(since), since):
+        outbox.send(
+            update.effective_chat.id,
+            msg,
+            parse_mode=ParseMode.MARKDOWN_V2,
+            disable_web_page_preview=True
+        )
+
+async def credits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /credits command"""
+    loading_msg = await update.message.reply_text("⏳ Checking credits...")
+    
+    result = await twitter_api.get_my_credits()
+    
+    if result['success']:
+        msg = f"💳 *API Credits Information*\n\n"
+        msg += f"💰 Recharge Credits: *{result['recharge_credits']}*\n"
+        msg += f"🎁 Bonus Credits: *{result['total_bonus_credits']}*\n"
+        msg += f"📊 Total Available: *{result['recharge_credits'] + result['total_bonus_credits']}*"
+        
+        await loading_msg.edit_text(
+            msg,
+            parse_mode=ParseMode.MARKDOWN
+        )
+    else:
+        await loading_msg.edit_text(
+            f"❌ Error: {result['error']}",
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+async def traces_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /traces command (admins only): slowest recent requests"""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("❌ This command is for bot admins only")
+        return
+    
+    limit = 10
+    if context.args and context.args[0].isdigit():
+        limit = min(int(context.args[0]), 25)
+    
+    await update.message.reply_text(
+        format_slowest_traces(exporter.slowest(limit)),
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle button callbacks"""
+    query = update.callback_query
+    await query.answer()
+    
+    data = query.data
+    
+    if data.startswith('check_'):
+        username = data.replace('check_', '')
+        # Simulate /track command
+        context.args = [username]
+        await per_account(track_command)(update, context)
+    
+    elif data.startswith('remove_'):
+        username = data.replace('remove_', '')
+        
+        async with service.locks.hold(chat_key(update.effective_chat.id, username)):
+            if await service.unsubscribe(username, update.effective_chat.id):
+                await query.edit_message_text(
+                    f"✅ Success delete tracking for @{username}",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            else:
+                await query.edit_message_text(
+                    f"❌ User @{username} not found",
+                    parse_mode=ParseMode.MARKDOWN
+                )
+
+async def post_init(application: Application):
+    """Start the outbound message queue and the metrics endpoint"""
+    outbox.start(application.bot)
+    
+    OUTBOX_BACKLOG.set_function(outbox.depth)
+    CREDITS_REMAINING.set_function(lambda: twitter_api.dispatcher.remaining_credits)
+    if METRICS_ENABLED:
+        await metrics_server.start()
+
+async def post_shutdown(application: Application):
+    """Stop the outbound queue and metrics endpoint, release pooled API connections and the store"""
+    scheduler.stop()
+    await metrics_server.stop()
+    await outbox.stop()
+    await twitter_api.close()
+    exporter.close()
+    db.close()
+
+async def run_webhook(application: Application):
+    """Serve updates through the embedded webhook server until SIGINT/SIGTERM"""
+    server = WebhookServer(
+        application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+        stats=lambda: dict(scheduler.leases.stats(), **service.locks.stats(), **db.cofollows.stats(), outbox_backlog=outbox.depth())
+    )
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    # run_polling calls the init/shutdown hooks itself, here it's up to us
+    async with application:
+        await post_init(application)
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            allowed_updates=ALLOWED_UPDATES,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            max_connections=CONCURRENT_UPDATES
+        )
+        await application.start()
+        await server.start()
+        
+        await stop.wait()
+        
+        await server.stop()
+        await application.stop()
+    await post_shutdown(application)
+
+async def run_worker(application: Application):
+    """Run background checks and the outbox without receiving updates"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    async with application:
+        await post_init(application)
+        await application.start()
+        
+        await stop.wait()
+        
+        await application.stop()
+    await post_shutdown(application)
+
+def main():
+    """Start the bot"""
+    # Create application
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .request(TracedRequest(connection_pool_size=256))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    
+    # Add handlers
+    application.add_handler(CommandHandler("start", instrumented('start', start_command)))
+    application.add_handler(CommandHandler("help", instrumented('help', help_command)))
+    application.add_handler(CommandHandler("track", instrumented('track', per_account(track_command))))
+    application.add_handler(CommandHandler("list", instrumented('list', list_command)))
+    application.add_handler(CommandHandler("remove", instrumented('remove', per_account(remove_command))))
+    application.add_handler(CommandHandler("trackmany", instrumented('trackmany', trackmany_command)))
+    application.add_handler(CommandHandler("checkall", instrumented('checkall', checkall_command)))
+    application.add_handler(MessageHandler(
+        filters.Document.TXT | filters.Document.FileExtension('csv'),
+        instrumented('import', import_document)
+    ))
+    application.add_handler(CommandHandler("plan", instrumented('plan', plan_command)))
+    application.add_handler(CommandHandler("history", instrumented('history', history_command)))
+    application.add_handler(CommandHandler("trending", instrumented('trending', trending_command)))
+    application.add_handler(CommandHandler("credits", instrumented('credits', credits_command)))
+    application.add_handler(CommandHandler("traces", instrumented('traces', traces_command)))
+    application.add_handler(CallbackQueryHandler(instrumented('button', button_callback)))
+    
+    # Background checks
+    if SCHEDULER_ENABLED:
+        if application.job_queue is None:
+            logger.warning("Job queue unavailable, install python-telegram-bot[job-queue] for background checks")
+        else:
+            scheduler.start(application)
+    
+    # Start bot
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            raise SystemExit("WEBHOOK_URL is required when BOT_MODE=webhook")
+        logger.info(f"Bot started in webhook mode on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        asyncio.run(run_webhook(application))
+    elif BOT_MODE == 'worker':
+        if not SCHEDULER_ENABLED or application.job_queue is None:
+            raise SystemExit("BOT_MODE=worker needs SCHEDULER_ENABLED and the job queue")
+        logger.info(f"Worker {scheduler.leases.worker_id} started")
+        asyncio.run(run_worker(application))
+    else:
+        logger.info("Bot started...")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+if __name__ == '__main__':
+    main()
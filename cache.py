@@ -0,0 +1,131 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Get a live entry, or None on miss"""
+        entry = self.data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.data[key]
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """Store an entry, evicting the least recently used ones"""
+        self.data[key] = (time.monotonic() + self.ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drop an entry"""
+        self.data.pop(key, None)
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+class Feed:
+    """Items of one shared async generator, in the order produced"""
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self.changed = asyncio.Condition()
+
+    async def fill(self, generator):
+        """Drain generator into items, waking consumers on every item"""
+        try:
+            async for item in generator:
+                async with self.changed:
+                    self.items.append(item)
+                    self.changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+class SingleFlight:
+    """Merge concurrent calls with the same key into one in-flight task"""
+
+    def __init__(self):
+        self.calls = {}
+        self.feeds = {}
+        self.merged = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        """Await func(*args, **kwargs), sharing the result with identical calls"""
+        task = self.calls.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.merged += 1
+
+        # One waiter giving up must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def stream(self, key, func, *args, **kwargs):
+        """Iterate the async generator func(*args, **kwargs), sharing it with identical calls
+
+        One producer task drains the generator into a feed, so it keeps
+        fetching while consumers are busy with earlier items. Callers
+        joining late replay the items produced so far.
+        """
+        feed = self.feeds.get(key)
+
+        if feed is None:
+            feed = Feed()
+            self.feeds[key] = feed
+            feed.task = asyncio.ensure_future(feed.fill(func(*args, **kwargs)))
+            feed.task.add_done_callback(lambda done: self._forget_feed(key, feed))
+        else:
+            self.merged += 1
+
+        index = 0
+        while True:
+            async with feed.changed:
+                await feed.changed.wait_for(lambda: index < len(feed.items) or feed.done)
+            if index < len(feed.items):
+                index += 1
+                yield feed.items[index - 1]
+            elif feed.error is not None:
+                raise feed.error
+            else:
+                return
+
+    def _forget_feed(self, key, feed):
+        """Remove a finished feed so the next stream goes upstream again"""
+        if self.feeds.get(key) is feed:
+            del self.feeds[key]
+
+    def _forget(self, key, task):
+        """Remove a finished call so the next one goes upstream again"""
+        if self.calls.get(key) is task:
+            del self.calls[key]
@@ -0,0 +1,110 @@
+"""Run checks without Telegram, for cron jobs and data pipelines
+
+    python -m cli loxous jack          check some tracked users
+    python -m cli --all                check every tracked user
+    python -m cli --track new_user     start tracking (takes a snapshot)
+    python -m cli --all --dry-run      predicted calls and credits only
+
+One JSON object per account is printed to stdout as each check
+finishes. Changes found here stay queued for the subscribed chats and
+are sent with the bot's next check of the account. Exit status is 0
+when every check succeeded, 1 when any failed and 2 on bad usage.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from datetime import datetime
+
+from config import BULK_MAX_CONCURRENT
+from database import create_database
+from ratelimit import PRIORITY_BACKGROUND, request_priority
+from service import CheckService
+from twitter_api import AsyncTwitterAPI
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+logger = logging.getLogger('cli')
+
+def result_record(result):
+    """JSON-ready line for a check result"""
+    record = {key: value for key, value in result.items() if key not in ('user_data', 'unseen')}
+    record['checked_at'] = datetime.now().isoformat()
+    return record
+
+def emit(record, out):
+    """Write one NDJSON line and flush it, so readers see results as they come"""
+    out.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    out.flush()
+
+async def run(args, out=sys.stdout):
+    """Run the checks or plans asked for and return the exit status"""
+    db = create_database()
+    twitter_api = AsyncTwitterAPI()
+    service = CheckService(db, twitter_api)
+
+    try:
+        usernames = service.tracked_usernames() if args.all else args.usernames
+        # Like scheduler checks: queued behind the bot and stopped at the credit reserve
+        request_priority.set(PRIORITY_BACKGROUND)
+
+        if args.dry_run:
+            plans, failed, total = await service.plan(usernames)
+            for plan in plans:
+                emit(dict(plan, success=True), out)
+            for item in failed:
+                emit(dict(item, success=False), out)
+            emit(dict(total, summary=True), out)
+            return EXIT_FAILED if failed else EXIT_OK
+
+        async def on_result(result):
+            emit(result_record(result), out)
+
+        results = await service.check_many(
+            usernames,
+            track_new=args.track,
+            max_concurrent=args.concurrency,
+            on_result=on_result
+        )
+    finally:
+        await twitter_api.close()
+        db.close()
+
+    failed = [result for result in results if not result['success']]
+    logger.info(f"Checked {len(results)} accounts, {len(failed)} failed")
+    return EXIT_FAILED if failed else EXIT_OK
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m cli',
+        description='Check tracked Twitter accounts and print NDJSON results'
+    )
+    parser.add_argument('usernames', nargs='*', help='accounts to check')
+    parser.add_argument('--all', action='store_true', help='check every tracked account')
+    parser.add_argument('--track', action='store_true', help='also start tracking untracked accounts')
+    parser.add_argument('--dry-run', action='store_true', help='print the predicted cost instead of checking')
+    parser.add_argument('--concurrency', type=int, default=BULK_MAX_CONCURRENT, help='checks run at once')
+    parser.add_argument('--verbose', action='store_true', help='log progress to stderr')
+
+    args = parser.parse_args(argv)
+    if args.all == bool(args.usernames):
+        parser.error('give usernames or --all')
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    args.usernames = [username.lstrip('@') for username in args.usernames]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        stream=sys.stderr,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO if args.verbose else logging.WARNING
+    )
+    return asyncio.run(run(args))
+
+if __name__ == '__main__':
+    sys.exit(main())
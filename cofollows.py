@@ -0,0 +1,231 @@
+import bisect
+import fcntl
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import islice
+
+from config import COFOLLOWS_FILE, COFOLLOW_RETENTION_DAYS
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+class CoFollowIndex:
+    """Inverted index from followed Twitter ID to the tracked accounts that followed it
+
+    followers maps each followed ID to {tracked username key: (username,
+    followed_at)}; timeline holds (followed_at, followed ID, username
+    key) oldest first, so a time window is found by bisection and only
+    the follows inside it are looked at. Follows, unfollows and removed
+    accounts are appended to a JSONL log that every process replays from
+    where it stopped. Follows older than retention_days are dropped, and
+    the log is rewritten once it holds more stale lines than live ones.
+    """
+
+    def __init__(self, path=COFOLLOWS_FILE, retention_days=COFOLLOW_RETENTION_DAYS):
+        self.path = path
+        self.retention = timedelta(days=retention_days)
+        self.followers = {}
+        self.timeline = []
+        self.log_key = None
+        self.offset = 0
+        self.lines = 0
+        # Follows in followers, the ones a compacted log would keep
+        self.live = 0
+
+    def cutoff(self):
+        return (datetime.now() - self.retention).isoformat()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def locked(self):
+        """Exclusive lock shared by the processes writing the log"""
+        lock_file = open(f"{self.path}.lock", 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def apply(self, entry, cutoff):
+        """Update the index with one log line; follows before cutoff are skipped"""
+        key = entry.get('account', '').lower()
+        if entry.get('kind') == 'follow':
+            if entry['followed_at'] < cutoff:
+                return
+            followers = self.followers.setdefault(entry['user_id'], {})
+            self.live += key not in followers
+            followers[key] = (entry['account'], entry['followed_at'])
+            item = (entry['followed_at'], entry['user_id'], key)
+            # Processes append in about time order; insort keeps a late line in place
+            if self.timeline and item < self.timeline[-1]:
+                bisect.insort(self.timeline, item)
+            else:
+                self.timeline.append(item)
+        elif entry.get('kind') == 'unfollow':
+            followers = self.followers.get(entry['user_id'], {})
+            self.live -= followers.pop(key, None) is not None
+            if not followers:
+                self.followers.pop(entry['user_id'], None)
+        elif entry.get('kind') == 'removed':
+            for user_id in [user_id for user_id, followers in self.followers.items() if key in followers]:
+                del self.followers[user_id][key]
+                self.live -= 1
+                if not self.followers[user_id]:
+                    del self.followers[user_id]
+
+    def expire(self):
+        """Drop follows older than the retention from memory"""
+        end = bisect.bisect_left(self.timeline, (self.cutoff(),))
+        for followed_at, user_id, key in self.timeline[:end]:
+            followers = self.followers.get(user_id, {})
+            if followers.get(key, (None, None))[1] == followed_at:
+                del followers[key]
+                self.live -= 1
+                if not followers:
+                    del self.followers[user_id]
+        del self.timeline[:end]
+
+    def refresh(self):
+        """Replay log lines written since the last call, from scratch if the log was replaced"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_dev, stat.st_ino) != self.log_key or stat.st_size < self.offset:
+            self.followers, self.timeline, self.live = {}, [], 0
+            self.log_key, self.offset, self.lines = (stat.st_dev, stat.st_ino), 0, 0
+        if stat.st_size == self.offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # A line still being written is read next time
+        data = data[:data.rfind(b'\n') + 1]
+        self.offset += len(data)
+        cutoff = self.cutoff()
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            self.lines += 1
+            try:
+                self.apply(json.loads(line), cutoff)
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Skipping damaged line in {self.path}")
+        self.expire()
+
+    def write(self, entries):
+        """Append log lines and apply them"""
+        if not entries:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        lock_file = self.locked()
+        try:
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        finally:
+            lock_file.close()
+        self.refresh()
+        if self.lines > 1000 and self.lines > 2 * self.live:
+            self.compact()
+
+    @traced('cofollows.add')
+    def add(self, username, events):
+        """Index follow and unfollow events (built by build_events) of a tracked account"""
+        self.write([
+            {
+                'kind': event['kind'],
+                'account': username,
+                'user_id': event['user_id'],
+                'followed_at': event['detected_at']
+            }
+            for event in events
+        ])
+
+    def remove(self, username):
+        """Drop a tracked account from the index"""
+        self.write([{'kind': 'removed', 'account': username}])
+
+    def backfill(self, history, usernames):
+        """Build the index from the follow history of tracked accounts, when it has no log yet"""
+        since = datetime.now() - self.retention
+        entries = []
+        for username in usernames:
+            entries.extend(
+                {'kind': event['kind'], 'account': username,
+                 'user_id': event['user_id'], 'followed_at': event['detected_at']}
+                for event in history.query(username, since=since)
+            )
+        entries.sort(key=lambda entry: entry['followed_at'])
+        # Creates the log even without follows, so this runs once
+        if not entries:
+            open(self.path, 'a').close()
+        self.write(entries)
+        logger.info(f"Indexed {len(entries)} follow events of {len(usernames)} users")
+
+    @traced('cofollows.compact')
+    def compact(self):
+        """Rewrite the log with only the follows still in the index"""
+        lock_file = self.locked()
+        try:
+            self.refresh()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                for followed_at, user_id, key in self.timeline:
+                    account, current = self.followers.get(user_id, {}).get(key, (None, None))
+                    if current == followed_at:
+                        f.write(json.dumps({
+                            'kind': 'follow',
+                            'account': account,
+                            'user_id': user_id,
+                            'followed_at': followed_at
+                        }) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        finally:
+            lock_file.close()
+        self.refresh()
+
+    @traced('cofollows.trending')
+    def trending(self, since, min_accounts=2, limit=None):
+        """Followed IDs with at least min_accounts tracked followers since a time
+
+        Returns [{'user_id', 'followers': [(username, followed_at), ...]}]
+        with the most followed first, then the most recently followed.
+        """
+        self.refresh()
+        since = since.isoformat()
+        start = bisect.bisect_left(self.timeline, (since,))
+        # Timeline items in the window bound each ID's follower count from
+        # above; only IDs that can reach min_accounts are looked up
+        counts = Counter(user_id for _, user_id, _ in islice(self.timeline, start, None))
+
+        results = []
+        for user_id, count in counts.items():
+            if count < min_accounts:
+                continue
+            followers = sorted(
+                (followed_at, account)
+                for account, followed_at in self.followers.get(user_id, {}).values()
+                if followed_at >= since
+            )
+            if len(followers) >= min_accounts:
+                results.append({
+                    'user_id': user_id,
+                    'followers': [(account, followed_at) for followed_at, account in followers]
+                })
+
+        results.sort(key=lambda entry: (len(entry['followers']), entry['followers'][-1][1]), reverse=True)
+        return results[:limit] if limit else results
+
+    def stats(self):
+        """Followed accounts and live follows in the index"""
+        return {
+            'cofollow_accounts': len(self.followers),
+            'cofollow_follows': self.live
+        }
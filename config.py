@@ -1,70 +1,211 @@
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Telegram Bot Configuration
-TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'YOUR_TELEGRAM_BOT_TOKEN')
-
-# Twitter API Configuration
-TWITTER_API_KEY = os.getenv('TWITTER_API_KEY', 'YOUR_TWITTER_API_KEY')
-TWITTER_API_BASE_URL = 'https://api.twitterapi.io'
-
-# Storage Configuration
-DATA_DIR = 'data'
-USERS_DB_FILE = os.path.join(DATA_DIR, 'users.json')
-
-# API Endpoints
-ENDPOINTS = {
-    'user_info': '/twitter/user/info',
-    'user_following': '/twitter/user/followings',
-    'my_info': '/oapi/my/info'
-}
-
-# Bot Messages
-MESSAGES = {
-    'welcome': """
-🤖 *Twitter Tracker Bot*
-
-Welcome! This bot will help you track new followers from your Twitter account.
-
-*Commands:*
-/start - Start the bot
-/track [username] - Track Twitter user
-/list - List all tracked users
-/remove [username] - Remove tracking for a user
-/credits - Check remaining API credits
-/help - Help
-
-*How to use:*
-1. Type `/track twitter_username`
-2. The bot will automatically track every time you check
-3. New follows will be displayed with complete details
-
-Made with ❤️
-""",
-    'help': """
-*📖 User Guide*
-
-*Main Commands:*
-• `/track [username]` - Start tracking a user.
-  Example: `/track loxous`
-
-• `/list` - View a list of tracked users.
-
-• `/remove [username]` - Stop tracking a user.
-  Example: `/remove loxous`
-
-• `/credits` - Check your remaining API credits
-
-*How it works:*
-1. When you first track, the bot will save the following data
-2. When you check a second time, the bot will detect new followers
-3. The bot will automatically fetch the new follower details
-
-*Tips:*
-• The bot only tracks when you make a manual request
-• Make sure the Twitter username is correct (without @)
-• Check periodically for the latest updates
-"""
-}
\ No newline at end of file
+import hashlib
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Telegram Bot Configuration
+TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'YOUR_TELEGRAM_BOT_TOKEN')
+# Updates handled at the same time
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '16'))
+
+# 'polling' (default), 'webhook' with the embedded HTTP server, or
+# 'worker' to run background checks only
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+# Public HTTPS base URL Telegram posts to, e.g. https://bot.example.com
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Must be the same on every instance behind a load balancer; defaults to
+# a value derived from the bot token
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN') or hashlib.sha256(
+    f"webhook:{TELEGRAM_BOT_TOKEN}".encode()
+).hexdigest()[:48]
+
+# Twitter API Configuration
+TWITTER_API_KEY = os.getenv('TWITTER_API_KEY', 'YOUR_TWITTER_API_KEY')
+TWITTER_API_BASE_URL = 'https://api.twitterapi.io'
+
+# HTTP client settings (seconds / connection counts)
+API_TIMEOUT = float(os.getenv('API_TIMEOUT', '30'))
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '10'))
+API_MAX_CONNECTIONS = int(os.getenv('API_MAX_CONNECTIONS', '20'))
+API_MAX_KEEPALIVE = int(os.getenv('API_MAX_KEEPALIVE', '10'))
+
+# API rate limit (requests per second) and credit budget
+API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', '5'))
+API_BURST = int(os.getenv('API_BURST', '10'))
+# Background checks are deferred while remaining credits are below this
+CREDITS_RESERVE = int(os.getenv('CREDITS_RESERVE', '10000'))
+CREDITS_REFRESH_INTERVAL = int(os.getenv('CREDITS_REFRESH_INTERVAL', '300'))
+# twitterapi.io pricing: minimum charge per request, charge per returned profile
+CREDITS_PER_REQUEST = int(os.getenv('CREDITS_PER_REQUEST', '15'))
+CREDITS_PER_PROFILE = int(os.getenv('CREDITS_PER_PROFILE', '18'))
+
+# Lookup caches (entries / seconds)
+USER_INFO_CACHE_SIZE = int(os.getenv('USER_INFO_CACHE_SIZE', '1024'))
+USER_INFO_CACHE_TTL = float(os.getenv('USER_INFO_CACHE_TTL', '60'))
+CREDITS_CACHE_TTL = float(os.getenv('CREDITS_CACHE_TTL', '30'))
+
+# Pagination limits for following lists
+FOLLOWING_MAX_PAGES = int(os.getenv('FOLLOWING_MAX_PAGES', '10'))
+SNAPSHOT_MAX_PAGES = int(os.getenv('SNAPSHOT_MAX_PAGES', '25'))
+# Unfinished pagination older than this (seconds) restarts from the top
+CHECKPOINT_MAX_AGE = int(os.getenv('CHECKPOINT_MAX_AGE', '86400'))
+# Checks with an unchanged following count fetch this many newest
+# followings (at least 20) to notice follows offset by unfollows; 0 skips it
+FINGERPRINT_PAGE_SIZE = int(os.getenv('FINGERPRINT_PAGE_SIZE', '20'))
+
+# Storage Configuration
+DATA_DIR = 'data'
+USERS_DB_FILE = os.path.join(DATA_DIR, 'users.json')
+# Changes to users.json (and profiles.json) are appended to a journal and
+# folded back into the file every JSON_COMPACT_EVERY changes, or once the
+# journal has half as many changes as the file has entries if that is later
+USERS_JOURNAL_FILE = os.path.join(DATA_DIR, 'users.journal')
+JSON_COMPACT_EVERY = int(os.getenv('JSON_COMPACT_EVERY', '1000'))
+SQLITE_DB_FILE = os.path.join(DATA_DIR, 'xtracker.db')
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshots')
+CHECKPOINT_DIR = os.path.join(DATA_DIR, 'checkpoints')
+EVENTS_DIR = os.path.join(DATA_DIR, 'events')
+PROFILES_DB_FILE = os.path.join(DATA_DIR, 'profiles.json')
+PROFILES_JOURNAL_FILE = os.path.join(DATA_DIR, 'profiles.journal')
+# Seconds before a stored profile of a followed account is replaced by a
+# newer copy; profiles rendered as list entries are cached in memory
+PROFILE_REFRESH_AGE = int(os.getenv('PROFILE_REFRESH_AGE', '86400'))
+PROFILE_RENDER_CACHE_SIZE = int(os.getenv('PROFILE_RENDER_CACHE_SIZE', '4096'))
+HISTORY_DIR = os.path.join(DATA_DIR, 'history')
+# Events per history segment file; /history defaults (days, events shown)
+HISTORY_SEGMENT_EVENTS = int(os.getenv('HISTORY_SEGMENT_EVENTS', '5000'))
+HISTORY_DEFAULT_DAYS = int(os.getenv('HISTORY_DEFAULT_DAYS', '7'))
+HISTORY_MAX_EVENTS = int(os.getenv('HISTORY_MAX_EVENTS', '200'))
+COFOLLOWS_FILE = os.path.join(DATA_DIR, 'cofollows.jsonl')
+# Days of follows kept in the co-follow index; /trending defaults (window,
+# tracked users that must follow an account, accounts shown)
+COFOLLOW_RETENTION_DAYS = int(os.getenv('COFOLLOW_RETENTION_DAYS', '30'))
+TRENDING_DEFAULT_WINDOW = os.getenv('TRENDING_DEFAULT_WINDOW', '24h')
+TRENDING_MIN_ACCOUNTS = int(os.getenv('TRENDING_MIN_ACCOUNTS', '2'))
+TRENDING_MAX_RESULTS = int(os.getenv('TRENDING_MAX_RESULTS', '20'))
+# 'sqlite' (default) or 'json' for the legacy users.json store
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite').lower()
+
+# Background checks (seconds)
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+SCHEDULER_TICK = int(os.getenv('SCHEDULER_TICK', '60'))
+SCHEDULER_MAX_CONCURRENT = int(os.getenv('SCHEDULER_MAX_CONCURRENT', '5'))
+CHECK_INTERVAL_DEFAULT = int(os.getenv('CHECK_INTERVAL_DEFAULT', '3600'))
+CHECK_INTERVAL_MIN = int(os.getenv('CHECK_INTERVAL_MIN', '900'))
+CHECK_INTERVAL_MAX = int(os.getenv('CHECK_INTERVAL_MAX', '86400'))
+CHECK_JITTER = float(os.getenv('CHECK_JITTER', '0.1'))
+
+# Several processes can share the storage; background checks are split
+# between them with leases (seconds). A fixed WORKER_ID lets a restarted
+# worker take its leases back at once instead of waiting for them to expire
+WORKER_ID = os.getenv('WORKER_ID') or None
+LEASE_TTL = int(os.getenv('LEASE_TTL', str(SCHEDULER_TICK * 3)))
+WORKER_TTL = int(os.getenv('WORKER_TTL', str(SCHEDULER_TICK * 3)))
+
+# Bulk commands (/trackmany, /checkall, list uploads): accounts per
+# request, checks in parallel, seconds between progress message edits
+BULK_MAX_ACCOUNTS = int(os.getenv('BULK_MAX_ACCOUNTS', '1000'))
+BULK_MAX_CONCURRENT = int(os.getenv('BULK_MAX_CONCURRENT', '5'))
+BULK_PROGRESS_INTERVAL = float(os.getenv('BULK_PROGRESS_INTERVAL', '3'))
+BULK_MAX_FILE_SIZE = 1024 * 1024
+
+# Outbound Telegram messages (flood limits)
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '25'))
+OUTBOX_CHAT_INTERVAL = float(os.getenv('OUTBOX_CHAT_INTERVAL', '1'))
+OUTBOX_GROUP_INTERVAL = float(os.getenv('OUTBOX_GROUP_INTERVAL', '3'))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Request tracing: finished traces go to TRACE_DIR/traces.jsonl, rotated at
+# TRACE_FILE_MAX_BYTES; the last TRACE_RECENT stay in memory for /traces
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+TRACE_DIR = os.path.join(DATA_DIR, 'traces')
+TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', str(5 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.getenv('TRACE_FILE_BACKUPS', '3'))
+TRACE_RECENT = int(os.getenv('TRACE_RECENT', '500'))
+
+# Telegram user IDs allowed to use admin commands (comma separated)
+ADMIN_USER_IDS = {int(i) for i in os.getenv('ADMIN_USER_IDS', '').split(',') if i.strip()}
+
+# Prometheus metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# API Endpoints
+ENDPOINTS = {
+    'user_info': '/twitter/user/info',
+    'user_following': '/twitter/user/followings',
+    'my_info': '/oapi/my/info'
+}
+
+# Bot Messages
+MESSAGES = {
+    'welcome': """
+🤖 *Twitter Tracker Bot*
+
+Welcome! This bot will help you track new followers from your Twitter account.
+
+*Commands:*
+/start - Start the bot
+/track [username] - Track Twitter user
+/list - List users tracked in this chat
+/remove [username] - Stop tracking a user in this chat
+/history [username] [since] - Logged follows and unfollows
+/trending [window] - Accounts followed by several tracked users
+/trackmany [usernames] - Track many users at once
+/checkall - Check every user tracked in this chat
+/plan [usernames] - API calls and credits a check would cost
+/credits - Check remaining API credits
+/help - Help
+
+*How to use:*
+1. Type `/track twitter_username`
+2. The bot will automatically track every time you check
+3. New follows will be displayed with complete details
+
+Made with ❤️
+""",
+    'help': """
+*📖 User Guide*
+
+*Main Commands:*
+• `/track [username]` - Start tracking a user.
+  Example: `/track loxous`
+
+• `/list` - View the users tracked in this chat.
+
+• `/remove [username]` - Stop tracking a user in this chat.
+  Example: `/remove loxous`
+
+• `/trackmany [usernames]` - Track a list of users separated by spaces, commas or new lines. You can also send a .txt or .csv file with one username per line.
+  Example: `/trackmany loxous elonmusk jack`
+
+• `/checkall` - Check every user tracked in this chat and get one summary.
+
+• `/plan [usernames]` - Predict the API calls and credits of checking these users (or this chat's users) without checking them. `/checkall --dry-run` and `/trackmany ... --dry-run` do the same.
+
+• `/history [username] [since]` - Follows and unfollows detected so far, without using credits.
+  Example: `/history loxous 7d` or `/history loxous 2024-05-01`
+
+• `/trending [window]` - Accounts that several tracked users started following in the window (default 24h), without using credits.
+  Example: `/trending 12h` or `/trending 7d`
+
+• `/credits` - Check your remaining API credits
+
+*How it works:*
+1. When you first track, the bot will save the following data
+2. When you check a second time, the bot will detect new follows and unfollows
+3. The bot will automatically fetch the new follower details
+
+*Tips:*
+• The bot also re-checks tracked users in the background and sends changes to every chat tracking them
+• Several chats can track the same user; each one is shown the changes it has not seen yet
+• Active accounts are checked more often than quiet ones
+• Make sure the Twitter username is correct (without @)
+• Check periodically for the latest updates
+"""
+}
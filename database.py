@@ -1,100 +1,1388 @@
-import json
-import os
-from datetime import datetime
-from config import DATA_DIR, USERS_DB_FILE
-
-class Database:
-    def __init__(self):
-        self.ensure_data_dir()
-        self.ensure_db_file()
-    
-    def ensure_data_dir(self):
-        """Create data directory if not exists"""
-        if not os.path.exists(DATA_DIR):
-            os.makedirs(DATA_DIR)
-    
-    def ensure_db_file(self):
-        """Create database file if not exists"""
-        if not os.path.exists(USERS_DB_FILE):
-            with open(USERS_DB_FILE, 'w') as f:
-                json.dump({}, f)
-    
-    def load_data(self):
-        """Load all data from JSON file"""
-        try:
-            with open(USERS_DB_FILE, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading data: {e}")
-            return {}
-    
-    def save_data(self, data):
-        """Save data to JSON file"""
-        try:
-            with open(USERS_DB_FILE, 'w') as f:
-                json.dump(data, f, indent=2)
-            return True
-        except Exception as e:
-            print(f"Error saving data: {e}")
-            return False
-    
-    def get_user(self, username):
-        """Get user data by username"""
-        data = self.load_data()
-        return data.get(username.lower())
-    
-    def save_user(self, username, user_info, following_count):
-        """Save or update user data"""
-        data = self.load_data()
-        username_lower = username.lower()
-        
-        now = datetime.now().isoformat()
-        
-        if username_lower not in data:
-            # First time tracking
-            data[username_lower] = {
-                'username': username,
-                'user_info': user_info,
-                'following_count': following_count,
-                'last_following_count': following_count,
-                'first_tracked': now,
-                'last_checked': now,
-                'check_count': 1
-            }
-        else:
-            # Update existing user
-            data[username_lower]['user_info'] = user_info
-            data[username_lower]['last_following_count'] = data[username_lower]['following_count']
-            data[username_lower]['following_count'] = following_count
-            data[username_lower]['last_checked'] = now
-            data[username_lower]['check_count'] = data[username_lower].get('check_count', 0) + 1
-        
-        self.save_data(data)
-        return data[username_lower]
-    
-    def remove_user(self, username):
-        """Remove user from tracking"""
-        data = self.load_data()
-        username_lower = username.lower()
-        
-        if username_lower in data:
-            del data[username_lower]
-            self.save_data(data)
-            return True
-        return False
-    
-    def get_all_users(self):
-        """Get all tracked users"""
-        data = self.load_data()
-        return list(data.values())
-    
-    def get_following_difference(self, username):
-        """Get difference in following count"""
-        user = self.get_user(username)
-        if not user:
-            return 0
-        
-        current = user.get('following_count', 0)
-        last = user.get('last_following_count', 0)
-        
-        return current - last
\ No newline at end of file
+import bisect
+import copy
+import fcntl
+import json
+import logging
+import os
+from array import array
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from config import (
+    DATA_DIR,
+    USERS_DB_FILE,
+    USERS_JOURNAL_FILE,
+    JSON_COMPACT_EVERY,
+    SQLITE_DB_FILE,
+    SNAPSHOT_DIR,
+    CHECKPOINT_DIR,
+    EVENTS_DIR,
+    PROFILES_DB_FILE,
+    PROFILES_JOURNAL_FILE,
+    PROFILE_REFRESH_AGE,
+    TRENDING_MIN_ACCOUNTS,
+    TRENDING_MAX_RESULTS,
+    STORAGE_BACKEND
+)
+from cofollows import CoFollowIndex
+from history import FollowHistory
+from metrics import DB_SECONDS, count_error
+from profiles import project_profile, refresh_cutoff
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+def pack_ids(ids):
+    """Encode following IDs as a compact array of unsigned 64-bit ints"""
+    return array('Q', ids).tobytes()
+
+def unpack_ids(blob):
+    """Decode following IDs stored by pack_ids"""
+    ids = array('Q')
+    ids.frombytes(blob)
+    return ids.tolist()
+
+def profile_user_id(profile):
+    """Twitter ID of a profile as a string, or None"""
+    if not profile or profile.get('id') is None:
+        return None
+    return str(profile['id'])
+
+def build_user_record(existing, username, user_info, following_count, chat_id=None,
+                      fingerprint=None, partial_snapshot=None):
+    """Build the stored record for a save_user call
+
+    The profile itself goes to the profile store; the record only keeps
+    its ID in user_id. fingerprint, the hash of the newest following
+    IDs, and partial_snapshot, True when the snapshot only holds the
+    newest follows, replace the stored ones when given.
+    """
+    now = datetime.now().isoformat()
+
+    if existing is None:
+        # First time tracking
+        return {
+            'username': username,
+            'user_id': profile_user_id(user_info),
+            'following_count': following_count,
+            'last_following_count': following_count,
+            'first_tracked': now,
+            'last_checked': now,
+            'check_count': 1,
+            'chat_id': chat_id,
+            'fingerprint': fingerprint,
+            'partial_snapshot': bool(partial_snapshot)
+        }
+
+    # Update existing user
+    record = dict(existing)
+    record.pop('user_info', None)
+    record['user_id'] = profile_user_id(user_info) or existing.get('user_id')
+    record['last_following_count'] = existing['following_count']
+    record['following_count'] = following_count
+    record['last_checked'] = now
+    record['check_count'] = existing.get('check_count', 0) + 1
+    if chat_id is not None:
+        record['chat_id'] = chat_id
+    if fingerprint is not None:
+        record['fingerprint'] = fingerprint
+    if partial_snapshot is not None:
+        record['partial_snapshot'] = partial_snapshot
+    return record
+
+def build_events(new_followings, unfollowed_ids):
+    """Follow/unfollow event dicts (without seq) for detected changes"""
+    now = datetime.now().isoformat()
+    events = [
+        {'kind': 'follow', 'user_id': str(profile.get('id')), 'profile': profile, 'detected_at': now}
+        for profile in new_followings
+    ]
+    events += [
+        {'kind': 'unfollow', 'user_id': str(user_id), 'profile': None, 'detected_at': now}
+        for user_id in unfollowed_ids
+    ]
+    return events
+
+def record_subscribers(record):
+    """Subscribers of a JSON user record, keyed by chat ID string
+
+    Records saved before subscriptions existed only know the chat that
+    tracked them.
+    """
+    if 'subscribers' in record:
+        return record['subscribers']
+    if record.get('chat_id') is not None:
+        return {str(record['chat_id']): {'subscribed_at': record.get('first_tracked'), 'last_seen_seq': 0}}
+    return {}
+
+def apply_journal(records, text, path=USERS_JOURNAL_FILE):
+    """Apply journal lines (users.journal by default) to records in order; returns how many were applied
+
+    Each line replaces one record, or removes it when record is null.
+    Lines that do not parse, like one cut short by a crash, are skipped.
+    """
+    applied = 0
+    for line in text.splitlines():
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            if line.strip():
+                logger.warning(f"Skipping damaged line in {path}")
+            continue
+        if entry['record'] is None:
+            records.pop(entry['key'], None)
+        else:
+            records[entry['key']] = entry['record']
+        applied += 1
+    return applied
+
+def read_journaled(path, journal_path):
+    """Records of a JSON store with its journal applied"""
+    records = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            records = json.load(f)
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r') as f:
+            apply_journal(records, f.read(), journal_path)
+    return records
+
+def file_key(path):
+    """Identity of a file's current contents (inode, mtime, size), or None if missing"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+class JournaledFile:
+    """JSON object file kept in memory, with changes appended to a journal
+
+    The file is only read again when it is replaced; journal lines
+    written since are replayed on top of it. Once the journal holds
+    compact_every changes, or half as many as there are records if that
+    is more, it is folded back into the file (temporary file, fsync,
+    atomic rename). A crash can at most lose a journal line that was
+    being written. Callers hold the lock of the store around every call.
+    """
+
+    def __init__(self, path, journal_path, compact_every, indent=None):
+        self.path = path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.indent = indent
+        self.records = {}
+        self.records_key = None
+        self.journal_offset = 0
+        self.journal_entries = 0
+
+    def refresh(self):
+        """Catch up with the file and the journal; two stat calls when nothing changed"""
+        key = file_key(self.path)
+        journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+
+        if key != self.records_key or journal_size < self.journal_offset:
+            try:
+                with DB_SECONDS.time(backend='json', operation='load'), open(self.path, 'r') as f:
+                    self.records = json.load(f)
+            except FileNotFoundError:
+                self.records = {}
+            except Exception as e:
+                count_error('database', e)
+                logger.error(f"Error loading {self.path}: {e}")
+                self.records = {}
+            self.records_key = key
+            self.journal_offset = 0
+            self.journal_entries = 0
+
+        if journal_size > self.journal_offset:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self.journal_offset)
+                text = f.read()
+            # A line still being written is picked up next time
+            complete = text[:text.rfind(b'\n') + 1]
+            self.journal_entries += apply_journal(self.records, complete.decode(), self.journal_path)
+            self.journal_offset += len(complete)
+
+    def append(self, changes):
+        """Append {key: record, or None to remove it} to the journal and apply it"""
+        self.refresh()
+        lines = ''.join(
+            json.dumps({'key': key, 'record': record}) + '\n' for key, record in changes.items()
+        )
+        with DB_SECONDS.time(backend='json', operation='save'):
+            with open(self.journal_path, 'ab') as f:
+                if f.tell() > self.journal_offset:
+                    # End the line a crashed writer left unfinished
+                    lines = '\n' + lines
+                f.write(lines.encode())
+                self.journal_offset = f.tell()
+
+        self.journal_entries += apply_journal(self.records, lines, self.journal_path)
+        if self.journal_entries >= max(self.compact_every, len(self.records) // 2):
+            self.compact()
+
+    def compact(self):
+        """Write the records to the file and empty the journal"""
+        with DB_SECONDS.time(backend='json', operation='compact'):
+            with open(f"{self.path}.tmp", 'w') as f:
+                json.dump(self.records, f, indent=self.indent)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{self.path}.tmp", self.path)
+            # Make the rename itself durable before the journal goes
+            directory = os.open(os.path.dirname(self.path) or '.', os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+            open(self.journal_path, 'w').close()
+
+        self.records_key = file_key(self.path)
+        self.journal_offset = 0
+        self.journal_entries = 0
+
+    def replace(self, data):
+        """Replace every record with data"""
+        self.records = data
+        self.compact()
+
+class BaseDatabase:
+    """Behaviour shared by every storage backend
+
+    Profiles of tracked and followed accounts are kept once per Twitter
+    ID in a shared profile store (save_profiles / get_profiles). User
+    records and follow events only point at them by ID; get_user and the
+    event getters fill the profiles back in. Follows of every tracked
+    user also go to a shared co-follow index for get_trending.
+    """
+
+    def ensure_data_dir(self):
+        """Create data directory if not exists"""
+        if not os.path.exists(DATA_DIR):
+            os.makedirs(DATA_DIR)
+
+    def with_profile(self, record):
+        """User record with user_info filled in from the profile store"""
+        if record is None or not record.get('user_id'):
+            return record
+        profile = self.get_profiles([record['user_id']]).get(record['user_id'])
+        return dict(record, user_info=profile) if profile else record
+
+    def hydrate_events(self, events):
+        """Fill in event profiles from the profile store, in place"""
+        missing = [event['user_id'] for event in events if not event.get('profile')]
+        if missing:
+            profiles = self.get_profiles(missing)
+            for event in events:
+                if not event.get('profile'):
+                    event['profile'] = profiles.get(event['user_id'])
+        return events
+
+    @traced('db.get_history')
+    def get_history(self, username, since=None, until=None, limit=None):
+        """Logged follow events of a user in a time range, oldest first"""
+        return self.history.query(username, since, until, limit)
+
+    @traced('db.count_history')
+    def count_history(self, username, since=None):
+        """Number of logged follow events of a user, since a time if given"""
+        return self.history.count(username, since)
+
+    def open_cofollows(self):
+        """Co-follow index, built from the follow history the first time"""
+        cofollows = CoFollowIndex()
+        if not cofollows.exists():
+            cofollows.backfill(self.history, [user['username'] for user in self.get_all_users()])
+        return cofollows
+
+    @traced('db.get_trending')
+    def get_trending(self, since, min_accounts=TRENDING_MIN_ACCOUNTS, limit=TRENDING_MAX_RESULTS):
+        """Accounts followed by at least min_accounts tracked users since a time, most followed first"""
+        trending = self.cofollows.trending(since, min_accounts, limit)
+        profiles = self.get_profiles([entry['user_id'] for entry in trending])
+        for entry in trending:
+            entry['profile'] = profiles.get(entry['user_id'])
+        return trending
+
+    @traced('db.get_following_difference')
+    def get_following_difference(self, username):
+        """Get difference in following count"""
+        user = self.get_user(username)
+        if not user:
+            return 0
+
+        current = user.get('following_count', 0)
+        last = user.get('last_following_count', 0)
+
+        return current - last
+
+class Database(BaseDatabase):
+    """Legacy store keeping every user in a single JSON file
+
+    users.json and profiles.json are JournaledFiles: records stay in
+    memory, changes go to users.journal and profiles.journal, and the
+    journals are folded back into the files from time to time. Workers
+    sharing the files take turns through a lock file; changes that read
+    a record first hold it exclusively from read to write.
+    """
+
+    def __init__(self, compact_every=JSON_COMPACT_EVERY):
+        self.ensure_data_dir()
+        self.ensure_db_file()
+        self.lock_file = open(os.path.join(DATA_DIR, 'users.lock'), 'a')
+        self.lock_depth = 0
+        self.users = JournaledFile(USERS_DB_FILE, USERS_JOURNAL_FILE, compact_every, indent=2)
+        self.profiles = JournaledFile(PROFILES_DB_FILE, PROFILES_JOURNAL_FILE, compact_every)
+        # Line offsets of the event logs by seq, per lowercase username
+        self.event_indexes = {}
+        self.history = FollowHistory()
+        self.cofollows = self.open_cofollows()
+
+    def ensure_db_file(self):
+        """Create database file if not exists"""
+        if not os.path.exists(USERS_DB_FILE):
+            with open(USERS_DB_FILE, 'w') as f:
+                json.dump({}, f)
+
+    @contextmanager
+    def locked(self, operation=fcntl.LOCK_SH):
+        """Hold the lock shared by every process using the JSON files
+
+        Nested calls keep the lock taken by the outermost one, so take
+        LOCK_EX outside when the block writes.
+        """
+        if self.lock_depth:
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+            return
+
+        fcntl.flock(self.lock_file, operation)
+        self.lock_depth = 1
+        try:
+            yield
+        finally:
+            self.lock_depth = 0
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def exclusive(self):
+        """Keep other workers out of the store for the with block
+
+        Reads and writes inside see and change the store as one step.
+        """
+        return self.locked(fcntl.LOCK_EX)
+
+    def close(self):
+        """Fold pending journal lines into users.json and profiles.json, release the lock file"""
+        with self.locked(fcntl.LOCK_EX):
+            for store in (self.users, self.profiles):
+                store.refresh()
+                if store.journal_entries:
+                    store.compact()
+        self.lock_file.close()
+
+    def load_data(self):
+        """All records keyed by lowercase username
+
+        This is the in-memory copy: change records through write_records,
+        never in place.
+        """
+        with self.locked():
+            self.users.refresh()
+        return self.users.records
+
+    def get_record(self, username):
+        """Copy of one record that may be changed and written back, or None"""
+        record = self.load_data().get(username.lower())
+        return copy.deepcopy(record) if record is not None else None
+
+    def write_records(self, changes):
+        """Append {key: record, or None to remove it} to the journal and apply it"""
+        try:
+            with self.locked(fcntl.LOCK_EX):
+                self.users.append(changes)
+            return True
+        except Exception as e:
+            count_error('database', e)
+            logger.error(f"Error saving data: {e}")
+            return False
+
+    def save_data(self, data):
+        """Replace every record with data"""
+        try:
+            with self.locked(fcntl.LOCK_EX):
+                self.users.replace(data)
+            return True
+        except Exception as e:
+            count_error('database', e)
+            logger.error(f"Error saving data: {e}")
+            return False
+
+    def snapshot_path(self, username):
+        """Path of the following-ID snapshot file for a user"""
+        return os.path.join(SNAPSHOT_DIR, f"{username.lower()}.bin")
+
+    def load_profiles(self):
+        """Stored profiles keyed by Twitter ID, with their update time (the in-memory copy)"""
+        with self.locked():
+            self.profiles.refresh()
+        return self.profiles.records
+
+    @traced('db.save_profiles')
+    def save_profiles(self, profiles, max_age=PROFILE_REFRESH_AGE):
+        """Store projected profiles, replacing copies older than max_age seconds"""
+        now = datetime.now().isoformat()
+        cutoff = refresh_cutoff(max_age)
+
+        with self.locked(fcntl.LOCK_EX):
+            stored = self.load_profiles()
+            changes = {}
+            for profile in profiles:
+                user_id = profile_user_id(profile)
+                if user_id is None:
+                    continue
+                entry = stored.get(user_id)
+                if entry is None or entry['updated_at'] < cutoff:
+                    changes[user_id] = {'profile': project_profile(profile), 'updated_at': now}
+
+            if changes:
+                try:
+                    self.profiles.append(changes)
+                except Exception as e:
+                    count_error('database', e)
+                    logger.error(f"Error saving profiles: {e}")
+
+    @traced('db.get_profiles')
+    def get_profiles(self, user_ids):
+        """Stored profiles of several Twitter IDs, keyed by ID"""
+        stored = self.load_profiles()
+        return {
+            str(user_id): dict(stored[str(user_id)]['profile'])
+            for user_id in user_ids if str(user_id) in stored
+        }
+
+    @traced('db.get_user')
+    def get_user(self, username):
+        """Get user data by username, with its profile as user_info"""
+        record = self.load_data().get(username.lower())
+        return self.with_profile(dict(record)) if record is not None else None
+
+    @traced('db.get_following_snapshot')
+    def get_following_snapshot(self, username):
+        """Get stored following IDs (newest first), or None without a snapshot"""
+        try:
+            with DB_SECONDS.time(backend='json', operation='load'), open(self.snapshot_path(username), 'rb') as f:
+                return unpack_ids(f.read())
+        except FileNotFoundError:
+            return None
+
+    @traced('db.save_following_snapshot')
+    def save_following_snapshot(self, username, following_ids):
+        """Replace the stored following IDs of a user"""
+        if not os.path.exists(SNAPSHOT_DIR):
+            os.makedirs(SNAPSHOT_DIR)
+        path = self.snapshot_path(username)
+        with DB_SECONDS.time(backend='json', operation='save'):
+            with open(f"{path}.tmp", 'wb') as f:
+                f.write(pack_ids(following_ids))
+            os.replace(f"{path}.tmp", path)
+        # A checkpoint is only valid against the snapshot it started from
+        self.clear_checkpoint(username)
+
+    def checkpoint_path(self, username):
+        """Path of the pagination checkpoint file for a user"""
+        return os.path.join(CHECKPOINT_DIR, f"{username.lower()}.json")
+
+    @traced('db.get_checkpoint')
+    def get_checkpoint(self, username):
+        """Get the unfinished pagination checkpoint of a user, or None"""
+        try:
+            with open(self.checkpoint_path(username), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            count_error('database', e)
+            logger.error(f"Error loading checkpoint: {e}")
+            return None
+
+    @traced('db.save_checkpoint')
+    def save_checkpoint(self, username, checkpoint):
+        """Store the pagination checkpoint of a user"""
+        if not os.path.exists(CHECKPOINT_DIR):
+            os.makedirs(CHECKPOINT_DIR)
+        path = self.checkpoint_path(username)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(f"{path}.tmp", path)
+
+    @traced('db.clear_checkpoint')
+    def clear_checkpoint(self, username):
+        """Drop the pagination checkpoint of a user"""
+        if os.path.exists(self.checkpoint_path(username)):
+            os.remove(self.checkpoint_path(username))
+
+    @traced('db.save_user')
+    def save_user(self, username, user_info, following_count, following_ids=None, chat_id=None,
+                  fingerprint=None, partial_snapshot=None, after_seq=None):
+        """Save or update user data, and its following snapshot when given
+
+        With after_seq nothing is saved, and None returned, unless the
+        user is tracked and its newest event is still after_seq.
+        """
+        username_lower = username.lower()
+
+        if user_info:
+            # Just looked up, so always newer than the stored copy
+            self.save_profiles([user_info], max_age=0)
+
+        with self.locked(fcntl.LOCK_EX):
+            existing = self.get_record(username)
+            if after_seq is not None and (existing is None or existing.get('last_event_seq', 0) != after_seq):
+                return None
+
+            if following_ids is not None:
+                self.save_following_snapshot(username, following_ids)
+            record = build_user_record(
+                existing, username, user_info, following_count, chat_id, fingerprint, partial_snapshot
+            )
+            self.write_records({username_lower: record})
+        return record
+
+    @traced('db.save_schedule')
+    def save_schedule(self, username, check_interval, next_check_at):
+        """Store the background check interval and next due time of a user"""
+        with self.locked(fcntl.LOCK_EX):
+            record = self.get_record(username)
+            if record is None:
+                return False
+
+            record['check_interval'] = check_interval
+            record['next_check_at'] = next_check_at
+            return self.write_records({username.lower(): record})
+
+    @traced('db.remove_user')
+    def remove_user(self, username):
+        """Remove user from tracking"""
+        username_lower = username.lower()
+
+        with self.locked(fcntl.LOCK_EX):
+            if username_lower not in self.load_data():
+                return False
+            self.write_records({username_lower: None})
+            if os.path.exists(self.snapshot_path(username)):
+                os.remove(self.snapshot_path(username))
+            if os.path.exists(self.events_path(username)):
+                os.remove(self.events_path(username))
+            self.event_indexes.pop(username_lower, None)
+            self.clear_checkpoint(username)
+            self.cofollows.remove(username)
+        return True
+
+    @traced('db.get_all_users')
+    def get_all_users(self):
+        """Get all tracked users"""
+        return [dict(record) for record in self.load_data().values()]
+
+    @traced('db.subscribe')
+    def subscribe(self, username, chat_id):
+        """Subscribe a chat to a tracked user; False if already subscribed or not tracked"""
+        with self.locked(fcntl.LOCK_EX):
+            record = self.get_record(username)
+            if record is None:
+                return False
+
+            subscribers = record_subscribers(record)
+            if str(chat_id) in subscribers:
+                return False
+
+            # New subscribers start from now, not from the account's history
+            subscribers[str(chat_id)] = {
+                'subscribed_at': datetime.now().isoformat(),
+                'last_seen_seq': record.get('last_event_seq', 0)
+            }
+            record['subscribers'] = subscribers
+            return self.write_records({username.lower(): record})
+
+    @traced('db.unsubscribe')
+    def unsubscribe(self, username, chat_id):
+        """Remove a chat's subscription; False if it was not subscribed"""
+        with self.locked(fcntl.LOCK_EX):
+            record = self.get_record(username)
+            if record is None:
+                return False
+
+            subscribers = record_subscribers(record)
+            if subscribers.pop(str(chat_id), None) is None:
+                return False
+            record['subscribers'] = subscribers
+            return self.write_records({username.lower(): record})
+
+    @traced('db.get_subscribers')
+    def get_subscribers(self, username):
+        """Subscriptions of a tracked user as dicts with chat_id and last_seen_seq"""
+        record = self.get_user(username)
+        if record is None:
+            return []
+        return [
+            dict(subscription, chat_id=int(chat_id))
+            for chat_id, subscription in record_subscribers(record).items()
+        ]
+
+    @traced('db.get_chat_users')
+    def get_chat_users(self, chat_id):
+        """Tracked users a chat is subscribed to"""
+        return [
+            dict(record) for record in self.load_data().values()
+            if str(chat_id) in record_subscribers(record)
+        ]
+
+    @traced('db.get_subscribed_usernames')
+    def get_subscribed_usernames(self):
+        """Lowercase usernames with at least one subscriber"""
+        return {key for key, record in self.load_data().items() if record_subscribers(record)}
+
+    def events_path(self, username):
+        """Path of the follow event log of a user"""
+        return os.path.join(EVENTS_DIR, f"{username.lower()}.jsonl")
+
+    @traced('db.latest_event_seq')
+    def latest_event_seq(self, username):
+        """Sequence number of the newest event of a user, 0 without events"""
+        record = self.get_user(username)
+        return record.get('last_event_seq', 0) if record else 0
+
+    @traced('db.append_events')
+    def append_events(self, username, new_followings, unfollowed_ids, after_seq=None):
+        """Record detected follows and unfollows; returns the newest sequence number
+
+        With after_seq nothing is recorded, and None returned, unless the
+        user's newest event is still after_seq.
+        """
+        events = build_events(new_followings, unfollowed_ids)
+        if events:
+            self.save_profiles(new_followings)
+
+        # Sequence numbers are handed out under the lock, so workers never share
+        # one, and history and co-follow entries are written in seq order
+        with self.locked(fcntl.LOCK_EX):
+            record = self.get_record(username)
+            if record is None:
+                return 0
+
+            seq = record.get('last_event_seq', 0)
+            if after_seq is not None and seq != after_seq:
+                return None
+            if not events:
+                return seq
+
+            if not os.path.exists(EVENTS_DIR):
+                os.makedirs(EVENTS_DIR)
+            with open(self.events_path(username), 'a') as f:
+                for event in events:
+                    seq += 1
+                    # Profiles live in the profile store
+                    f.write(json.dumps(dict(event, profile=None, seq=seq)) + '\n')
+
+            record['last_event_seq'] = seq
+            self.write_records({username.lower(): record})
+            # Unfollowed accounts seen before get their names in the history too
+            self.history.append(username, self.hydrate_events(events))
+            self.cofollows.add(username, events)
+        return seq
+
+    def event_index(self, username):
+        """Seqs and byte offsets of the lines in a user's event log
+
+        Only lines added since the last call are read, and each of them
+        is parsed once. A log removed and written again by another worker
+        is noticed by its last indexed line no longer being there.
+        """
+        key = username.lower()
+        try:
+            stat = os.stat(self.events_path(username))
+        except FileNotFoundError:
+            self.event_indexes.pop(key, None)
+            return None
+
+        index = self.event_indexes.get(key)
+        if index is None or index['file'] != (stat.st_dev, stat.st_ino) or stat.st_size < index['size']:
+            index = None
+        elif stat.st_size > index['size'] and index['offsets']:
+            with open(self.events_path(username), 'rb') as f:
+                f.seek(index['offsets'][-1])
+                if f.read(len(index['last'])) != index['last']:
+                    index = None
+        if index is None:
+            index = self.event_indexes[key] = {
+                'file': (stat.st_dev, stat.st_ino), 'size': 0, 'seqs': [], 'offsets': [], 'last': b''
+            }
+
+        if stat.st_size > index['size']:
+            with open(self.events_path(username), 'rb') as f:
+                f.seek(index['size'])
+                data = f.read()
+            offset = index['size']
+            # A line still being written is indexed next time
+            for line in data[:data.rfind(b'\n') + 1].splitlines(keepends=True):
+                try:
+                    seq = json.loads(line)['seq']
+                except (ValueError, KeyError, TypeError):
+                    seq = None
+                if seq is not None and (not index['seqs'] or seq > index['seqs'][-1]):
+                    index['seqs'].append(seq)
+                    index['offsets'].append(offset)
+                    index['last'] = line
+                offset += len(line)
+            index['size'] = offset
+        return index
+
+    @traced('db.get_events')
+    def get_events(self, username, after_seq=0, upto_seq=None):
+        """Events of a user with after_seq < seq <= upto_seq, oldest first"""
+        index = self.event_index(username)
+        if index is None:
+            return []
+        start = bisect.bisect_right(index['seqs'], after_seq)
+        end = len(index['seqs']) if upto_seq is None else bisect.bisect_right(index['seqs'], upto_seq)
+        if start >= end:
+            return []
+
+        events = []
+        with open(self.events_path(username), 'rb') as f:
+            f.seek(index['offsets'][start])
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event['seq'] > index['seqs'][end - 1]:
+                    break
+                events.append(event)
+        return self.hydrate_events(events)
+
+    @traced('db.claim_events')
+    def claim_events(self, username, chat_id, upto_seq):
+        """Events a chat has not seen yet, up to upto_seq, moving its cursor past them"""
+        with self.locked(fcntl.LOCK_EX):
+            record = self.get_record(username)
+            if record is None:
+                return []
+
+            subscribers = record_subscribers(record)
+            subscription = subscribers.get(str(chat_id))
+            if subscription is None or subscription['last_seen_seq'] >= upto_seq:
+                return []
+
+            after_seq = subscription['last_seen_seq']
+            subscription['last_seen_seq'] = upto_seq
+            record['subscribers'] = subscribers
+            self.write_records({username.lower(): record})
+        return self.get_events(username, after_seq, upto_seq)
+
+class SQLiteDatabase(BaseDatabase):
+    """SQLite store with one row per tracked user, keyed by lowercase username"""
+
+    USER_COLUMNS = (
+        'username', 'user_info', 'following_count', 'last_following_count',
+        'first_tracked', 'last_checked', 'check_count', 'chat_id',
+        'check_interval', 'next_check_at', 'user_id', 'fingerprint', 'partial_snapshot'
+    )
+
+    # Columns added after the first release, created on open if missing
+    ADDED_USER_COLUMNS = {
+        'chat_id': 'INTEGER',
+        'check_interval': 'REAL',
+        'next_check_at': 'TEXT',
+        'user_id': 'TEXT',
+        'fingerprint': 'TEXT',
+        'partial_snapshot': 'INTEGER'
+    }
+
+    def __init__(self, path=SQLITE_DB_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.transaction_depth = 0
+        self.ensure_data_dir()
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.create_schema()
+        self.migrate_from_json()
+        self.migrate_subscriptions()
+        self.history = FollowHistory()
+        self.cofollows = self.open_cofollows()
+
+    def create_schema(self):
+        """Create tables if not exists"""
+        with self.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    username_key TEXT PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    user_info TEXT,
+                    following_count INTEGER NOT NULL DEFAULT 0,
+                    last_following_count INTEGER NOT NULL DEFAULT 0,
+                    first_tracked TEXT,
+                    last_checked TEXT,
+                    check_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(users)")}
+            for column, column_type in self.ADDED_USER_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE users ADD COLUMN {column} {column_type}")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS following_snapshots (
+                    username_key TEXT PRIMARY KEY,
+                    following_ids BLOB NOT NULL,
+                    updated_at TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pagination_checkpoints (
+                    username_key TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    username_key TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    subscribed_at TEXT,
+                    last_seen_seq INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (username_key, chat_id)
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS subscriptions_chat ON subscriptions (chat_id)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS follow_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username_key TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    user_id TEXT NOT NULL,
+                    profile TEXT,
+                    detected_at TEXT NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS follow_events_user ON follow_events (username_key, seq)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS profiles (
+                    user_id TEXT PRIMARY KEY,
+                    profile TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in a single write transaction
+
+        Nested calls join the outermost transaction.
+        """
+        with self.lock:
+            if self.transaction_depth:
+                self.transaction_depth += 1
+                try:
+                    yield self.conn
+                finally:
+                    self.transaction_depth -= 1
+                return
+
+            with DB_SECONDS.time(backend='sqlite', operation='save'):
+                self.conn.execute('BEGIN IMMEDIATE')
+                self.transaction_depth = 1
+                try:
+                    yield self.conn
+                except BaseException as e:
+                    self.conn.execute('ROLLBACK')
+                    count_error('database', e)
+                    raise
+                finally:
+                    self.transaction_depth = 0
+                self.conn.execute('COMMIT')
+
+    def exclusive(self):
+        """Keep other workers out of the store for the with block
+
+        Reads and writes inside see and change the store as one step.
+        """
+        return self.transaction()
+
+    def query(self, sql, params=()):
+        """Run a read-only query and return all rows"""
+        with self.lock, DB_SECONDS.time(backend='sqlite', operation='load'):
+            return self.conn.execute(sql, params).fetchall()
+
+    def migrate_from_json(self):
+        """Import the JSON backend's stores once, the first time the SQLite store is opened
+
+        Users with their subscriptions, profiles, following snapshots,
+        pagination checkpoints and follow events are copied. Events get
+        new sequence numbers, and every subscription cursor is moved to
+        the new number of the last event it had seen. The follow history
+        and the co-follow index are shared by both backends already.
+        """
+        with self.transaction() as conn:
+            done = conn.execute(
+                "SELECT value FROM meta WHERE key = 'json_migrated'"
+            ).fetchone()
+            if done or not os.path.exists(USERS_DB_FILE):
+                return
+
+            try:
+                # Journals hold changes not compacted into the files yet
+                data = read_journaled(USERS_DB_FILE, USERS_JOURNAL_FILE)
+                profiles = read_journaled(PROFILES_DB_FILE, PROFILES_JOURNAL_FILE)
+            except Exception as e:
+                logger.error(f"Error migrating {USERS_DB_FILE}: {e}")
+                return
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO profiles (user_id, profile, updated_at) VALUES (?, ?, ?)",
+                [(user_id, json.dumps(entry['profile']), entry['updated_at']) for user_id, entry in profiles.items()]
+            )
+
+            event_count = 0
+            for key, record in data.items():
+                user_id = profile_user_id(record.get('user_info'))
+                if user_id:
+                    self._write_profiles(conn, [record['user_info']])
+                    record = dict(record, user_id=user_id)
+                self._write_user(conn, key, record)
+
+                snapshot_path = os.path.join(SNAPSHOT_DIR, f"{key}.bin")
+                if os.path.exists(snapshot_path):
+                    with open(snapshot_path, 'rb') as f:
+                        self._write_snapshot(conn, key, unpack_ids(f.read()))
+
+                checkpoint_path = os.path.join(CHECKPOINT_DIR, f"{key}.json")
+                if os.path.exists(checkpoint_path):
+                    with open(checkpoint_path, 'r') as f:
+                        state = f.read()
+                    conn.execute("""
+                        INSERT OR REPLACE INTO pagination_checkpoints (username_key, state, updated_at)
+                        VALUES (?, ?, ?)
+                    """, (key, state, datetime.now().isoformat()))
+
+                # Old sequence number -> new one, in order
+                seqs = []
+                events_path = os.path.join(EVENTS_DIR, f"{key}.jsonl")
+                if os.path.exists(events_path):
+                    with open(events_path, 'r') as f:
+                        for line in f:
+                            try:
+                                event = json.loads(line)
+                            except ValueError:
+                                logger.warning(f"Skipping damaged line in {events_path}")
+                                continue
+                            cursor = conn.execute("""
+                                INSERT INTO follow_events (username_key, kind, user_id, profile, detected_at)
+                                VALUES (?, ?, ?, ?, ?)
+                            """, (
+                                key, event['kind'], event['user_id'],
+                                json.dumps(event['profile']) if event.get('profile') else None,
+                                event['detected_at']
+                            ))
+                            seqs.append((event['seq'], cursor.lastrowid))
+                event_count += len(seqs)
+
+                for chat_id, subscription in record_subscribers(record).items():
+                    index = bisect.bisect_right(seqs, (subscription['last_seen_seq'], float('inf')))
+                    conn.execute("""
+                        INSERT OR IGNORE INTO subscriptions (username_key, chat_id, subscribed_at, last_seen_seq)
+                        VALUES (?, ?, ?, ?)
+                    """, (key, int(chat_id), subscription.get('subscribed_at'), seqs[index - 1][1] if index else 0))
+
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.now().isoformat(),)
+            )
+            # Subscriptions came from the JSON records; chat_id may be stale there
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('subscriptions_migrated', ?)",
+                (datetime.now().isoformat(),)
+            )
+
+        logger.info(
+            f"Migrated {len(data)} users, {len(profiles)} profiles and {event_count} events from JSON"
+        )
+
+    def migrate_subscriptions(self):
+        """Subscribe the chat stored on each user row, once, when subscriptions are introduced"""
+        with self.transaction() as conn:
+            done = conn.execute(
+                "SELECT value FROM meta WHERE key = 'subscriptions_migrated'"
+            ).fetchone()
+            if done:
+                return
+
+            conn.execute("""
+                INSERT OR IGNORE INTO subscriptions (username_key, chat_id, subscribed_at, last_seen_seq)
+                SELECT username_key, chat_id, first_tracked, 0 FROM users WHERE chat_id IS NOT NULL
+            """)
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('subscriptions_migrated', ?)",
+                (datetime.now().isoformat(),)
+            )
+
+    def _row_to_user(self, row):
+        """Convert a users row to the record dict returned by get_user"""
+        if row is None:
+            return None
+        user = {column: row[column] for column in self.USER_COLUMNS}
+        user['user_info'] = json.loads(user['user_info']) if user['user_info'] else None
+        user['partial_snapshot'] = bool(user['partial_snapshot'])
+        return user
+
+    def _write_user(self, conn, key, record):
+        """Insert or update one users row"""
+        row = {
+            'username': record.get('username', key),
+            # Only records from before the profile store keep it inline
+            'user_info': json.dumps(record['user_info']) if record.get('user_info') and not record.get('user_id') else None,
+            'following_count': record.get('following_count', 0),
+            'last_following_count': record.get('last_following_count', 0),
+            'first_tracked': record.get('first_tracked'),
+            'last_checked': record.get('last_checked'),
+            'check_count': record.get('check_count', 0),
+            'chat_id': record.get('chat_id'),
+            'check_interval': record.get('check_interval'),
+            'next_check_at': record.get('next_check_at'),
+            'user_id': record.get('user_id'),
+            'fingerprint': record.get('fingerprint'),
+            'partial_snapshot': int(bool(record.get('partial_snapshot')))
+        }
+        values = [row[column] for column in self.USER_COLUMNS]
+        conn.execute(f"""
+            INSERT INTO users (username_key, {', '.join(self.USER_COLUMNS)})
+            VALUES (?, {', '.join('?' for _ in self.USER_COLUMNS)})
+            ON CONFLICT(username_key) DO UPDATE SET
+            {', '.join(f'{c} = excluded.{c}' for c in self.USER_COLUMNS)}
+        """, [key] + values)
+
+    def _write_profiles(self, conn, profiles, max_age=PROFILE_REFRESH_AGE):
+        """Upsert projected profiles, replacing copies older than max_age seconds"""
+        now = datetime.now().isoformat()
+        cutoff = refresh_cutoff(max_age)
+        conn.executemany("""
+            INSERT INTO profiles (user_id, profile, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                profile = excluded.profile, updated_at = excluded.updated_at
+            WHERE profiles.updated_at < ?
+        """, [
+            (profile_user_id(profile), json.dumps(project_profile(profile)), now, cutoff)
+            for profile in profiles if profile_user_id(profile)
+        ])
+
+    @traced('db.save_profiles')
+    def save_profiles(self, profiles, max_age=PROFILE_REFRESH_AGE):
+        """Store projected profiles, replacing copies older than max_age seconds"""
+        with self.transaction() as conn:
+            self._write_profiles(conn, profiles, max_age)
+
+    @traced('db.get_profiles')
+    def get_profiles(self, user_ids):
+        """Stored profiles of several Twitter IDs, keyed by ID"""
+        user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        profiles = {}
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            rows = self.query(
+                f"SELECT user_id, profile FROM profiles WHERE user_id IN ({', '.join('?' for _ in chunk)})",
+                chunk
+            )
+            profiles.update((row['user_id'], json.loads(row['profile'])) for row in rows)
+        return profiles
+
+    @traced('db.get_user')
+    def get_user(self, username):
+        """Get user data by username, with its profile as user_info"""
+        rows = self.query(
+            "SELECT * FROM users WHERE username_key = ?", (username.lower(),)
+        )
+        return self.with_profile(self._row_to_user(rows[0] if rows else None))
+
+    @traced('db.get_following_snapshot')
+    def get_following_snapshot(self, username):
+        """Get stored following IDs (newest first), or None without a snapshot"""
+        rows = self.query(
+            "SELECT following_ids FROM following_snapshots WHERE username_key = ?",
+            (username.lower(),)
+        )
+        return unpack_ids(rows[0]['following_ids']) if rows else None
+
+    def _write_snapshot(self, conn, key, following_ids):
+        """Insert or replace one following_snapshots row"""
+        conn.execute("""
+            INSERT OR REPLACE INTO following_snapshots (username_key, following_ids, updated_at)
+            VALUES (?, ?, ?)
+        """, (key, pack_ids(following_ids), datetime.now().isoformat()))
+        # A checkpoint is only valid against the snapshot it started from
+        conn.execute("DELETE FROM pagination_checkpoints WHERE username_key = ?", (key,))
+
+    @traced('db.save_following_snapshot')
+    def save_following_snapshot(self, username, following_ids):
+        """Replace the stored following IDs of a user"""
+        with self.transaction() as conn:
+            self._write_snapshot(conn, username.lower(), following_ids)
+
+    @traced('db.get_checkpoint')
+    def get_checkpoint(self, username):
+        """Get the unfinished pagination checkpoint of a user, or None"""
+        rows = self.query(
+            "SELECT state FROM pagination_checkpoints WHERE username_key = ?",
+            (username.lower(),)
+        )
+        return json.loads(rows[0]['state']) if rows else None
+
+    @traced('db.save_checkpoint')
+    def save_checkpoint(self, username, checkpoint):
+        """Store the pagination checkpoint of a user"""
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO pagination_checkpoints (username_key, state, updated_at)
+                VALUES (?, ?, ?)
+            """, (username.lower(), json.dumps(checkpoint), datetime.now().isoformat()))
+
+    @traced('db.clear_checkpoint')
+    def clear_checkpoint(self, username):
+        """Drop the pagination checkpoint of a user"""
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM pagination_checkpoints WHERE username_key = ?", (username.lower(),)
+            )
+
+    @traced('db.save_user')
+    def save_user(self, username, user_info, following_count, following_ids=None, chat_id=None,
+                  fingerprint=None, partial_snapshot=None, after_seq=None):
+        """Save or update user data, and its following snapshot when given
+
+        With after_seq nothing is saved, and None returned, unless the
+        user is tracked and its newest event is still after_seq.
+        """
+        username_lower = username.lower()
+
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM users WHERE username_key = ?", (username_lower,)
+            ).fetchone()
+            if after_seq is not None and (row is None or self._latest_event_seq(conn, username_lower) != after_seq):
+                return None
+            if user_info:
+                # Just looked up, so always newer than the stored copy
+                self._write_profiles(conn, [user_info], max_age=0)
+            record = build_user_record(
+                self._row_to_user(row), username, user_info, following_count, chat_id, fingerprint,
+                partial_snapshot
+            )
+            self._write_user(conn, username_lower, record)
+            if following_ids is not None:
+                self._write_snapshot(conn, username_lower, following_ids)
+
+        return record
+
+    @traced('db.save_schedule')
+    def save_schedule(self, username, check_interval, next_check_at):
+        """Store the background check interval and next due time of a user"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE users SET check_interval = ?, next_check_at = ? WHERE username_key = ?",
+                (check_interval, next_check_at, username.lower())
+            )
+        return cursor.rowcount > 0
+
+    @traced('db.remove_user')
+    def remove_user(self, username):
+        """Remove user from tracking"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM users WHERE username_key = ?", (username.lower(),)
+            )
+            conn.execute(
+                "DELETE FROM following_snapshots WHERE username_key = ?", (username.lower(),)
+            )
+            conn.execute(
+                "DELETE FROM pagination_checkpoints WHERE username_key = ?", (username.lower(),)
+            )
+            conn.execute(
+                "DELETE FROM subscriptions WHERE username_key = ?", (username.lower(),)
+            )
+            conn.execute(
+                "DELETE FROM follow_events WHERE username_key = ?", (username.lower(),)
+            )
+            if cursor.rowcount:
+                self.cofollows.remove(username)
+        return cursor.rowcount > 0
+
+    @traced('db.get_all_users')
+    def get_all_users(self):
+        """Get all tracked users"""
+        rows = self.query("SELECT * FROM users ORDER BY rowid")
+        return [self._row_to_user(row) for row in rows]
+
+    def _latest_event_seq(self, conn, key):
+        """Newest event sequence number of a user inside a transaction"""
+        row = conn.execute(
+            "SELECT MAX(seq) AS seq FROM follow_events WHERE username_key = ?", (key,)
+        ).fetchone()
+        return row['seq'] or 0
+
+    @traced('db.subscribe')
+    def subscribe(self, username, chat_id):
+        """Subscribe a chat to a tracked user; False if already subscribed or not tracked"""
+        key = username.lower()
+
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE username_key = ?", (key,)).fetchone() is None:
+                return False
+            # New subscribers start from now, not from the account's history
+            cursor = conn.execute("""
+                INSERT OR IGNORE INTO subscriptions (username_key, chat_id, subscribed_at, last_seen_seq)
+                VALUES (?, ?, ?, ?)
+            """, (key, chat_id, datetime.now().isoformat(), self._latest_event_seq(conn, key)))
+        return cursor.rowcount > 0
+
+    @traced('db.unsubscribe')
+    def unsubscribe(self, username, chat_id):
+        """Remove a chat's subscription; False if it was not subscribed"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM subscriptions WHERE username_key = ? AND chat_id = ?",
+                (username.lower(), chat_id)
+            )
+        return cursor.rowcount > 0
+
+    @traced('db.get_subscribers')
+    def get_subscribers(self, username):
+        """Subscriptions of a tracked user as dicts with chat_id and last_seen_seq"""
+        rows = self.query(
+            "SELECT chat_id, subscribed_at, last_seen_seq FROM subscriptions WHERE username_key = ?",
+            (username.lower(),)
+        )
+        return [dict(row) for row in rows]
+
+    @traced('db.get_chat_users')
+    def get_chat_users(self, chat_id):
+        """Tracked users a chat is subscribed to"""
+        rows = self.query("""
+            SELECT users.* FROM users
+            JOIN subscriptions ON subscriptions.username_key = users.username_key
+            WHERE subscriptions.chat_id = ?
+            ORDER BY users.rowid
+        """, (chat_id,))
+        return [self._row_to_user(row) for row in rows]
+
+    @traced('db.get_subscribed_usernames')
+    def get_subscribed_usernames(self):
+        """Lowercase usernames with at least one subscriber"""
+        return {row['username_key'] for row in self.query("SELECT DISTINCT username_key FROM subscriptions")}
+
+    @traced('db.latest_event_seq')
+    def latest_event_seq(self, username):
+        """Sequence number of the newest event of a user, 0 without events"""
+        rows = self.query(
+            "SELECT MAX(seq) AS seq FROM follow_events WHERE username_key = ?", (username.lower(),)
+        )
+        return rows[0]['seq'] or 0
+
+    @traced('db.append_events')
+    def append_events(self, username, new_followings, unfollowed_ids, after_seq=None):
+        """Record detected follows and unfollows; returns the newest sequence number
+
+        With after_seq nothing is recorded, and None returned, unless the
+        user's newest event is still after_seq.
+        """
+        key = username.lower()
+        events = build_events(new_followings, unfollowed_ids)
+
+        with self.transaction() as conn:
+            if after_seq is not None and self._latest_event_seq(conn, key) != after_seq:
+                return None
+            self._write_profiles(conn, new_followings)
+            # Profiles live in the profile store; the column only has old events' ones
+            conn.executemany("""
+                INSERT INTO follow_events (username_key, kind, user_id, detected_at)
+                VALUES (?, ?, ?, ?)
+            """, [
+                (key, event['kind'], event['user_id'], event['detected_at'])
+                for event in events
+            ])
+            seq = self._latest_event_seq(conn, key)
+            # Inside the write transaction so other workers append theirs after
+            # ours; unfollowed accounts seen before get their names in the history too
+            self.history.append(username, self.hydrate_events(events))
+            self.cofollows.add(username, events)
+        return seq
+
+    def _row_to_event(self, row):
+        """Convert a follow_events row to an event dict"""
+        event = dict(row)
+        event.pop('username_key', None)
+        event['profile'] = json.loads(event['profile']) if event['profile'] else None
+        return event
+
+    @traced('db.get_events')
+    def get_events(self, username, after_seq=0, upto_seq=None):
+        """Events of a user with after_seq < seq <= upto_seq, oldest first"""
+        rows = self.query("""
+            SELECT * FROM follow_events
+            WHERE username_key = ? AND seq > ? AND seq <= ?
+            ORDER BY seq
+        """, (username.lower(), after_seq, upto_seq if upto_seq is not None else 2 ** 63 - 1))
+        return self.hydrate_events([self._row_to_event(row) for row in rows])
+
+    @traced('db.claim_events')
+    def claim_events(self, username, chat_id, upto_seq):
+        """Events a chat has not seen yet, up to upto_seq, moving its cursor past them"""
+        key = username.lower()
+
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT last_seen_seq FROM subscriptions WHERE username_key = ? AND chat_id = ?",
+                (key, chat_id)
+            ).fetchone()
+            if row is None or row['last_seen_seq'] >= upto_seq:
+                return []
+
+            rows = conn.execute("""
+                SELECT * FROM follow_events
+                WHERE username_key = ? AND seq > ? AND seq <= ?
+                ORDER BY seq
+            """, (key, row['last_seen_seq'], upto_seq)).fetchall()
+            conn.execute(
+                "UPDATE subscriptions SET last_seen_seq = ? WHERE username_key = ? AND chat_id = ?",
+                (upto_seq, key, chat_id)
+            )
+        return self.hydrate_events([self._row_to_event(row) for row in rows])
+
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+def create_database(backend=STORAGE_BACKEND):
+    """Create the storage backend selected in config"""
+    if backend == 'sqlite':
+        return SQLiteDatabase()
+    if backend == 'json':
+        return Database()
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,148 @@
+import bisect
+import fcntl
+import json
+import os
+import shutil
+from datetime import datetime
+
+from config import HISTORY_DIR, HISTORY_SEGMENT_EVENTS
+from tracing import traced
+
+def history_entry(event):
+    """Compact history line for a follow event built by build_events"""
+    profile = event['profile'] or {}
+    return {
+        'detected_at': event['detected_at'],
+        'kind': event['kind'],
+        'user_id': event['user_id'],
+        'username': profile.get('userName'),
+        'name': profile.get('name')
+    }
+
+class FollowHistory:
+    """Append-only log of follow and unfollow events per account
+
+    Events go to numbered JSONL segments under HISTORY_DIR/<username>/,
+    a new one every segment_events events. index.json holds the first
+    and last timestamp of every segment, so a time range query only
+    opens the segments overlapping it instead of the whole log. The log
+    is kept when an account stops being tracked. Processes appending to
+    one account take turns through an flock on its index.lock.
+    """
+
+    def __init__(self, directory=HISTORY_DIR, segment_events=HISTORY_SEGMENT_EVENTS):
+        self.directory = directory
+        self.segment_events = segment_events
+
+    def account_dir(self, username):
+        return os.path.join(self.directory, username.lower())
+
+    def locked(self, username):
+        """Exclusive lock of an account's log, shared by every process"""
+        lock_file = open(os.path.join(self.account_dir(username), 'index.lock'), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def load_index(self, username):
+        """Segments of an account, oldest first"""
+        try:
+            with open(os.path.join(self.account_dir(username), 'index.json'), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def save_index(self, username, index):
+        path = os.path.join(self.account_dir(username), 'index.json')
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(index, f)
+        os.replace(f"{path}.tmp", path)
+
+    @traced('history.append')
+    def append(self, username, events):
+        """Add events (oldest first) to the end of an account's log"""
+        if not events:
+            return
+
+        account_dir = self.account_dir(username)
+        os.makedirs(account_dir, exist_ok=True)
+        pending = [history_entry(event) for event in events]
+
+        lock_file = self.locked(username)
+        try:
+            index = self.load_index(username)
+            while pending:
+                if not index or index[-1]['count'] >= self.segment_events:
+                    index.append({
+                        'segment': f"{len(index) + 1:06d}.jsonl",
+                        'first': pending[0]['detected_at'],
+                        'last': pending[0]['detected_at'],
+                        'count': 0
+                    })
+                entry = index[-1]
+                batch = pending[:self.segment_events - entry['count']]
+                pending = pending[len(batch):]
+
+                with open(os.path.join(account_dir, entry['segment']), 'a') as f:
+                    f.writelines(json.dumps(line) + '\n' for line in batch)
+                entry['last'] = batch[-1]['detected_at']
+                entry['count'] += len(batch)
+
+            # The index only ever points at lines already written
+            self.save_index(username, index)
+        finally:
+            lock_file.close()
+
+    def read_segment(self, username, segment):
+        with open(os.path.join(self.account_dir(username), segment), 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    @traced('history.query')
+    def query(self, username, since=None, until=None, limit=None):
+        """Events with since <= detected_at <= until, oldest first
+
+        With limit only the newest limit events are returned, and
+        segments are read newest first until there are enough.
+        """
+        index = self.load_index(username)
+
+        start = 0
+        if since is not None:
+            # Segments are in time order: skip the ones ending before since
+            start = bisect.bisect_left([datetime.fromisoformat(entry['last']) for entry in index], since)
+
+        events = []
+        for entry in reversed(index[start:]):
+            if until is not None and datetime.fromisoformat(entry['first']) > until:
+                continue
+
+            events = [
+                event for event in self.read_segment(username, entry['segment'])
+                if (since is None or datetime.fromisoformat(event['detected_at']) >= since)
+                and (until is None or datetime.fromisoformat(event['detected_at']) <= until)
+            ] + events
+            if limit and len(events) >= limit:
+                break
+
+        return events[-limit:] if limit else events
+
+    def count(self, username, since=None):
+        """Number of events logged for an account, since a time if given
+
+        Only the segment the time falls in is read.
+        """
+        index = self.load_index(username)
+        if since is None:
+            return sum(entry['count'] for entry in index)
+
+        start = bisect.bisect_left([datetime.fromisoformat(entry['last']) for entry in index], since)
+        total = sum(entry['count'] for entry in index[start + 1:])
+        if start < len(index):
+            total += sum(
+                1 for event in self.read_segment(username, index[start]['segment'])
+                if datetime.fromisoformat(event['detected_at']) >= since
+            )
+        return total
+
+    def remove(self, username):
+        """Delete an account's whole log"""
+        shutil.rmtree(self.account_dir(username), ignore_errors=True)
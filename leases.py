@@ -0,0 +1,236 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+from config import (
+    DATA_DIR,
+    SQLITE_DB_FILE,
+    STORAGE_BACKEND,
+    LEASE_TTL,
+    WORKER_TTL
+)
+
+logger = logging.getLogger(__name__)
+
+def default_worker_id():
+    """Unique name for this process"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+def rendezvous_owner(key, workers):
+    """Worker that should own key: highest hash of (worker, key)
+
+    Every worker computes the same answer from the same live set, and
+    a worker joining or leaving only moves the keys it wins or held.
+    """
+    return max(workers, key=lambda worker: hashlib.sha1(f"{worker}:{key}".encode()).digest())
+
+class SQLiteLeaseStore:
+    """Worker heartbeats and account leases in the shared SQLite file"""
+
+    def __init__(self, path=SQLITE_DB_FILE):
+        if not os.path.exists(os.path.dirname(path) or '.'):
+            os.makedirs(os.path.dirname(path))
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        with self.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    heartbeat_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    username_key TEXT PRIMARY KEY,
+                    worker_id TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in a single write transaction"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def heartbeat(self, worker_id, now, worker_ttl):
+        """Mark worker alive, forget dead ones and return the live workers"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)",
+                (worker_id, now)
+            )
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - worker_ttl,))
+            return sorted(row['worker_id'] for row in conn.execute("SELECT worker_id FROM workers"))
+
+    def apply(self, worker_id, acquire, release, expires_at, now):
+        """Take or renew leases on acquire, drop release; return the keys worker holds"""
+        with self.transaction() as conn:
+            conn.executemany(
+                "DELETE FROM leases WHERE username_key = ? AND worker_id = ?",
+                [(key, worker_id) for key in release]
+            )
+            for key in acquire:
+                # Only free, expired or already-own leases can be taken
+                conn.execute("""
+                    INSERT INTO leases (username_key, worker_id, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(username_key) DO UPDATE SET
+                        worker_id = excluded.worker_id, expires_at = excluded.expires_at
+                    WHERE leases.worker_id = excluded.worker_id OR leases.expires_at < ?
+                """, (key, worker_id, expires_at, now))
+            return {
+                row['username_key'] for row in conn.execute(
+                    "SELECT username_key FROM leases WHERE worker_id = ? AND expires_at >= ?",
+                    (worker_id, now)
+                )
+            }
+
+    def leave(self, worker_id):
+        """Release every lease of a worker and remove it from the live set"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE worker_id = ?", (worker_id,))
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def close(self):
+        self.conn.close()
+
+class FileLeaseStore:
+    """Worker heartbeats and account leases in a JSON file guarded by flock"""
+
+    def __init__(self, directory=DATA_DIR):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, 'leases.json')
+        self.lock_path = os.path.join(directory, 'leases.lock')
+
+    @contextmanager
+    def locked_state(self):
+        """Load the state under an exclusive lock and write it back afterwards"""
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path, 'r') as f:
+                        state = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    state = {'workers': {}, 'leases': {}}
+
+                yield state
+
+                with open(f"{self.path}.tmp", 'w') as f:
+                    json.dump(state, f)
+                os.replace(f"{self.path}.tmp", self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def heartbeat(self, worker_id, now, worker_ttl):
+        """Mark worker alive, forget dead ones and return the live workers"""
+        with self.locked_state() as state:
+            state['workers'][worker_id] = now
+            state['workers'] = {
+                worker: beat for worker, beat in state['workers'].items() if beat >= now - worker_ttl
+            }
+            return sorted(state['workers'])
+
+    def apply(self, worker_id, acquire, release, expires_at, now):
+        """Take or renew leases on acquire, drop release; return the keys worker holds"""
+        with self.locked_state() as state:
+            leases = state['leases']
+            for key in release:
+                if key in leases and leases[key][0] == worker_id:
+                    del leases[key]
+            for key in acquire:
+                holder = leases.get(key)
+                if holder is None or holder[0] == worker_id or holder[1] < now:
+                    leases[key] = [worker_id, expires_at]
+            return {key for key, (holder, expires) in leases.items() if holder == worker_id and expires >= now}
+
+    def leave(self, worker_id):
+        """Release every lease of a worker and remove it from the live set"""
+        with self.locked_state() as state:
+            state['workers'].pop(worker_id, None)
+            state['leases'] = {
+                key: lease for key, lease in state['leases'].items() if lease[0] != worker_id
+            }
+
+    def close(self):
+        pass
+
+def create_lease_store(backend=STORAGE_BACKEND):
+    """Lease store living next to the configured storage backend"""
+    if backend == 'json':
+        return FileLeaseStore()
+    return SQLiteLeaseStore()
+
+class LeaseManager:
+    """Decides which tracked accounts this worker may check
+
+    Live workers heartbeat into the shared store. Accounts are split
+    between them by rendezvous hashing and each worker holds expiring
+    leases on its share. A lease is only taken when it is free or
+    expired, and accounts being checked keep their lease until the
+    check ends, so no two schedulers check an account at once. Checks
+    run outside the scheduler (/track, the CLI) take no lease.
+    When a worker joins, others release what it now owns; when one dies
+    its leases expire after LEASE_TTL and are picked up.
+    """
+
+    def __init__(self, store, worker_id=None, lease_ttl=LEASE_TTL, worker_ttl=WORKER_TTL):
+        self.store = store
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_ttl = lease_ttl
+        self.worker_ttl = worker_ttl
+        self.held = set()
+        self.workers = []
+
+    def refresh(self, keys, busy=()):
+        """Heartbeat and rebalance; returns the keys this worker holds a lease on
+
+        keys are all accounts that need checking, busy the ones whose
+        check is still running here.
+        """
+        now = time.time()
+        self.workers = self.store.heartbeat(self.worker_id, now, self.worker_ttl)
+
+        wanted = {key for key in keys if rendezvous_owner(key, self.workers) == self.worker_id}
+        wanted |= set(busy)
+        release = self.held - wanted
+
+        self.held = self.store.apply(self.worker_id, wanted, release, now + self.lease_ttl, now)
+        if release:
+            logger.info(f"Worker {self.worker_id} handed over {len(release)} accounts")
+        return self.held
+
+    def holds(self, key):
+        """Renew the lease on key right before using it; False if it was lost"""
+        now = time.time()
+        self.held = self.store.apply(self.worker_id, [key], [], now + self.lease_ttl, now)
+        return key in self.held
+
+    def stats(self):
+        """This worker's ID, live workers and leases held"""
+        return {
+            'worker_id': self.worker_id,
+            'workers': len(self.workers),
+            'leases': len(self.held)
+        }
+
+    def leave(self):
+        """Give up every lease so the remaining workers take over at once"""
+        self.store.leave(self.worker_id)
+        self.store.close()
+        self.held = set()
@@ -0,0 +1,63 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+def account_key(username):
+    """Lock key of a tracked account"""
+    return ('account', username.lower())
+
+def chat_key(chat_id, username):
+    """Lock key of one tracked account within a Telegram chat"""
+    return ('chat', str(chat_id), username.lower())
+
+class KeyedLocks:
+    """One asyncio lock per key, created on first use and dropped once free
+
+    Tasks holding the same key run one after another in arrival order,
+    tasks on different keys run in parallel. hold() takes several keys
+    in sorted order, so tasks asking for overlapping keys can't
+    deadlock; nesting hold() calls is only safe when every task nests
+    them the same way (chat outside, account inside). The locks only
+    order tasks on one event loop. Other processes (scheduler workers,
+    webhook workers, the CLI) can check the same account at the same
+    time; check_user then records the outcome of only one of them.
+    """
+
+    def __init__(self):
+        self.locks = {}
+        # Tasks holding or waiting for each key
+        self.users = {}
+
+    @asynccontextmanager
+    async def hold(self, *keys):
+        """Hold the locks of keys for the with block"""
+        keys = sorted(set(keys))
+        for key in keys:
+            self.users[key] = self.users.get(key, 0) + 1
+            if key not in self.locks:
+                self.locks[key] = asyncio.Lock()
+
+        acquired = []
+        try:
+            for key in keys:
+                await self.locks[key].acquire()
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self.locks[key].release()
+            for key in keys:
+                self.users[key] -= 1
+                if not self.users[key]:
+                    del self.users[key]
+                    del self.locks[key]
+
+    def waiting(self):
+        """Tasks queued behind another one holding the same key"""
+        return sum(count - 1 for count in self.users.values())
+
+    def stats(self):
+        """Keys with a lock and tasks queued behind one"""
+        return {
+            'locked_keys': len(self.locks),
+            'lock_waiters': self.waiting()
+        }
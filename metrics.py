@@ -0,0 +1,200 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from webserver import HTTPServer, Response
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def escape_label(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=None):
+    """Render {name="value",...}, or '' without labels"""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Metric:
+    """Base class: a named family of samples keyed by label values"""
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        (registry or REGISTRY).register(self)
+
+    def key(self, labels):
+        """Label values in labelnames order"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        """Sample lines for this metric"""
+        with self.lock:
+            return [
+                f"{self.name}{format_labels(self.labelnames, key)} {value}"
+                for key, value in self.values.items()
+            ]
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Value that goes up and down, optionally read from a callback at scrape time"""
+
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from function() on every scrape"""
+        self.function = function
+
+    def render(self):
+        if self.function is None:
+            return super().render()
+        value = self.function()
+        return [] if value is None else [f"{self.name} {value}"]
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count of observations"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # One counter per bucket plus +Inf, then the sum
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[bisect.bisect_left(self.buckets, value)] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for key, entry in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), entry):
+                    cumulative += count
+                    labels = format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {entry[-1]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    """Metrics exposed by the /metrics endpoint"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            samples = metric.render()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = Histogram(
+    'xtracker_handler_seconds', 'Telegram handler latency', ['command']
+)
+API_REQUEST_SECONDS = Histogram(
+    'xtracker_api_request_seconds', 'twitterapi.io request latency', ['endpoint']
+)
+ERRORS = Counter(
+    'xtracker_errors_total', 'Errors by where they happened and exception type', ['source', 'type']
+)
+CHECK_PAGES = Histogram(
+    'xtracker_check_pages', 'Following pages fetched per check', ['status'],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50)
+)
+CREDITS_SPENT = Counter(
+    'xtracker_credits_spent_total', 'Estimated twitterapi.io credits spent', ['endpoint']
+)
+CREDITS_REMAINING = Gauge(
+    'xtracker_credits_remaining', 'Last known remaining credits'
+)
+DB_SECONDS = Histogram(
+    'xtracker_db_seconds', 'Storage load/save latency', ['backend', 'operation']
+)
+OUTBOX_BACKLOG = Gauge(
+    'xtracker_outbox_backlog', 'Telegram messages waiting to be sent'
+)
+
+def count_error(source, error):
+    """Count an exception (or error type name) under source"""
+    ERRORS.inc(source=source, type=error if isinstance(error, str) else type(error).__name__)
+
+def instrument_handler(command, handler):
+    """Wrap a Telegram handler to record its latency and uncaught errors"""
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        with HANDLER_SECONDS.time(command=command):
+            try:
+                return await handler(update, context)
+            except Exception as e:
+                count_error(f"handler:{command}", e)
+                raise
+
+    return wrapper
+
+class MetricsServer(HTTPServer):
+    """HTTP server answering GET /metrics on the bot's event loop"""
+
+    def __init__(self, host, port, registry=REGISTRY):
+        super().__init__(host, port, {('GET', '/metrics'): self.metrics}, name='Metrics')
+        self.registry = registry
+
+    async def metrics(self, request):
+        return Response(200, self.registry.render(), 'text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from telegram.error import RetryAfter
+
+from config import (
+    OUTBOX_GLOBAL_RATE,
+    OUTBOX_CHAT_INTERVAL,
+    OUTBOX_GROUP_INTERVAL,
+    TELEGRAM_MESSAGE_LIMIT
+)
+from metrics import count_error
+from tracing import hold, release, span_under
+
+logger = logging.getLogger(__name__)
+
+class OutgoingMessage:
+    """One queued send_message call and the futures waiting on it
+
+    parents are the spans that queued it, so the send shows up in the
+    traces of the updates or checks it belongs to.
+    """
+
+    def __init__(self, chat_id, text, kwargs, future, parent=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.futures = [future]
+        self.parents = [parent]
+
+    def can_merge(self, other):
+        """True when other can be appended to this message's text"""
+        return (
+            'reply_markup' not in self.kwargs
+            and self.kwargs.get('parse_mode') == other.kwargs.get('parse_mode')
+            and self.kwargs.get('disable_web_page_preview') == other.kwargs.get('disable_web_page_preview')
+            and len(self.text) + 2 + len(other.text) <= TELEGRAM_MESSAGE_LIMIT
+        )
+
+    def merge(self, other):
+        """Append other to this message; its keyboard, if any, moves here"""
+        self.text = f"{self.text}\n\n{other.text}"
+        self.kwargs = dict(self.kwargs, **other.kwargs)
+        self.futures += other.futures
+        self.parents += other.parents
+
+    def settle(self, sent=None, error=None):
+        """Resolve the futures and give back the parent spans"""
+        for future in self.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(sent)
+        for parent in self.parents:
+            release(parent)
+        self.parents = []
+
+class Outbox:
+    """Outbound Telegram queue that stays within flood limits
+
+    Sends to one chat are spaced by OUTBOX_CHAT_INTERVAL (groups by
+    OUTBOX_GROUP_INTERVAL) and all sends by OUTBOX_GLOBAL_RATE per
+    second. Small messages waiting for the same chat are merged up to
+    Telegram's message size limit, and RetryAfter pauses the chat (and
+    the whole queue) for the time Telegram asks for.
+    """
+
+    def __init__(self, bot=None, global_rate=OUTBOX_GLOBAL_RATE):
+        self.bot = bot
+        self.global_interval = 1 / global_rate
+        self.queues = {}
+        self.next_send = {}
+        self.global_next_send = 0
+        self.wakeup = asyncio.Event()
+        self.worker = None
+        self.sent = 0
+        self.merged = 0
+        self.retries = 0
+
+    def start(self, bot):
+        """Start delivering with the given bot"""
+        self.bot = bot
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the delivery worker"""
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        # Traces waiting on unsent messages are written out without them
+        for queue in self.queues.values():
+            for message in queue:
+                for parent in message.parents:
+                    release(parent)
+                message.parents = []
+
+    def depth(self):
+        """Messages waiting to be sent"""
+        return sum(len(queue) for queue in self.queues.values())
+
+    def stats(self):
+        """Queue depth and delivery counters"""
+        return {
+            'depth': self.depth(),
+            'chats': len(self.queues),
+            'sent': self.sent,
+            'merged': self.merged,
+            'retries': self.retries
+        }
+
+    def send(self, chat_id, text, **kwargs):
+        """Queue a message; returns a future for the sent Message"""
+        future = asyncio.get_running_loop().create_future()
+        # Errors are logged by the worker, callers don't have to await
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+        self.queues.setdefault(chat_id, deque()).append(
+            OutgoingMessage(chat_id, text, kwargs, future, hold())
+        )
+        self.wakeup.set()
+        return future
+
+    def chat_interval(self, chat_id):
+        """Minimum spacing between sends to one chat"""
+        return OUTBOX_GROUP_INTERVAL if chat_id < 0 else OUTBOX_CHAT_INTERVAL
+
+    def _next_chat(self, now):
+        """Chat whose turn it is, or the seconds to wait for one"""
+        ready_at = None
+        for chat_id in self.queues:
+            at = self.next_send.get(chat_id, 0)
+            if at <= now:
+                return chat_id, 0
+            ready_at = at if ready_at is None else min(ready_at, at)
+        return None, ready_at - now
+
+    def _pop(self, chat_id):
+        """Take the next message of a chat, merged with what fits behind it"""
+        queue = self.queues[chat_id]
+        message = queue.popleft()
+        try:
+            while queue and message.can_merge(queue[0]):
+                message.merge(queue[0])
+                queue.popleft()
+                self.merged += 1
+        except Exception as e:
+            message.settle(error=e)
+            raise
+        finally:
+            if not queue:
+                del self.queues[chat_id]
+        return message
+
+    def _evict_idle(self, now):
+        """Forget the spacing of chats with nothing queued whose next send time has passed"""
+        for chat_id in [chat_id for chat_id, at in self.next_send.items() if at <= now]:
+            if chat_id not in self.queues:
+                del self.next_send[chat_id]
+
+    async def _run(self):
+        """Deliver queued messages forever
+
+        A message that fails in any way is settled with the error and
+        the worker moves on to the next one.
+        """
+        while True:
+            if not self.queues:
+                self._evict_idle(time.monotonic())
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            if self.global_next_send > now:
+                await asyncio.sleep(self.global_next_send - now)
+                continue
+
+            chat_id, wait = self._next_chat(now)
+            if chat_id is None:
+                self.wakeup.clear()
+                # asyncio.wait, unlike wait_for, never swallows a stop() cancel
+                waiter = asyncio.ensure_future(self.wakeup.wait())
+                try:
+                    await asyncio.wait([waiter], timeout=wait)
+                finally:
+                    waiter.cancel()
+                continue
+
+            if len(self.next_send) > len(self.queues) + 1000:
+                self._evict_idle(now)
+
+            message = None
+            try:
+                message = self._pop(chat_id)
+                self.global_next_send = now + self.global_interval
+                self.next_send[chat_id] = now + self.chat_interval(chat_id)
+                await self._deliver(message)
+            except Exception as e:
+                count_error('outbox', e)
+                logger.error(f"Error delivering to chat {chat_id}: {e}")
+                if message is not None:
+                    message.settle(error=e)
+
+    async def _deliver(self, message):
+        """Send one message and settle its futures"""
+        try:
+            with span_under(message.parents, 'outbox.send', chat_id=message.chat_id):
+                sent = await self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+
+        except RetryAfter as e:
+            # Put it back at the head of its chat and pause as asked
+            self.retries += 1
+            self.queues.setdefault(message.chat_id, deque()).appendleft(message)
+            resume_at = time.monotonic() + e.retry_after
+            self.next_send[message.chat_id] = resume_at
+            self.global_next_send = max(self.global_next_send, resume_at)
+            logger.warning(f"Flood limit hit for chat {message.chat_id}, retrying in {e.retry_after}s")
+            return
+
+        except Exception as e:
+            count_error('outbox', e)
+            logger.error(f"Error sending message to chat {message.chat_id}: {e}")
+            message.settle(error=e)
+            return
+
+        self.sent += 1
+        message.settle(sent)
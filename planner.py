@@ -0,0 +1,179 @@
+import logging
+import math
+from datetime import datetime
+
+from config import (
+    FINGERPRINT_PAGE_SIZE,
+    FOLLOWING_MAX_PAGES,
+    SNAPSHOT_MAX_PAGES,
+    CHECKPOINT_MAX_AGE,
+    CREDITS_PER_REQUEST,
+    CREDITS_PER_PROFILE
+)
+from ratelimit import following_credits
+from twitter_api import following_page_size
+
+logger = logging.getLogger(__name__)
+
+# Credits of the profile lookup every check starts with
+LOOKUP_CREDITS = max(CREDITS_PER_REQUEST, CREDITS_PER_PROFILE)
+
+def checkpoint_usable(checkpoint, known_count):
+    """True when a pagination checkpoint is recent and for the stored snapshot"""
+    age = datetime.now() - datetime.fromisoformat(checkpoint['updated_at'])
+    return age.total_seconds() <= CHECKPOINT_MAX_AGE and checkpoint['known_count'] == known_count
+
+def follow_page_sizes(outstanding, anchored=0):
+    """Page sizes a check requests to find outstanding new follows
+
+    Mirrors FollowingDiff.next_page_size: each page asks for the follows
+    still missing plus the two known IDs needed to anchor the diff, 200
+    at most, so no call is spent on entries that aren't needed.
+    """
+    sizes = []
+    while anchored < 2:
+        if anchored:
+            size = following_page_size(2)
+        else:
+            size = following_page_size(max(outstanding, 0) + 2)
+        found = min(size, max(outstanding, 0))
+        outstanding -= found
+        anchored += size - found
+        sizes.append(size)
+    return sizes
+
+def page_costs(sizes, list_length):
+    """Credits per page when the followings list has list_length entries"""
+    costs = []
+    for size in sizes:
+        costs.append(following_credits(min(size, max(list_length, 0))))
+        list_length -= size
+    return costs
+
+def plan_check(username, previous_count, current_count, has_snapshot=True, checkpoint=None,
+               max_pages=FOLLOWING_MAX_PAGES):
+    """Predicted followings calls and credits of one check, after its profile lookup
+
+    Snapshots are predicted exactly. Everything else is a range: calls
+    and credits are the best case, where a count change hides no
+    unfollows, and max_calls and max_credits the walk down the whole
+    list to find unfollows whose position is unknown (or the hidden
+    ones that keep follows from anchoring the diff).
+    complete is False when the page limit stops the check early; the
+    rest then continues on the next check.
+    """
+    plan = {
+        'username': username,
+        'previous_count': previous_count,
+        'current_count': current_count,
+        'difference': current_count - previous_count,
+        'resumed': bool(checkpoint)
+    }
+
+    if not has_snapshot:
+        pages = max(math.ceil(current_count / 200), 1)
+        sizes = [200] * min(pages, SNAPSHOT_MAX_PAGES)
+        plan.update(action='snapshot', complete=pages <= SNAPSHOT_MAX_PAGES)
+        best = worst = sizes
+
+    elif checkpoint:
+        # Continue from where the unfinished check stopped
+        previous_count = checkpoint['previous_count']
+        current_count = checkpoint['current_count']
+        outstanding = current_count - previous_count - checkpoint['added_total']
+        anchored = len(checkpoint['last_positions'])
+        best = follow_page_sizes(outstanding, anchored) or [following_page_size(200)]
+        worst = best + [200] * math.ceil(
+            max(current_count - len(checkpoint['seen_ids']) - sum(best), 0) / 200
+        )
+        plan.update(action='resume', difference=current_count - previous_count)
+
+    elif current_count == previous_count:
+        plan.update(action='unchanged', complete=True)
+        best = worst = []
+        if FINGERPRINT_PAGE_SIZE:
+            # One page to compare fingerprints; follows offset by
+            # unfollows mean walking down to the unfollows
+            best = [following_page_size(FINGERPRINT_PAGE_SIZE)]
+            worst = best + [200] * math.ceil(max(current_count - best[0], 0) / 200)
+
+    elif current_count > previous_count:
+        best = follow_page_sizes(current_count - previous_count)
+        # Unfollows hidden by the follows show up as a missing anchor
+        worst = best + [200] * math.ceil(max(current_count - sum(best), 0) / 200)
+        plan.update(action='follows')
+
+    else:
+        # The first page anchors; unfollows further down need pages of 200
+        best = follow_page_sizes(0)
+        worst = best + [200] * math.ceil(max(current_count - best[0], 0) / 200)
+        plan.update(action='unfollows')
+
+    limit = SNAPSHOT_MAX_PAGES if plan['action'] == 'snapshot' else max_pages
+    plan.setdefault('complete', len(best) <= limit)
+    best, worst = best[:limit], worst[:limit]
+
+    plan['page_sizes'] = best
+    plan['calls'] = len(best)
+    plan['credits'] = sum(page_costs(best, current_count))
+    plan['max_calls'] = len(worst)
+    plan['max_credits'] = sum(page_costs(worst, current_count))
+    return plan
+
+def plan_total(plans, lookups=0):
+    """Calls and credits of several plans plus their profile lookups"""
+    return {
+        'accounts': len(plans),
+        'lookups': lookups,
+        'calls': lookups + sum(plan['calls'] for plan in plans),
+        'credits': lookups * LOOKUP_CREDITS + sum(plan['credits'] for plan in plans),
+        'max_calls': lookups + sum(plan['max_calls'] for plan in plans),
+        'max_credits': lookups * LOOKUP_CREDITS + sum(plan['max_credits'] for plan in plans)
+    }
+
+async def plan_accounts(db, twitter_api, usernames):
+    """Plans for checking accounts right now, plus lookup failures
+
+    Current counts come from the profile lookup, which is cached, so a
+    check started shortly after reuses it. Nothing else is fetched and
+    nothing is stored.
+    """
+    infos = await twitter_api.get_many_user_info(usernames)
+
+    plans, failed = [], []
+    for username in usernames:
+        info = infos[username]
+        if not info['success']:
+            failed.append({'username': username, 'error': info['error']})
+            continue
+
+        current_count = info['data'].get('following', 0)
+        existing = db.get_user(username)
+        known_ids = db.get_following_snapshot(username) if existing else None
+        if known_ids is None:
+            plans.append(plan_check(username, 0, current_count, has_snapshot=False))
+            continue
+
+        checkpoint = db.get_checkpoint(username)
+        if checkpoint and not checkpoint_usable(checkpoint, len(known_ids)):
+            checkpoint = None
+        plans.append(plan_check(username, existing['following_count'], current_count, checkpoint=checkpoint))
+
+    return plans, failed
+
+def log_cost(plan, spent):
+    """Log the predicted against the actual cost of a check's pagination"""
+    if plan['calls'] and not spent['calls']:
+        logger.info(f"Pages for {plan['username']} came from a concurrent identical check")
+        return
+
+    predicted = f"{plan['calls']} calls / {plan['credits']} credits"
+    if plan['max_calls'] != plan['calls']:
+        predicted = f"{plan['calls']}-{plan['max_calls']} calls / {plan['credits']}-{plan['max_credits']} credits"
+
+    within = plan['calls'] <= spent['calls'] <= plan['max_calls']
+    logger.log(
+        logging.INFO if within else logging.WARNING,
+        f"Cost of {plan['action']} check for {plan['username']}: predicted {predicted}, "
+        f"actual {spent['calls']} calls / {spent['credits']} credits"
+    )
@@ -0,0 +1,21 @@
+from datetime import datetime, timedelta
+
+from config import PROFILE_REFRESH_AGE
+
+# Profile fields the bot reads; the rest of an API profile is dropped
+PROFILE_FIELDS = (
+    'id', 'userName', 'name', 'description',
+    'followers_count', 'following_count', 'statuses_count', 'created_at',
+    'followers', 'following'
+)
+
+def project_profile(profile):
+    """Copy of an API profile with only PROFILE_FIELDS, ID as a string"""
+    projected = {field: profile[field] for field in PROFILE_FIELDS if field in profile}
+    if projected.get('id') is not None:
+        projected['id'] = str(projected['id'])
+    return projected
+
+def refresh_cutoff(max_age=PROFILE_REFRESH_AGE):
+    """Stored profiles updated before this ISO time are replaced by newer copies"""
+    return (datetime.now() - timedelta(seconds=max_age)).isoformat()
@@ -0,0 +1,157 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import (
+    API_RATE_LIMIT,
+    API_BURST,
+    CREDITS_RESERVE,
+    CREDITS_REFRESH_INTERVAL,
+    CREDITS_PER_REQUEST,
+    CREDITS_PER_PROFILE
+)
+from metrics import CREDITS_SPENT
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Priority of API calls made from the current task; background jobs set it
+# once at their start and every call they make is queued behind /track
+request_priority = ContextVar('request_priority', default=PRIORITY_INTERACTIVE)
+
+# Calls and credits of the responses received inside spend_ledger()
+credit_ledger = ContextVar('credit_ledger', default=None)
+
+class RequestDeferred(Exception):
+    """Raised when low-priority work is held back to protect the credit reserve"""
+
+def following_credits(profiles):
+    """Credits charged for a followings page returning profiles entries"""
+    return max(CREDITS_PER_REQUEST, profiles * CREDITS_PER_PROFILE)
+
+def estimate_credits(endpoint, data):
+    """Credits charged for one response of an endpoint"""
+    if endpoint == 'my_info':
+        return 0
+    if endpoint == 'user_following':
+        return following_credits(len(data.get('followings') or []))
+    return max(CREDITS_PER_REQUEST, CREDITS_PER_PROFILE)
+
+@contextmanager
+def spend_ledger():
+    """Count the calls and credits of API responses received in the with block"""
+    ledger = {'calls': 0, 'credits': 0}
+    token = credit_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        credit_ledger.reset(token)
+
+class ApiDispatcher:
+    """Token bucket shared by all endpoints, served in priority order
+
+    Interactive calls always go first. Background calls are refused with
+    RequestDeferred while the known remaining credits are below
+    CREDITS_RESERVE. The remaining credits are set from get_my_credits
+    and lowered by the estimated cost of each response in between.
+    """
+
+    def __init__(self, rate=API_RATE_LIMIT, burst=API_BURST, reserve=CREDITS_RESERVE):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.reserve = reserve
+        self.waiters = []
+        self.counter = itertools.count()
+        self.pump_task = None
+        self.remaining_credits = None
+        self.credits_updated = None
+        self.credits_spent = 0
+        self.deferred = 0
+
+    def queue_depth(self):
+        """Calls waiting for a token"""
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+    def credits_stale(self):
+        """True when the remaining credits should be refreshed"""
+        return (
+            self.credits_updated is None
+            or time.monotonic() - self.credits_updated > CREDITS_REFRESH_INTERVAL
+        )
+
+    def credits_low(self):
+        """True when the known remaining credits are below the reserve"""
+        return self.remaining_credits is not None and self.remaining_credits < self.reserve
+
+    def set_credits(self, remaining):
+        """Record remaining credits reported by /oapi/my/info"""
+        self.remaining_credits = remaining
+        self.credits_updated = time.monotonic()
+
+    def record_spend(self, endpoint, data):
+        """Lower the remaining credits by the estimated cost of a response"""
+        cost = estimate_credits(endpoint, data)
+        self.credits_spent += cost
+        ledger = credit_ledger.get()
+        if ledger is not None:
+            ledger['calls'] += 1
+            ledger['credits'] += cost
+        CREDITS_SPENT.inc(cost, endpoint=endpoint)
+        if self.remaining_credits is not None:
+            self.remaining_credits -= cost
+
+    async def acquire(self, priority=None):
+        """Wait for a request slot"""
+        if priority is None:
+            priority = request_priority.get()
+
+        if priority >= PRIORITY_BACKGROUND and self.credits_low():
+            self.deferred += 1
+            raise RequestDeferred(
+                f"Credits below reserve ({self.remaining_credits} < {self.reserve}), background work deferred"
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.ensure_future(self._pump())
+        await future
+
+    def _refill(self):
+        """Add tokens for the time elapsed since the last refill"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def _pump(self):
+        """Release waiters in priority order as tokens become available"""
+        while self.waiters:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+
+            priority, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                # Waiter was cancelled while queued
+                continue
+            if priority >= PRIORITY_BACKGROUND and self.credits_low():
+                self.deferred += 1
+                future.set_exception(RequestDeferred("Credits below reserve, background work deferred"))
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+
+    def stats(self):
+        """Queue and credit counters"""
+        return {
+            'queued': self.queue_depth(),
+            'remaining_credits': self.remaining_credits,
+            'credits_spent': self.credits_spent,
+            'deferred': self.deferred
+        }
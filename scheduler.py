@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+
+from config import (
+    SCHEDULER_TICK,
+    SCHEDULER_MAX_CONCURRENT,
+    CHECK_INTERVAL_DEFAULT,
+    CHECK_INTERVAL_MIN,
+    CHECK_INTERVAL_MAX,
+    CHECK_JITTER
+)
+from metrics import count_error
+from tracing import trace
+from ratelimit import PRIORITY_BACKGROUND, request_priority
+from tracker import has_changes
+
+logger = logging.getLogger(__name__)
+
+def next_check_interval(current, changed):
+    """Halve the interval after a change, grow it by half while quiet"""
+    if not current:
+        current = CHECK_INTERVAL_DEFAULT
+    interval = current / 2 if changed else current * 1.5
+    return min(max(interval, CHECK_INTERVAL_MIN), CHECK_INTERVAL_MAX)
+
+def check_schedule(current, result):
+    """(interval, delay until the next check) after a background check result
+
+    Failed checks, deferred ones included, keep the interval and are
+    retried after at most CHECK_INTERVAL_MIN: the account didn't turn
+    quiet, the API or the credits were short.
+    """
+    if not result['success']:
+        interval = current or CHECK_INTERVAL_DEFAULT
+        return interval, min(interval, CHECK_INTERVAL_MIN)
+    interval = next_check_interval(current, has_changes(result))
+    return interval, interval
+
+def jittered(seconds):
+    """Spread a delay by +/- CHECK_JITTER so checks don't run in lockstep"""
+    return seconds * random.uniform(1 - CHECK_JITTER, 1 + CHECK_JITTER)
+
+class CheckScheduler:
+    """Re-check tracked users on the job queue with adaptive intervals"""
+
+    def __init__(self, service, max_concurrent=SCHEDULER_MAX_CONCURRENT, leases=None):
+        self.service = service
+        self.db = service.db
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = set()
+        # LeaseManager when several workers share the storage
+        self.leases = leases
+
+    def start(self, application):
+        """Register the periodic tick on the application's job queue"""
+        application.job_queue.run_repeating(
+            self.tick,
+            interval=SCHEDULER_TICK,
+            first=jittered(SCHEDULER_TICK),
+            name='background_checks'
+        )
+
+    def stop(self):
+        """Hand this worker's accounts over to the remaining workers"""
+        if self.leases:
+            self.leases.leave()
+
+    def next_check_at(self, user):
+        """When a user is due for a background check"""
+        if user.get('next_check_at'):
+            return datetime.fromisoformat(user['next_check_at'])
+
+        # Never scheduled - start one default interval after the last check
+        last_checked = user.get('last_checked')
+        if not last_checked:
+            return datetime.now()
+        delay = jittered(user.get('check_interval') or CHECK_INTERVAL_DEFAULT)
+        return datetime.fromisoformat(last_checked) + timedelta(seconds=delay)
+
+    async def tick(self, context):
+        """Start checks for every due user not already being checked
+
+        Each account is checked once however many chats subscribe to it;
+        accounts nobody subscribes to are not checked at all. With
+        leases, only accounts leased to this worker are considered.
+        """
+        now = datetime.now()
+        subscribed = self.db.get_subscribed_usernames()
+        if self.leases:
+            subscribed &= self.leases.refresh(subscribed, busy=self.in_flight)
+
+        for user in self.db.get_all_users():
+            key = user['username'].lower()
+            if key not in subscribed or key in self.in_flight or self.next_check_at(user) > now:
+                continue
+
+            self.in_flight.add(key)
+            context.application.create_task(self.run_check(user))
+
+    async def run_check(self, user):
+        """Check one user, deliver its changes to the subscribers and reschedule it"""
+        username = user['username']
+        # Queue this task's API calls behind interactive /track requests
+        request_priority.set(PRIORITY_BACKGROUND)
+
+        try:
+            async with self.semaphore:
+                if self.leases:
+                    # The lease may have moved while waiting for a slot, and
+                    # the new owner may have checked the account already
+                    user = self.db.get_user(username)
+                    if not self.leases.holds(username.lower()) or not user or self.next_check_at(user) > datetime.now():
+                        return
+
+                with trace('scheduler.check', username=username):
+                    try:
+                        result = await self.service.check(username, track_new=False)
+                    except Exception as e:
+                        count_error('scheduler', e)
+                        result = {'success': False, 'username': username, 'error': str(e)}
+
+            if not result['success']:
+                logger.warning(f"Background check failed for {username}: {result['error']}")
+
+            interval, delay = check_schedule(user.get('check_interval'), result)
+            next_check_at = datetime.now() + timedelta(seconds=jittered(delay))
+            self.db.save_schedule(username, interval, next_check_at.isoformat())
+
+        except Exception as e:
+            count_error('scheduler', e)
+            logger.error(f"Error in background check for {username}: {e}")
+
+        finally:
+            self.in_flight.discard(username.lower())
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+
+from config import BULK_MAX_CONCURRENT
+from locks import KeyedLocks, account_key, chat_key
+from metrics import count_error
+from planner import plan_accounts, plan_total
+from tracker import check_user, changes_from_events
+
+logger = logging.getLogger(__name__)
+
+class CheckService:
+    """Check flow shared by the bot, the background scheduler and the CLI
+
+    Checks accounts against the storage and the API, then hands every
+    subscribed chat the changes it has not seen yet through
+    deliver(chat_id, result), where a front end renders them. Without
+    deliver the changes stay queued for each chat and go out with the
+    next check that has one.
+
+    Checks of one account, and unsubscribing from it, hold its lock in
+    locks, so concurrent updates queue behind each other instead of
+    computing the same delta twice. A chat's flows around one account
+    (the check and the replies about it) hold the account's chat lock
+    from the same KeyedLocks, outside the account lock.
+    """
+
+    def __init__(self, db, twitter_api, deliver=None):
+        self.db = db
+        self.twitter_api = twitter_api
+        self.deliver = deliver
+        self.locks = KeyedLocks()
+
+    async def check(self, username, chat_id=None, claim=False, track_new=True,
+                    on_progress=None, on_page=None):
+        """Check one account and deliver its changes to the subscribers
+
+        With chat_id the chat is subscribed. With claim as well, the
+        changes that chat has not seen yet are returned under 'unseen'
+        for the caller to show, instead of being delivered to it.
+        """
+        async with self.locks.hold(account_key(username)):
+            result = await check_user(
+                self.db, self.twitter_api, username,
+                chat_id=chat_id,
+                on_progress=on_progress,
+                on_page=on_page,
+                track_new=track_new
+            )
+            if not result['success']:
+                return result
+
+            if claim and chat_id is not None:
+                result['unseen'] = self.claim(username, chat_id, result['event_seq'])
+            self.fan_out(result)
+            return result
+
+    async def check_many(self, usernames, chat_id=None, track_new=True,
+                         max_concurrent=BULK_MAX_CONCURRENT, on_result=None):
+        """Check many accounts, at most max_concurrent at a time
+
+        A fixed pool of workers pulls the next username as soon as its
+        previous check is done, so slow accounts don't hold up the rest.
+        on_result is an optional coroutine called with every result as it
+        finishes. With chat_id, each account's check and on_result hold
+        its chat lock, so the chat's other updates about that account
+        don't interleave with it while the rest of the batch is waiting.
+        Results are returned in the order of usernames; a check that
+        raises becomes a failed result.
+        """
+        results = [None] * len(usernames)
+        pending = iter(enumerate(usernames))
+
+        async def worker():
+            for index, username in pending:
+                keys = [chat_key(chat_id, username)] if chat_id is not None else []
+                async with self.locks.hold(*keys):
+                    try:
+                        result = await self.check(username, chat_id=chat_id, track_new=track_new)
+                    except Exception as e:
+                        count_error('bulk', e)
+                        result = {'success': False, 'username': username, 'error': str(e)}
+
+                    results[index] = result
+                    if on_result:
+                        await on_result(result)
+
+        await asyncio.gather(*(worker() for _ in range(min(max_concurrent, len(usernames)))))
+        return results
+
+    def claim(self, username, chat_id, upto_seq):
+        """Changes of an account a chat has not seen yet, marking them seen"""
+        return changes_from_events(self.db.claim_events(username, chat_id, upto_seq))
+
+    def fan_out(self, result):
+        """Deliver to every subscriber the changes of a check it has not seen yet
+
+        Each chat gets the events after its own cursor, so a chat that
+        missed a delivery catches up instead of seeing only the last diff.
+        """
+        if self.deliver is None:
+            return
+
+        username = result['username']
+        for subscription in self.db.get_subscribers(username):
+            chat_id = subscription['chat_id']
+            events = self.db.claim_events(username, chat_id, result['event_seq'])
+            if events:
+                self.deliver(chat_id, dict(result, **changes_from_events(events)))
+
+    def tracked_usernames(self, chat_id=None):
+        """Usernames tracked in a chat, or by anyone without chat_id"""
+        users = self.db.get_chat_users(chat_id) if chat_id is not None else self.db.get_all_users()
+        return [user['username'] for user in users]
+
+    async def unsubscribe(self, username, chat_id):
+        """Stop tracking a user in one chat, dropping the user once no chat follows it"""
+        async with self.locks.hold(account_key(username)):
+            if not self.db.unsubscribe(username, chat_id):
+                return False
+            if not self.db.get_subscribers(username):
+                self.db.remove_user(username)
+            return True
+
+    async def plan(self, usernames):
+        """Predicted cost of checking usernames now: (plans, failed, total)"""
+        plans, failed = await plan_accounts(self.db, self.twitter_api, usernames)
+        return plans, failed, plan_total(plans, lookups=len(usernames))
@@ -0,0 +1,49 @@
+import os
+
+from database import Database
+
+def profile(user_id):
+    return {'id': user_id, 'userName': f"user{user_id}"}
+
+def seqs(events):
+    return [event['seq'] for event in events]
+
+def test_json_events_are_read_by_seq_range(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    db = Database()
+    db.save_user('alice', profile(1), 0, [])
+    for user_id in range(10, 20):
+        db.append_events('alice', [profile(user_id)], [])
+
+    assert seqs(db.get_events('alice')) == list(range(1, 11))
+    assert seqs(db.get_events('alice', 3, 6)) == [4, 5, 6]
+    assert seqs(db.get_events('alice', 10)) == []
+    assert db.get_events('alice', 4, 5)[0]['user_id'] == '14'
+
+    # A line another worker is still writing is left for the next read
+    with open(db.events_path('alice'), 'a') as f:
+        f.write('{"seq": 11, "kind": "fol')
+    assert seqs(db.get_events('alice', 8)) == [9, 10]
+
+def test_json_event_index_notices_a_rewritten_log(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    db = Database()
+    other = Database()
+    db.save_user('alice', profile(1), 0, [])
+    db.append_events('alice', [profile(1000000), profile(1000001)], [])
+    assert seqs(db.get_events('alice')) == [1, 2]
+
+    # Another worker removes and tracks the account again, and the new
+    # log grows past the old size
+    other.remove_user('alice')
+    other.save_user('alice', profile(1), 0, [])
+    other.append_events('alice', [profile(user_id) for user_id in range(20, 25)], [])
+    stat = os.stat(db.events_path('alice'))
+    assert stat.st_size > db.event_indexes['alice']['size']
+    # As if the filesystem had handed the old inode out again
+    db.event_indexes['alice']['file'] = (stat.st_dev, stat.st_ino)
+
+    events = db.get_events('alice')
+    assert seqs(events) == [1, 2, 3, 4, 5]
+    assert [event['user_id'] for event in events] == ['20', '21', '22', '23', '24']
+    assert [event['user_id'] for event in db.get_events('alice', 1, 2)] == ['21']
@@ -0,0 +1,77 @@
+import asyncio
+
+import service
+from locks import KeyedLocks, chat_key
+from service import CheckService
+
+def test_same_key_never_overlaps():
+    locks = KeyedLocks()
+    active = {}
+    most = {'same': 0, 'all': 0}
+
+    async def task(key):
+        async with locks.hold(key):
+            active[key] = active.get(key, 0) + 1
+            most['same'] = max(most['same'], active[key])
+            most['all'] = max(most['all'], sum(active.values()))
+            await asyncio.sleep(0.001)
+            active[key] -= 1
+
+    async def main():
+        await asyncio.gather(*(task(('account', f"user{i % 3}")) for i in range(60)))
+
+    asyncio.run(main())
+    assert most['same'] == 1
+    assert most['all'] == 3
+    assert not locks.locks and not locks.users
+
+def test_check_many_locks_each_account_not_the_batch(monkeypatch):
+    log = []
+
+    async def fake_check_user(db, twitter_api, username, **kwargs):
+        log.append(('start', username))
+        await asyncio.sleep(0.01)
+        return {'success': True, 'username': username, 'event_seq': 0}
+
+    monkeypatch.setattr(service, 'check_user', fake_check_user)
+    checks = CheckService(db=None, twitter_api=None)
+    usernames = [f"user{i}" for i in range(8)]
+
+    async def on_result(result):
+        # The notification runs under the account's chat lock too
+        assert checks.locks.locks[chat_key(1, result['username'])].locked()
+        await asyncio.sleep(0.005)
+        log.append(('end', result['username']))
+
+    async def handler(username):
+        # Another update of the same chat, like /track or /remove
+        async with checks.locks.hold(chat_key(1, username)):
+            log.append(('start', username))
+            await asyncio.sleep(0.01)
+            log.append(('end', username))
+
+    async def main():
+        batch = asyncio.create_task(
+            checks.check_many(usernames, chat_id=1, max_concurrent=2, on_result=on_result)
+        )
+        await asyncio.sleep(0)
+        await asyncio.gather(handler('USER0'), handler('user5'), handler('other'))
+        handled_before_batch = not batch.done()
+        return await batch, handled_before_batch
+
+    results, handled_before_batch = asyncio.run(main())
+    assert [result['username'] for result in results] == usernames
+    # The batch only holds the chat lock of the accounts it is checking
+    assert handled_before_batch
+
+    # Everything done about an account, a batch check with its
+    # notification or another update, runs alone
+    running = {}
+    for what, username in log:
+        username = username.lower()
+        if what == 'start':
+            assert not running.get(username), f"{username} interleaved"
+            running[username] = True
+        elif what == 'end':
+            running[username] = False
+    assert not any(running.values())
@@ -0,0 +1,64 @@
+from database import Database, SQLiteDatabase
+
+def profile(user_id, name):
+    return {'id': user_id, 'userName': name, 'name': name.title(), 'following_count': 3}
+
+def events_of(db, username, after_seq=0):
+    return [(event['kind'], event['user_id']) for event in db.get_events(username, after_seq)]
+
+def test_json_store_round_trips_into_sqlite(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    json_db = Database()
+    json_db.save_user('Alice', profile(1, 'alice'), 3, [13, 12, 11], chat_id=100,
+                      fingerprint='abc', partial_snapshot=True)
+    json_db.subscribe('Alice', 100)
+    json_db.save_user('bob', profile(2, 'bob'), 2, [22, 21])
+    json_db.subscribe('bob', 100)
+    json_db.subscribe('bob', 200)
+
+    # Interleaved so the JSON per-user sequence numbers differ from SQLite's
+    json_db.append_events('Alice', [profile(14, 'new1')], [11])
+    json_db.append_events('bob', [profile(23, 'new2'), profile(24, 'new3')], [])
+    json_db.claim_events('bob', 100, json_db.latest_event_seq('bob'))
+    json_db.append_events('Alice', [profile(15, 'new4')], [])
+    json_db.claim_events('Alice', 100, 1)
+    json_db.append_events('bob', [], [21])
+    json_db.subscribe('Alice', 300)
+    json_db.unsubscribe('bob', 200)
+    json_db.save_checkpoint('bob', {'cursor': 'c1', 'pending': []})
+
+    expected = {
+        username: {
+            'user': json_db.get_user(username),
+            'snapshot': json_db.get_following_snapshot(username),
+            'checkpoint': json_db.get_checkpoint(username),
+            'events': events_of(json_db, username),
+            'unseen': {
+                subscription['chat_id']: events_of(json_db, username, subscription['last_seen_seq'])
+                for subscription in json_db.get_subscribers(username)
+            }
+        }
+        for username in ('alice', 'bob')
+    }
+
+    sqlite_db = SQLiteDatabase()
+    try:
+        assert {user['username'] for user in sqlite_db.get_all_users()} == {'Alice', 'bob'}
+        for username, want in expected.items():
+            user = sqlite_db.get_user(username)
+            for field in ('user_id', 'following_count', 'fingerprint', 'partial_snapshot', 'user_info'):
+                assert user[field] == want['user'][field], field
+            assert sqlite_db.get_following_snapshot(username) == want['snapshot']
+            assert sqlite_db.get_checkpoint(username) == want['checkpoint']
+            assert events_of(sqlite_db, username) == want['events']
+
+            subscribers = sqlite_db.get_subscribers(username)
+            assert {s['chat_id'] for s in subscribers} == set(want['unseen'])
+            for subscription in subscribers:
+                unseen = events_of(sqlite_db, username, subscription['last_seen_seq'])
+                assert unseen == want['unseen'][subscription['chat_id']]
+
+        assert sqlite_db.get_profiles(['14', '24'])['24']['userName'] == 'new3'
+    finally:
+        sqlite_db.close()
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from database import Database, SQLiteDatabase
+from tracker import check_user
+
+class FakeAPI:
+    """Just enough of the Twitter client for check_user, with a hook mid-pagination"""
+
+    def __init__(self, following):
+        self.following = following
+        self.during = None
+
+    async def get_user_info(self, username):
+        return {'success': True, 'data': {'id': '1', 'userName': username, 'following': len(self.following)}}
+
+    async def fetch_following_snapshot(self, username):
+        return {'success': True, 'following_ids': list(self.following), 'complete': True, 'pages_fetched': 1}
+
+    async def get_user_following(self, username, page_size):
+        return {'success': True, 'followings': [{'id': user_id} for user_id in self.following[:page_size]]}
+
+    async def stream_following_changes(self, username, known_ids, previous_count, current_count, **kwargs):
+        if self.during:
+            during, self.during = self.during, None
+            await during()
+        yield 'result', {
+            'success': True,
+            'new_followings': [{'id': user_id} for user_id in self.following if user_id not in known_ids],
+            'unfollowed_ids': [user_id for user_id in known_ids if user_id not in self.following],
+            'following_ids': list(self.following),
+            'complete': True,
+            'pages_fetched': 1,
+            'checkpoint': None
+        }
+
+@pytest.fixture(params=['json', 'sqlite'])
+def open_db(request, monkeypatch, tmp_path):
+    """Opens another handle on one store, like another worker process would"""
+    monkeypatch.chdir(tmp_path)
+    opened = []
+
+    def open_db():
+        db = Database() if request.param == 'json' else SQLiteDatabase(str(tmp_path / 'tracker.db'))
+        opened.append(db)
+        return db
+
+    yield open_db
+    for db in opened:
+        if isinstance(db, SQLiteDatabase):
+            db.close()
+
+def test_concurrent_checks_record_changes_once(open_db):
+    worker, cli = open_db(), open_db()
+    api = FakeAPI([3, 2, 1])
+
+    async def main():
+        assert (await check_user(worker, api, 'alice'))['status'] == 'tracked'
+        api.following = [4, 3, 2]
+
+        # The CLI checks the account while the worker is paginating
+        async def other_check():
+            other['result'] = await check_user(cli, api, 'alice')
+        other = {}
+        api.during = other_check
+        return await check_user(worker, api, 'alice'), other['result']
+
+    result, other = asyncio.run(main())
+
+    assert other['status'] == 'changed' and not other.get('superseded')
+    assert result['superseded'] and result['status'] == 'changed'
+    assert [user['id'] for user in result['new_followings']] == ['4']
+    assert result['unfollowed_ids'] == ['1']
+    assert result['event_seq'] == other['event_seq']
+
+    events = worker.get_events('alice')
+    assert [(event['kind'], event['user_id']) for event in events] == [('follow', '4'), ('unfollow', '1')]
+    assert worker.get_following_snapshot('alice') == [4, 3, 2]
+    assert asyncio.run(check_user(worker, api, 'alice'))['status'] == 'unchanged'
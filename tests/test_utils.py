@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+
+from database import Database
+from utils import parse_since
+
+def test_parse_since_returns_naive_local_time():
+    now = datetime(2024, 5, 8, 12, 0)
+    assert parse_since('7d', now) == datetime(2024, 5, 1, 12, 0)
+    assert parse_since('2024-05-01') == datetime(2024, 5, 1)
+
+    aware = datetime(2024, 5, 1, 10, 0, tzinfo=timezone(timedelta(hours=3)))
+    since = parse_since(aware.isoformat())
+    assert since.tzinfo is None
+    assert since == aware.astimezone().replace(tzinfo=None)
+
+    for text in ('2024-05-01T10:00Z', '2024-05-01 10:00:00+00:00'):
+        assert parse_since(text).tzinfo is None
+    for text in ('soon', '99999999999w', '0001-01-01T00:00+05:00'):
+        assert parse_since(text) is None
+
+def test_history_accepts_a_date_with_an_offset(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    db = Database()
+    db.save_user('alice', {'id': 1, 'userName': 'alice'}, 0, [])
+    db.append_events('alice', [{'id': 10, 'userName': 'bob'}], [])
+
+    since = parse_since((datetime.now(timezone.utc) - timedelta(hours=1)).isoformat())
+    assert [event['user_id'] for event in db.get_history('alice', since=since)] == ['10']
+    assert db.count_history('alice', since) == 1
@@ -0,0 +1,253 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import secrets
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from config import (
+    TRACING_ENABLED,
+    TRACE_DIR,
+    TRACE_FILE_MAX_BYTES,
+    TRACE_FILE_BACKUPS,
+    TRACE_RECENT
+)
+
+logger = logging.getLogger(__name__)
+
+# Span currently open in this task; None outside of a trace
+current_span = ContextVar('current_span', default=None)
+
+class Span:
+    """One timed operation inside a trace"""
+
+    def __init__(self, name, trace, parent=None, attrs=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(4)
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = attrs or {}
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.spans.append(self)
+
+    def to_dict(self):
+        return {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.started_at, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'attrs': self.attrs,
+            'error': self.error
+        }
+
+class Trace:
+    """Spans recorded while handling one update or background check"""
+
+    def __init__(self, name, attrs):
+        self.trace_id = secrets.token_hex(8)
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.root = Span(name, self, attrs=attrs)
+        # Spans held for work outliving the root, e.g. queued sends
+        self.holds = 0
+
+    @property
+    def duration(self):
+        return self.root.duration
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'time': datetime.fromtimestamp(self.root.started_at).isoformat(),
+            'duration_ms': round(self.duration * 1000, 3),
+            'attrs': self.attrs,
+            'error': self.root.error,
+            'spans': [span.to_dict() for span in self.spans]
+        }
+
+    def breakdown(self):
+        """Total seconds and count per span name, slowest first, root excluded"""
+        totals = {}
+        for span in self.spans:
+            if span is self.root:
+                continue
+            total, count = totals.get(span.name, (0, 0))
+            totals[span.name] = (total + span.duration, count + 1)
+        return sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+
+class TraceExporter:
+    """Writes finished traces to a rotating JSONL file and keeps the recent ones"""
+
+    def __init__(self, directory=TRACE_DIR, max_bytes=TRACE_FILE_MAX_BYTES,
+                 backups=TRACE_FILE_BACKUPS, recent=TRACE_RECENT):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.recent = deque(maxlen=recent)
+        self.handler = None
+
+    def open(self):
+        """Create the rotating file handler on first use"""
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.handler = RotatingFileHandler(
+            os.path.join(self.directory, 'traces.jsonl'),
+            maxBytes=self.max_bytes,
+            backupCount=self.backups,
+            encoding='utf-8'
+        )
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def export(self, trace):
+        self.recent.append(trace)
+        try:
+            if self.handler is None:
+                self.open()
+            record = logging.makeLogRecord({'msg': json.dumps(trace.to_dict()), 'levelno': logging.INFO})
+            self.handler.emit(record)
+        except OSError as e:
+            logger.error(f"Error exporting trace: {e}")
+
+    def slowest(self, limit=10):
+        """Slowest of the recently finished traces"""
+        return sorted(self.recent, key=lambda trace: trace.duration, reverse=True)[:limit]
+
+    def close(self):
+        if self.handler is not None:
+            self.handler.close()
+            self.handler = None
+
+exporter = TraceExporter()
+
+@contextmanager
+def trace(name, **attrs):
+    """Start a trace for the with block; nested inside one, acts as a span"""
+    if not TRACING_ENABLED:
+        yield
+        return
+    if current_span.get() is not None:
+        with span(name, **attrs):
+            yield
+        return
+
+    new_trace = Trace(name, attrs)
+    token = current_span.set(new_trace.root)
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        new_trace.root.finish(error)
+        if not new_trace.holds:
+            exporter.export(new_trace)
+
+@contextmanager
+def span(name, **attrs):
+    """Time the with block as a child of the current span (no-op outside a trace)"""
+    parent = current_span.get()
+    if parent is None:
+        yield
+        return
+
+    child = Span(name, parent.trace, parent, attrs)
+    token = current_span.set(child)
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        child.finish(error)
+
+def hold():
+    """Current span, kept for work that runs later elsewhere; None outside a trace
+
+    Its trace is only exported once the root span finished and every
+    span taken with hold() was given back with release().
+    """
+    parent = current_span.get()
+    if parent is not None:
+        parent.trace.holds += 1
+    return parent
+
+def release(parent):
+    """Give back a span taken with hold()"""
+    if parent is None:
+        return
+    held_trace = parent.trace
+    held_trace.holds -= 1
+    if not held_trace.holds and held_trace.root.duration is not None:
+        exporter.export(held_trace)
+
+@contextmanager
+def span_under(parents, name, **attrs):
+    """Time the with block as a child of each held span (no-op without any)"""
+    parents = [parent for parent in parents if parent is not None]
+    if not parents:
+        yield
+        return
+
+    children = [Span(name, parent.trace, parent, attrs) for parent in parents]
+    token = current_span.set(children[0])
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        for child in children:
+            child.finish(error)
+
+def traced(name):
+    """Decorator wrapping a sync or async function in a span"""
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+def trace_handler(command, handler):
+    """Wrap a Telegram handler so every update it handles starts a trace"""
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        user = update.effective_user
+        args = ' '.join(getattr(context, 'args', None) or [])
+        with trace(f"handler.{command}", user_id=user.id if user else None, args=args):
+            return await handler(update, context)
+
+    return wrapper
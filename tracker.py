@@ -0,0 +1,299 @@
+from config import FINGERPRINT_PAGE_SIZE
+from metrics import CHECK_PAGES
+from planner import checkpoint_usable, plan_check, log_cost
+from ratelimit import spend_ledger
+from twitter_api import following_fingerprint, following_id, following_page_size
+
+def snapshot_fingerprint(following_ids):
+    """Fingerprint of the newest following IDs, as far as the fingerprint page reaches"""
+    return following_fingerprint(following_ids[:following_page_size(FINGERPRINT_PAGE_SIZE)])
+
+def page_fingerprint(followings):
+    """Fingerprint of a fetched first followings page"""
+    return snapshot_fingerprint([
+        user_id for user_id in map(following_id, followings) if user_id is not None
+    ])
+
+def usable_checkpoint(db, username, known_ids):
+    """Stored pagination checkpoint, unless it is too old or for another snapshot"""
+    checkpoint = db.get_checkpoint(username)
+    if not checkpoint:
+        return None
+
+    if not checkpoint_usable(checkpoint, len(known_ids)):
+        db.clear_checkpoint(username)
+        return None
+    return checkpoint
+
+def check_result(username, status, user_data, difference=0, **extra):
+    """Build the result dict for check_user"""
+    result = {
+        'success': True,
+        'username': username,
+        'status': status,
+        'user_data': user_data,
+        'current_following': user_data.get('following', 0),
+        'difference': difference,
+        'new_followings': [],
+        'unfollowed_ids': [],
+        'pages_fetched': 0,
+        'complete': True,
+        'event_seq': 0,
+        'cost': None
+    }
+    result.update(extra)
+    CHECK_PAGES.observe(result['pages_fetched'], status=status)
+    return result
+
+def superseded_result(db, username, user_data, after_seq, **extra):
+    """Result of a check another worker recorded one of first
+
+    The changes logged since after_seq are reported in place of the
+    ones this check found, and the other worker's snapshot is kept.
+    """
+    event_seq = db.latest_event_seq(username)
+    changes = changes_from_events(db.get_events(username, after_seq, event_seq))
+    return check_result(
+        username, 'changed' if has_changes(changes) else 'unchanged', user_data,
+        event_seq=event_seq, superseded=True, **changes, **extra
+    )
+
+def has_changes(result):
+    """True when a check found follows or unfollows to report"""
+    return bool(result.get('new_followings') or result.get('unfollowed_ids'))
+
+def changes_from_events(events):
+    """New followings and unfollowed IDs recorded in follow events"""
+    return {
+        'new_followings': [
+            event['profile'] or {'id': event['user_id']}
+            for event in events if event['kind'] == 'follow'
+        ],
+        'unfollowed_ids': [event['user_id'] for event in events if event['kind'] == 'unfollow']
+    }
+
+def record_streamed(db, username, chat_id, streamed):
+    """Log follows on_page already sent during a check that then failed
+
+    Follows the checkpoint still holds as pending are stored as events
+    and dropped from it, so the run resuming it does not send them
+    again. The chat's cursor moves past them when it had seen every
+    earlier event.
+    """
+    checkpoint = db.get_checkpoint(username)
+    if not streamed or checkpoint is None:
+        return
+
+    streamed_ids = {following_id(user) for user in streamed}
+    sent = [user for user in checkpoint['pending'] if following_id(user) in streamed_ids]
+    if not sent:
+        return
+
+    latest = db.latest_event_seq(username)
+    caught_up = chat_id is not None and any(
+        subscription['chat_id'] == chat_id and subscription['last_seen_seq'] >= latest
+        for subscription in db.get_subscribers(username)
+    )
+    seq = db.append_events(username, sent, [])
+    if caught_up:
+        db.claim_events(username, chat_id, seq)
+    db.save_checkpoint(username, dict(
+        checkpoint,
+        pending=[user for user in checkpoint['pending'] if following_id(user) not in streamed_ids]
+    ))
+
+async def check_user(db, twitter_api, username, chat_id=None, on_progress=None, on_page=None,
+                     track_new=True):
+    """Check one account for following changes and update the database
+
+    Used by the /track handler and the background scheduler. Status is
+    'tracked' for a new account, 'snapshot' when a legacy record got its
+    first following snapshot, 'changed' or 'unchanged' otherwise.
+    When the following count did not change, one page of the newest
+    followings is compared against the stored fingerprint; if it
+    differs, follows were offset by unfollows and the full diff runs
+    (stage 'churn'), starting from that page.
+    on_progress is an optional coroutine called as (stage, difference,
+    plan) before slow pagination starts, plan being the predicted cost
+    from plan_check. on_page is an optional coroutine
+    called with every followings page as soon as it arrives, while the
+    next one is being fetched; when the check then fails, the follows
+    it was handed are logged right away instead of being kept for the
+    resuming run (record_streamed). With track_new=False, accounts that
+    are not tracked (e.g. removed meanwhile) are left alone.
+
+    With chat_id the chat is subscribed to the account. Detected changes
+    are stored as follow events; event_seq in the result is the newest
+    one, for handing them to subscribers with claim_events. cost holds
+    the predicted and actual calls and credits of the pagination.
+
+    Another process (the CLI, another webhook worker) may check the same
+    account meanwhile. The check reads its snapshot together with the
+    newest event seq and only records its outcome if no events were
+    added since; otherwise superseded is set in the result and it
+    reports what the other check recorded.
+    """
+    if not track_new and not db.get_user(username):
+        return {
+            'success': False,
+            'username': username,
+            'error': 'User is not tracked'
+        }
+
+    user_info_result = await twitter_api.get_user_info(username)
+
+    if not user_info_result['success']:
+        return dict(user_info_result, username=username)
+
+    user_data = user_info_result['data']
+    current_following = user_data.get('following', 0)
+
+    with db.exclusive():
+        existing_user = db.get_user(username)
+        known_ids = db.get_following_snapshot(username) if existing_user else None
+        base_seq = db.latest_event_seq(username)
+
+    if known_ids is None:
+        # New account, or tracked before snapshots existed - take a baseline
+        plan = plan_check(username, 0, current_following, has_snapshot=False)
+        if on_progress:
+            await on_progress('snapshot', 0, plan)
+
+        with spend_ledger() as spent:
+            snapshot_result = await twitter_api.fetch_following_snapshot(username)
+        log_cost(plan, spent)
+        if not snapshot_result['success']:
+            return dict(snapshot_result, username=username)
+
+        # Cut off at the page limit, the snapshot only covers the newest
+        # follows; later diffs stop at its end instead of reading past it
+        db.save_user(
+            username, user_data, current_following,
+            snapshot_result['following_ids'],
+            fingerprint=snapshot_fingerprint(snapshot_result['following_ids']),
+            partial_snapshot=not snapshot_result['complete']
+        )
+        if chat_id is not None:
+            db.subscribe(username, chat_id)
+        return check_result(
+            username,
+            'snapshot' if existing_user else 'tracked',
+            user_data,
+            pages_fetched=snapshot_result['pages_fetched'],
+            complete=snapshot_result['complete'],
+            event_seq=db.latest_event_seq(username),
+            cost={'predicted': plan, 'actual': spent}
+        )
+
+    if chat_id is not None:
+        # Before any new events, so this chat's cursor sits in front of them
+        db.subscribe(username, chat_id)
+
+    previous_following = existing_user['following_count']
+    checkpoint = usable_checkpoint(db, username, known_ids)
+
+    if checkpoint:
+        # Continue unfinished pagination against the counts it started with
+        previous_following = checkpoint['previous_count']
+        current_following = checkpoint['current_count']
+
+    difference = current_following - previous_following
+    plan = plan_check(username, previous_following, current_following, checkpoint=checkpoint)
+    first_page = None
+
+    with spend_ledger() as spent:
+        if difference == 0 and not checkpoint:
+            fingerprint = None
+            if FINGERPRINT_PAGE_SIZE:
+                first_page = await twitter_api.get_user_following(
+                    username, page_size=following_page_size(FINGERPRINT_PAGE_SIZE)
+                )
+                if not first_page['success']:
+                    return dict(first_page, username=username)
+                fingerprint = page_fingerprint(first_page['followings'])
+
+            # Records from before fingerprints compare against their snapshot
+            stored = existing_user.get('fingerprint') or snapshot_fingerprint(known_ids)
+            if fingerprint is None or fingerprint == stored:
+                saved = db.save_user(
+                    username, user_data, current_following, fingerprint=fingerprint, after_seq=base_seq
+                )
+                if saved is None:
+                    return superseded_result(
+                        db, username, user_data, base_seq,
+                        pages_fetched=1 if first_page else 0,
+                        cost={'predicted': plan, 'actual': spent}
+                    )
+                return check_result(
+                    username, 'unchanged', user_data,
+                    pages_fetched=1 if first_page else 0,
+                    event_seq=base_seq,
+                    cost={'predicted': plan, 'actual': spent}
+                )
+
+        if on_progress:
+            await on_progress('churn' if first_page else 'changes', difference, plan)
+
+        # Stream exact follows and unfollows since the last snapshot
+        streamed = []
+        try:
+            async for kind, data in twitter_api.stream_following_changes(
+                username, known_ids, previous_following, current_following,
+                checkpoint=checkpoint,
+                on_checkpoint=lambda state: db.save_checkpoint(username, state),
+                first_page=first_page,
+                partial=bool(existing_user.get('partial_snapshot'))
+            ):
+                if kind == 'result':
+                    changes = data
+                elif on_page and data['new_followings']:
+                    await on_page(data)
+                    streamed.extend(data['new_followings'])
+        except Exception:
+            record_streamed(db, username, chat_id, streamed)
+            raise
+    log_cost(plan, spent)
+
+    if not changes['success']:
+        record_streamed(db, username, chat_id, streamed)
+        return dict(changes, username=username)
+
+    with db.exclusive():
+        event_seq = db.append_events(
+            username, changes['new_followings'], changes['unfollowed_ids'], after_seq=base_seq
+        )
+        if event_seq is None:
+            return superseded_result(
+                db, username, user_data, base_seq,
+                pages_fetched=changes['pages_fetched'],
+                cost={'predicted': plan, 'actual': spent}
+            )
+
+        if changes['complete']:
+            # Saving the new snapshot also drops the checkpoint
+            # The page seen next time matches the one just fetched, even when
+            # it skips entries the snapshot has
+            db.save_user(
+                username, user_data, current_following,
+                changes['following_ids'],
+                fingerprint=page_fingerprint(first_page['followings']) if first_page
+                else snapshot_fingerprint(changes['following_ids'])
+            )
+        else:
+            # Counts stay as they were so the next check resumes from here
+            db.save_checkpoint(username, changes['checkpoint'])
+
+    found = changes['new_followings'] or changes['unfollowed_ids']
+    return check_result(
+        username,
+        'changed' if found or difference else 'unchanged',
+        user_data,
+        difference,
+        new_followings=changes['new_followings'],
+        unfollowed_ids=changes['unfollowed_ids'],
+        pages_fetched=changes['pages_fetched'],
+        complete=changes['complete'],
+        resumed=bool(checkpoint),
+        event_seq=event_seq,
+        cost={'predicted': plan, 'actual': spent}
+    )
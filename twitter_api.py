@@ -1,144 +1,626 @@
-import requests
-from config import TWITTER_API_KEY, TWITTER_API_BASE_URL, ENDPOINTS
-
-class TwitterAPI:
-    def __init__(self):
-        self.api_key = TWITTER_API_KEY
-        self.base_url = TWITTER_API_BASE_URL
-        self.headers = {
-            'X-API-Key': self.api_key
-        }
-    
-    def get_user_info(self, username):
-        """Get user information"""
-        url = f"{self.base_url}{ENDPOINTS['user_info']}"
-        params = {'userName': username}
-        
-        try:
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get('status') == 'success':
-                return {
-                    'success': True,
-                    'data': data.get('data')
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': data.get('msg', 'Unknown error')
-                }
-        except requests.exceptions.RequestException as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    def get_user_following(self, username, page_size=20, cursor=None):
-        """Get user following list"""
-        url = f"{self.base_url}{ENDPOINTS['user_following']}"
-        params = {
-            'userName': username,
-            'pageSize': page_size
-        }
-        
-        if cursor:
-            params['cursor'] = cursor
-        
-        try:
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get('status') == 'success':
-                return {
-                    'success': True,
-                    'followings': data.get('followings', []),
-                    'has_next_page': data.get('has_next_page', False),
-                    'next_cursor': data.get('next_cursor')
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': data.get('msg', 'Unknown error')
-                }
-        except requests.exceptions.RequestException as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    def get_my_credits(self):
-        """Get account credits information"""
-        url = f"{self.base_url}{ENDPOINTS['my_info']}"
-        
-        try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            return {
-                'success': True,
-                'recharge_credits': data.get('recharge_credits', 0),
-                'total_bonus_credits': data.get('total_bonus_credits', 0)
-            }
-        except requests.exceptions.RequestException as e:
-            return {
-                'success': False,
-                'error': str(e)
-            }
-    
-    def fetch_new_followings(self, username, difference):
-        """Fetch new followings based on difference with pagination support"""
-        all_followings = []
-        remaining = difference
-        cursor = None
-        page_count = 0
-        max_pages = 10  # Safety limit to prevent infinite loops
-        
-        while remaining > 0 and page_count < max_pages:
-            # Calculate page size for this iteration: min 20, max 200
-            page_size = max(20, min(remaining, 200))
-            
-            # Fetch followings
-            result = self.get_user_following(username, page_size=page_size, cursor=cursor)
-            
-            if not result['success']:
-                # If error on first page, return error
-                if page_count == 0:
-                    return result
-                # If error on subsequent pages, return what we have
-                break
-            
-            # Add followings to collection
-            followings = result['followings']
-            all_followings.extend(followings)
-            
-            # Update remaining count
-            remaining -= len(followings)
-            page_count += 1
-            
-            # Check if we need to continue
-            if remaining <= 0:
-                break
-            
-            # Check if there's next page
-            if not result.get('has_next_page'):
-                break
-            
-            # Get cursor for next page
-            cursor = result.get('next_cursor')
-            if not cursor:
-                break
-        
-        # Return only the exact number requested
-        new_followings = all_followings[:difference]
-        
-        return {
-            'success': True,
-            'new_followings': new_followings,
-            'count': len(new_followings),
-            'total_fetched': len(all_followings),
-            'pages_fetched': page_count
-        }
\ No newline at end of file
+import asyncio
+import hashlib
+from datetime import datetime
+import httpx
+import requests
+from cache import TTLCache, SingleFlight
+from metrics import API_REQUEST_SECONDS, count_error
+from profiles import project_profile
+from tracing import span
+from ratelimit import ApiDispatcher, RequestDeferred, PRIORITY_BACKGROUND, request_priority
+from config import (
+    TWITTER_API_KEY,
+    TWITTER_API_BASE_URL,
+    ENDPOINTS,
+    API_TIMEOUT,
+    API_CONNECT_TIMEOUT,
+    API_MAX_CONNECTIONS,
+    API_MAX_KEEPALIVE,
+    FOLLOWING_MAX_PAGES,
+    SNAPSHOT_MAX_PAGES,
+    USER_INFO_CACHE_SIZE,
+    USER_INFO_CACHE_TTL,
+    CREDITS_CACHE_TTL
+)
+
+def parse_user_info(data):
+    """Build result dict from /twitter/user/info response"""
+    if data.get('status') == 'success':
+        return {
+            'success': True,
+            'data': data.get('data')
+        }
+    return {
+        'success': False,
+        'error': data.get('msg', 'Unknown error')
+    }
+
+def parse_user_following(data):
+    """Build result dict from /twitter/user/followings response"""
+    if data.get('status') == 'success':
+        return {
+            'success': True,
+            'followings': data.get('followings', []),
+            'has_next_page': data.get('has_next_page', False),
+            'next_cursor': data.get('next_cursor')
+        }
+    return {
+        'success': False,
+        'error': data.get('msg', 'Unknown error')
+    }
+
+def parse_my_credits(data):
+    """Build result dict from /oapi/my/info response"""
+    return {
+        'success': True,
+        'recharge_credits': data.get('recharge_credits', 0),
+        'total_bonus_credits': data.get('total_bonus_credits', 0)
+    }
+
+def error_result(error):
+    """Build failed result dict from an exception"""
+    return {
+        'success': False,
+        'error': str(error) or error.__class__.__name__
+    }
+
+def following_page_size(remaining):
+    """Page size for the next followings request: min 20, max 200"""
+    return max(20, min(remaining, 200))
+
+def following_id(user):
+    """Numeric Twitter ID of a followings entry, or None"""
+    try:
+        return int(user.get('id'))
+    except (TypeError, ValueError):
+        return None
+
+def following_fingerprint(following_ids):
+    """Short hash of following IDs in order, newest first"""
+    return hashlib.sha1(','.join(str(user_id) for user_id in following_ids).encode()).hexdigest()[:16]
+
+def following_page(new_followings, pages_fetched):
+    """Build a page item for stream_following_changes"""
+    return {
+        'new_followings': new_followings,
+        'count': len(new_followings),
+        'pages_fetched': pages_fetched
+    }
+
+def snapshot_result(following_ids, pages_fetched, complete=True):
+    """Build the result dict for fetch_following_snapshot"""
+    return {
+        'success': True,
+        'following_ids': following_ids,
+        'pages_fetched': pages_fetched,
+        'complete': complete
+    }
+
+class FollowingDiff:
+    """Diff followings pages, newest first, against a stored ID snapshot
+
+    Entries not in the snapshot are new follows. Once pages overlap the
+    snapshot, snapshot IDs skipped over are unfollows. The count change
+    tells how many unfollows to expect, so pagination stops as soon as
+    all of them are found instead of walking the whole list.
+
+    A partial snapshot only holds the newest follows (the snapshot fetch
+    hit its page limit). Its diff stops at the snapshot's last ID: IDs
+    found after reaching the snapshot are older follows, not new ones,
+    and unfollows past the end can't be seen.
+
+    The progress can be saved with state() after any page and passed
+    back as checkpoint to continue in a later run. new_followings only
+    holds follows that were not handed out in an earlier run yet.
+    """
+
+    def __init__(self, known_ids, previous_count, current_count, checkpoint=None, partial=False):
+        self.known_ids = list(known_ids)
+        self.partial = partial
+        self.positions = {user_id: pos for pos, user_id in enumerate(self.known_ids)}
+        self.previous_count = previous_count
+        self.current_count = current_count
+        self.new_followings = []
+        self.added_total = 0
+        self.seen_ids = []
+        self.seen = set()
+        self.last_positions = []
+        self.exhausted = False
+        self.finished = False
+
+        if checkpoint:
+            self.seen_ids = list(checkpoint['seen_ids'])
+            self.seen = set(self.seen_ids)
+            self.last_positions = list(checkpoint['last_positions'])
+            self.added_total = checkpoint['added_total']
+            self.new_followings = list(checkpoint['pending'])
+
+    @property
+    def expected_removals(self):
+        """Unfollows implied by the counts and the follows found so far"""
+        return max(self.previous_count + self.added_total - self.current_count, 0)
+
+    @property
+    def anchored(self):
+        """True once two snapshot IDs were seen in their stored order"""
+        return len(self.last_positions) == 2 and self.last_positions[0] < self.last_positions[1]
+
+    def frontier(self):
+        """Number of snapshot IDs the pages have moved past"""
+        if self.exhausted:
+            return len(self.known_ids)
+        if self.anchored:
+            return self.last_positions[-1] + 1
+        return 0
+
+    def removed_ids(self):
+        """Snapshot IDs passed over without being seen"""
+        return [
+            user_id for user_id in self.known_ids[:self.frontier()]
+            if user_id not in self.seen
+        ]
+
+    def next_page_size(self):
+        """Page size for the next request"""
+        if self.last_positions:
+            if len(self.removed_ids()) >= self.expected_removals:
+                # Nothing left to find but a second ID to anchor on
+                return following_page_size(2)
+            # In known territory, only unfollows are left to find
+            return following_page_size(200)
+        outstanding = self.current_count - self.previous_count - self.added_total
+        return following_page_size(max(outstanding, 0) + 2)
+
+    def add_page(self, followings):
+        """Consume one page; returns True when the diff is complete"""
+        reached = bool(self.last_positions)
+        known_on_page = False
+        for user in followings:
+            user_id = following_id(user)
+            if user_id is None or user_id in self.seen:
+                continue
+            self.seen.add(user_id)
+            self.seen_ids.append(user_id)
+
+            position = self.positions.get(user_id)
+            if position is None:
+                if self.partial and self.last_positions:
+                    # Older than the snapshot reaches, not a new follow
+                    continue
+                self.new_followings.append(project_profile(user))
+                self.added_total += 1
+            else:
+                known_on_page = True
+                self.last_positions = (self.last_positions + [position])[-2:]
+
+        if self.partial and self.last_positions and (
+            self.last_positions[-1] == len(self.known_ids) - 1 or (reached and not known_on_page)
+        ):
+            # At the snapshot's last ID, or a whole page past it
+            self.finish()
+        if self.anchored and len(self.removed_ids()) >= self.expected_removals:
+            self.finished = True
+        return self.finished
+
+    def finish(self):
+        """Mark the followings list as exhausted"""
+        self.exhausted = True
+        self.finished = True
+
+    def state(self, cursor, pages_fetched, pending=None):
+        """Checkpoint to continue the diff from cursor in a later run"""
+        return {
+            'cursor': cursor,
+            'pages_fetched': pages_fetched,
+            'previous_count': self.previous_count,
+            'current_count': self.current_count,
+            'known_count': len(self.known_ids),
+            'seen_ids': self.seen_ids,
+            'last_positions': self.last_positions,
+            'added_total': self.added_total,
+            'pending': self.new_followings if pending is None else pending,
+            'updated_at': datetime.now().isoformat()
+        }
+
+    def result(self, pages_fetched, cursor=None, total_pages=None):
+        """Build the result dict for fetch_following_changes"""
+        if not self.finished:
+            # Follows found so far are reported now; the rest continues later
+            return {
+                'success': True,
+                'new_followings': self.new_followings,
+                'unfollowed_ids': [],
+                'following_ids': None,
+                'count': len(self.new_followings),
+                'total_fetched': len(self.seen_ids),
+                'pages_fetched': pages_fetched,
+                'complete': False,
+                'checkpoint': self.state(cursor, total_pages, pending=[])
+            }
+
+        frontier = self.frontier()
+        following_ids = self.seen_ids + [
+            user_id for user_id in self.known_ids[frontier:]
+            if user_id not in self.seen
+        ]
+
+        return {
+            'success': True,
+            'new_followings': self.new_followings,
+            'unfollowed_ids': self.removed_ids(),
+            'following_ids': following_ids,
+            'count': len(self.new_followings),
+            'total_fetched': len(self.seen_ids),
+            'pages_fetched': pages_fetched,
+            'complete': True,
+            'checkpoint': None
+        }
+
+class TwitterAPI:
+    """Blocking client, kept for scripts and the interactive shell"""
+
+    def __init__(self):
+        self.api_key = TWITTER_API_KEY
+        self.base_url = TWITTER_API_BASE_URL
+        self.headers = {
+            'X-API-Key': self.api_key
+        }
+        self.timeout = (API_CONNECT_TIMEOUT, API_TIMEOUT)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+
+    def _get(self, endpoint, params=None):
+        """Send GET request and return decoded JSON"""
+        url = f"{self.base_url}{ENDPOINTS[endpoint]}"
+        try:
+            with span(f"api.{endpoint}", **(params or {})), API_REQUEST_SECONDS.time(endpoint=endpoint):
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                response.raise_for_status()
+                return response.json()
+        except Exception as e:
+            count_error(f"api:{endpoint}", e)
+            raise
+
+    def get_user_info(self, username):
+        """Get user information"""
+        try:
+            return parse_user_info(self._get('user_info', {'userName': username}))
+        except requests.exceptions.RequestException as e:
+            return error_result(e)
+
+    def get_user_following(self, username, page_size=20, cursor=None):
+        """Get user following list"""
+        params = {
+            'userName': username,
+            'pageSize': page_size
+        }
+
+        if cursor:
+            params['cursor'] = cursor
+
+        try:
+            return parse_user_following(self._get('user_following', params))
+        except requests.exceptions.RequestException as e:
+            return error_result(e)
+
+    def get_my_credits(self):
+        """Get account credits information"""
+        try:
+            return parse_my_credits(self._get('my_info'))
+        except requests.exceptions.RequestException as e:
+            return error_result(e)
+
+    def fetch_following_snapshot(self, username, max_pages=SNAPSHOT_MAX_PAGES):
+        """Fetch following IDs, newest first, to use as a diff baseline"""
+        following_ids = []
+        cursor = None
+        page_count = 0
+        complete = False
+
+        while page_count < max_pages:
+            result = self.get_user_following(username, page_size=200, cursor=cursor)
+            if not result['success']:
+                if page_count == 0:
+                    return result
+                # Keep the pages already paid for as a partial baseline
+                break
+
+            following_ids.extend(
+                user_id for user_id in map(following_id, result['followings'])
+                if user_id is not None
+            )
+            page_count += 1
+
+            cursor = result.get('next_cursor')
+            if not result.get('has_next_page') or not cursor:
+                complete = True
+                break
+
+        return snapshot_result(following_ids, page_count, complete)
+
+    def fetch_following_changes(self, username, known_ids, previous_count, current_count,
+                                max_pages=FOLLOWING_MAX_PAGES, checkpoint=None, on_checkpoint=None,
+                                partial=False):
+        """Fetch exact follows and unfollows since the stored snapshot
+
+        Resumes from checkpoint when given. on_checkpoint is called with
+        the progress after every page, so a failure or the page limit
+        never loses pages that were already paid for. partial marks a
+        snapshot holding only the newest follows (see FollowingDiff).
+        """
+        diff = FollowingDiff(known_ids, previous_count, current_count, checkpoint, partial)
+        cursor = checkpoint['cursor'] if checkpoint else None
+        pages_before = checkpoint['pages_fetched'] if checkpoint else 0
+        page_count = 0
+
+        while page_count < max_pages:
+            result = self.get_user_following(
+                username, page_size=diff.next_page_size(), cursor=cursor
+            )
+            if not result['success']:
+                return dict(result, resumable=bool(checkpoint or page_count))
+            page_count += 1
+
+            if diff.add_page(result['followings']):
+                break
+
+            cursor = result.get('next_cursor')
+            if not result.get('has_next_page') or not cursor:
+                diff.finish()
+                break
+
+            if on_checkpoint:
+                on_checkpoint(diff.state(cursor, pages_before + page_count))
+
+        return diff.result(page_count, cursor, pages_before + page_count)
+
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
+
+class AsyncTwitterAPI:
+    """Non-blocking client sharing one pooled keep-alive connection set
+
+    Concurrent identical calls are merged into one upstream request, and
+    successful user info and credits lookups are cached for a short TTL.
+    Every request passes through the shared ApiDispatcher rate limit.
+    """
+
+    def __init__(self):
+        self.api_key = TWITTER_API_KEY
+        self.base_url = TWITTER_API_BASE_URL
+        self.headers = {
+            'X-API-Key': self.api_key
+        }
+        self.timeout = httpx.Timeout(API_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+        self.limits = httpx.Limits(
+            max_connections=API_MAX_CONNECTIONS,
+            max_keepalive_connections=API_MAX_KEEPALIVE
+        )
+        self._client = None
+        self.user_info_cache = TTLCache(USER_INFO_CACHE_SIZE, USER_INFO_CACHE_TTL)
+        self.credits_cache = TTLCache(1, CREDITS_CACHE_TTL)
+        self.single_flight = SingleFlight()
+        self.dispatcher = ApiDispatcher()
+
+    @property
+    def client(self):
+        """Lazily create the pooled HTTP client inside the running loop"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits
+            )
+        return self._client
+
+    async def _get(self, endpoint, params=None):
+        """Send GET request through the dispatcher and return decoded JSON"""
+        if (endpoint != 'my_info' and request_priority.get() >= PRIORITY_BACKGROUND
+                and self.dispatcher.credits_stale()):
+            await self.get_my_credits()
+
+        try:
+            with span('ratelimit.wait'):
+                await self.dispatcher.acquire()
+            with span(f"api.{endpoint}", **(params or {})), API_REQUEST_SECONDS.time(endpoint=endpoint):
+                response = await self.client.get(ENDPOINTS[endpoint], params=params)
+                response.raise_for_status()
+                data = response.json()
+        except Exception as e:
+            count_error(f"api:{endpoint}", e)
+            raise
+        self.dispatcher.record_spend(endpoint, data)
+        return data
+
+    async def _fetch_user_info(self, username):
+        """Request user information upstream"""
+        try:
+            return parse_user_info(await self._get('user_info', {'userName': username}))
+        except (httpx.HTTPError, ValueError, RequestDeferred) as e:
+            return error_result(e)
+
+    async def get_user_info(self, username):
+        """Get user information"""
+        key = username.lower()
+        cached = self.user_info_cache.get(key)
+        if cached is not None:
+            return cached
+
+        result = await self.single_flight.do(('user_info', key), self._fetch_user_info, username)
+        if result['success']:
+            self.user_info_cache.set(key, result)
+        return result
+
+    async def get_user_following(self, username, page_size=20, cursor=None):
+        """Get user following list"""
+        params = {
+            'userName': username,
+            'pageSize': page_size
+        }
+
+        if cursor:
+            params['cursor'] = cursor
+
+        try:
+            return parse_user_following(await self._get('user_following', params))
+        except (httpx.HTTPError, ValueError, RequestDeferred) as e:
+            return error_result(e)
+
+    async def _fetch_my_credits(self):
+        """Request account credits upstream"""
+        try:
+            return parse_my_credits(await self._get('my_info'))
+        except (httpx.HTTPError, ValueError, RequestDeferred) as e:
+            return error_result(e)
+
+    async def get_my_credits(self):
+        """Get account credits information"""
+        cached = self.credits_cache.get('my_info')
+        if cached is not None:
+            return cached
+
+        result = await self.single_flight.do(('my_info',), self._fetch_my_credits)
+        if result['success']:
+            self.credits_cache.set('my_info', result)
+            self.dispatcher.set_credits(result['recharge_credits'] + result['total_bonus_credits'])
+        return result
+
+    async def get_many_user_info(self, usernames):
+        """Look up several users concurrently, keyed by username"""
+        results = await asyncio.gather(*(self.get_user_info(u) for u in usernames))
+        return dict(zip(usernames, results))
+
+    async def fetch_following_snapshot(self, username, max_pages=SNAPSHOT_MAX_PAGES):
+        """Fetch following IDs, newest first, to use as a diff baseline"""
+        return await self.single_flight.do(
+            ('following_snapshot', username.lower(), max_pages),
+            self._fetch_following_snapshot, username, max_pages
+        )
+
+    async def _fetch_following_snapshot(self, username, max_pages):
+        """Paginate following IDs upstream"""
+        following_ids = []
+        cursor = None
+        page_count = 0
+        complete = False
+
+        while page_count < max_pages:
+            result = await self.get_user_following(username, page_size=200, cursor=cursor)
+            if not result['success']:
+                if page_count == 0:
+                    return result
+                # Keep the pages already paid for as a partial baseline
+                break
+
+            following_ids.extend(
+                user_id for user_id in map(following_id, result['followings'])
+                if user_id is not None
+            )
+            page_count += 1
+
+            cursor = result.get('next_cursor')
+            if not result.get('has_next_page') or not cursor:
+                complete = True
+                break
+
+        return snapshot_result(following_ids, page_count, complete)
+
+    def stream_following_changes(self, username, known_ids, previous_count, current_count,
+                                 max_pages=FOLLOWING_MAX_PAGES, checkpoint=None,
+                                 on_checkpoint=None, first_page=None, partial=False):
+        """Stream exact follows and unfollows since the stored snapshot
+
+        Async iterator of ('page', page) items, one per fetched page with
+        the new follows found on it, then a final ('result', result) with
+        the same dict fetch_following_changes returns. The next page is
+        already being fetched while the consumer handles the current one.
+
+        Resumes from checkpoint when given. on_checkpoint is called with
+        the progress after every page, so a failure or the page limit
+        never loses pages that were already paid for. first_page is a
+        get_user_following result the caller already has for the top of
+        the list; it is used instead of fetching the first page again.
+        partial marks a snapshot holding only the newest follows (see
+        FollowingDiff).
+        """
+        key = (
+            'following_changes', username.lower(), previous_count, current_count,
+            len(known_ids), known_ids[0] if known_ids else None, max_pages,
+            checkpoint['cursor'] if checkpoint else None, first_page is not None, partial
+        )
+        return self.single_flight.stream(
+            key, self._following_change_pages,
+            username, known_ids, previous_count, current_count, max_pages,
+            checkpoint, on_checkpoint, first_page, partial
+        )
+
+    async def fetch_following_changes(self, username, known_ids, previous_count, current_count,
+                                      max_pages=FOLLOWING_MAX_PAGES, checkpoint=None,
+                                      on_checkpoint=None, partial=False):
+        """Fetch exact follows and unfollows since the stored snapshot"""
+        async for kind, data in self.stream_following_changes(
+            username, known_ids, previous_count, current_count,
+            max_pages, checkpoint, on_checkpoint, partial=partial
+        ):
+            if kind == 'result':
+                return data
+
+    async def _following_change_pages(self, username, known_ids, previous_count, current_count,
+                                      max_pages, checkpoint, on_checkpoint, first_page=None,
+                                      partial=False):
+        """Paginate and diff followings upstream, yielding every page"""
+        diff = FollowingDiff(known_ids, previous_count, current_count, checkpoint, partial)
+        cursor = checkpoint['cursor'] if checkpoint else None
+        pages_before = checkpoint['pages_fetched'] if checkpoint else 0
+        page_count = 0
+
+        if diff.new_followings:
+            # Follows found in an earlier run but never delivered
+            yield 'page', following_page(diff.new_followings, page_count)
+
+        while page_count < max_pages:
+            if first_page is not None:
+                result, first_page = first_page, None
+            else:
+                result = await self.get_user_following(
+                    username, page_size=diff.next_page_size(), cursor=cursor
+                )
+            if not result['success']:
+                yield 'result', dict(result, resumable=bool(checkpoint or page_count))
+                return
+            page_count += 1
+
+            found_before = len(diff.new_followings)
+            finished = diff.add_page(result['followings'])
+
+            cursor = result.get('next_cursor')
+            if not finished and (not result.get('has_next_page') or not cursor):
+                diff.finish()
+                finished = True
+
+            if not finished and on_checkpoint:
+                on_checkpoint(diff.state(cursor, pages_before + page_count))
+
+            yield 'page', following_page(diff.new_followings[found_before:], page_count)
+
+            if finished:
+                break
+
+        yield 'result', diff.result(page_count, cursor, pages_before + page_count)
+
+    def cache_stats(self):
+        """Hit/miss counters of the lookup caches and merged call count"""
+        return {
+            'user_info': self.user_info_cache.stats(),
+            'credits': self.credits_cache.stats(),
+            'merged_calls': self.single_flight.merged,
+            'dispatcher': self.dispatcher.stats()
+        }
+
+    async def close(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -1,136 +1,480 @@
-from datetime import datetime
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-
-def format_number(num):
-    """Format number with K, M suffix"""
-    if num >= 1_000_000:
-        return f"{num/1_000_000:.1f}M"
-    elif num >= 1_000:
-        return f"{num/1_000:.1f}K"
-    return str(num)
-
-def format_date(date_str):
-    """Format date string to readable format"""
-    try:
-        dt = datetime.strptime(date_str, "%a %b %d %H:%M:%S %z %Y")
-        return dt.strftime("%d %B %Y")
-    except:
-        return date_str
-
-def format_datetime(iso_str):
-    """Format ISO datetime to readable format"""
-    try:
-        dt = datetime.fromisoformat(iso_str)
-        return dt.strftime("%d %b %Y, %H:%M")
-    except:
-        return iso_str
-
-def escape_markdown(text):
-    """Escape special characters for Telegram MarkdownV2"""
-    if not text:
-        return ""
-    
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    return text
-
-def format_user_card(user_data, show_stats=True):
-    """Format user information card"""
-    name = escape_markdown(user_data.get('name', 'N/A'))
-    username = user_data.get('userName', 'N/A')
-    description = escape_markdown(user_data.get('description', 'No description'))[:150]
-    
-    followers = format_number(user_data.get('followers_count', 0))
-    following = format_number(user_data.get('following_count', 0))
-    tweets = format_number(user_data.get('statuses_count', 0))
-    
-    created = format_date(user_data.get('created_at', 'N/A'))
-    
-    # Build message
-    msg = f"*{name}*\n"
-    msg += f"[@{username}](https://twitter.com/{username})\n\n"
-    msg += f"_{description}_\n\n"
-    
-    if show_stats:
-        msg += f"👥 Followers: *{followers}*\n"
-        msg += f"➕ Following: *{following}*\n"
-        msg += f"📝 Tweets: *{tweets}*\n"
-        msg += f"📅 Joined: {created}\n"
-    
-    return msg
-
-def format_following_list(followings):
-    """Format list of new followings"""
-    if not followings:
-        return "No new following\\."
-    
-    messages = []
-    message = "*🆕 New Following Detected\\!*\n\n"
-    message += f"Total: *{len(followings)}* new account\n"
-    message += "━━━━━━━━━━━━━━━━━━\n\n"
-    messages.append(message)
-    
-    for idx, user in enumerate(followings, 1):
-        name = escape_markdown(user.get('name', 'N/A'))
-        username = user.get('userName', 'N/A')
-        description = escape_markdown(user.get('description', 'No description'))
-        
-        # Limit description length
-        if len(description) > 100:
-            description = description[:97] + "\\.\\.\\."
-        
-        followers = format_number(user.get('followers_count', 0))
-        following = format_number(user.get('following_count', 0))
-        tweets = format_number(user.get('statuses_count', 0))
-        created = format_date(user.get('created_at', 'N/A'))
-        
-        user_msg = f"*{idx}\\. {name}*\n"
-        user_msg += f"[@{username}](https://twitter.com/{username})\n"
-        user_msg += f"_{description}_\n\n"
-        user_msg += f"👥 {followers} • ➕ {following} • 📝 {tweets}\n"
-        user_msg += f"📅 {created}\n"
-        user_msg += "━━━━━━━━━━━━━━━━━━\n\n"
-        
-        # Check if adding this user exceeds Telegram message limit
-        if len(messages[-1] + user_msg) > 4000:
-            messages.append(user_msg)
-        else:
-            messages[-1] += user_msg
-    
-    return messages
-
-def create_user_keyboard(username):
-    """Create inline keyboard for user actions"""
-    keyboard = [
-        [
-            InlineKeyboardButton("🔄 Check Update", callback_data=f"check_{username}"),
-            InlineKeyboardButton("🗑️ Remove", callback_data=f"remove_{username}")
-        ],
-        [
-            InlineKeyboardButton("🔗 View on Twitter", url=f"https://twitter.com/{username}")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def format_tracked_users(users):
-    """Format list of tracked users"""
-    if not users:
-        return "No users are being\\-tracked\\.\n\nUse `/track username` to start tracking\\."
-    
-    msg = "*📋 List of tracked \\-Users*\n\n"
-    
-    for user in users:
-        username = user.get('username', 'N/A')
-        following = user.get('following_count', 0)
-        last_checked = format_datetime(user.get('last_checked', ''))
-        check_count = user.get('check_count', 0)
-        
-        msg += f"• *{username}*\n"
-        msg += f"  Following: {following} \\| Checked: {check_count}x\n"
-        msg += f"  Last: {escape_markdown(last_checked)}\n\n"
-    
-    msg += f"Total: *{len(users)}* user\n"
-    msg += "\nUse `/track username` for check update\\."
-    
-    return msg
\ No newline at end of file
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import PROFILE_RENDER_CACHE_SIZE
+from tracing import traced
+
+def format_number(num):
+    """Format number with K, M suffix"""
+    if num >= 1_000_000:
+        return f"{num/1_000_000:.1f}M"
+    elif num >= 1_000:
+        return f"{num/1_000:.1f}K"
+    return str(num)
+
+@lru_cache(maxsize=PROFILE_RENDER_CACHE_SIZE)
+def format_date(date_str):
+    """Format date string to readable format
+
+    Cached, as the same few creation dates come up in every list.
+    """
+    try:
+        dt = datetime.strptime(date_str, "%a %b %d %H:%M:%S %z %Y")
+        return dt.strftime("%d %B %Y")
+    except (TypeError, ValueError):
+        return date_str
+
+def format_datetime(iso_str):
+    """Format ISO datetime to readable format"""
+    try:
+        dt = datetime.fromisoformat(iso_str)
+        return dt.strftime("%d %b %Y, %H:%M")
+    except:
+        return iso_str
+
+def parse_since(text, now=None):
+    """Start of a /history range: 30m, 12h, 7d, 2w or a YYYY-MM-DD date; None if invalid
+
+    The result is naive local time like the stored detected_at stamps;
+    a date with a UTC offset is converted to it.
+    """
+    match = re.fullmatch(r'(\d+)([mhdw])', text.strip().lower())
+    try:
+        if match:
+            unit = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}[match.group(2)]
+            return (now or datetime.now()) - timedelta(**{unit: int(match.group(1))})
+        since = datetime.fromisoformat(text.strip())
+        if since.tzinfo is not None:
+            since = since.astimezone().replace(tzinfo=None)
+        return since
+    except (ValueError, OverflowError):
+        return None
+
+# Twitter handles: 1-15 letters, digits or underscores
+USERNAME_PATTERN = re.compile(r'[A-Za-z0-9_]{1,15}')
+
+def parse_usernames(text):
+    """Split a pasted or uploaded list into (valid, invalid) usernames
+
+    Names can be separated by spaces, commas, semicolons or new lines
+    and may carry an @ or be profile links. Duplicates are dropped,
+    ignoring case; the order is kept.
+    """
+    valid, invalid, seen = [], [], set()
+    for token in re.split(r'[\s,;]+', text):
+        name = re.sub(r'^(https?://)?(www\.)?(twitter|x)\.com/', '', token.strip(), flags=re.IGNORECASE)
+        name = name.split('?')[0].strip('/').lstrip('@')
+        if not name:
+            continue
+        if not USERNAME_PATTERN.fullmatch(name):
+            invalid.append(name)
+        elif name.lower() not in seen:
+            seen.add(name.lower())
+            valid.append(name)
+    return valid, invalid
+
+# Telegram MarkdownV2 special characters
+MARKDOWN_SPECIAL_CHARS = '_*[]()~`>#+-=|{}.!'
+_MD_ESCAPES = str.maketrans({char: f'\\{char}' for char in MARKDOWN_SPECIAL_CHARS})
+
+# Longest message the list formatters build, below Telegram's 4096
+MESSAGE_CHUNK_LIMIT = 4000
+
+def escape_markdown(text):
+    """Escape special characters for Telegram MarkdownV2"""
+    if not text:
+        return ""
+    return text.translate(_MD_ESCAPES)
+
+def iter_chunks(parts, first=""):
+    """Join parts into messages of at most MESSAGE_CHUNK_LIMIT characters
+
+    Messages start with first and are yielded as soon as they are full;
+    a part that does not fit starts the next one. Each part is only
+    copied once, when its message is joined.
+    """
+    chunk = [first]
+    length = len(first)
+    for part in parts:
+        if length + len(part) > MESSAGE_CHUNK_LIMIT:
+            yield ''.join(chunk)
+            chunk = [part]
+            length = len(part)
+        else:
+            chunk.append(part)
+            length += len(part)
+    yield ''.join(chunk)
+
+@traced('format.user_card')
+def format_user_card(user_data, show_stats=True):
+    """Format user information card"""
+    name = escape_markdown(user_data.get('name', 'N/A'))
+    username = user_data.get('userName', 'N/A')
+    description = escape_markdown(user_data.get('description', 'No description'))[:150]
+    
+    followers = format_number(user_data.get('followers_count', 0))
+    following = format_number(user_data.get('following_count', 0))
+    tweets = format_number(user_data.get('statuses_count', 0))
+    
+    created = format_date(user_data.get('created_at', 'N/A'))
+    
+    # Build message
+    msg = f"*{name}*\n"
+    msg += f"[@{username}](https://twitter.com/{username})\n\n"
+    msg += f"_{description}_\n\n"
+    
+    if show_stats:
+        msg += f"👥 Followers: *{followers}*\n"
+        msg += f"➕ Following: *{following}*\n"
+        msg += f"📝 Tweets: *{tweets}*\n"
+        msg += f"📅 Joined: {created}\n"
+    
+    return msg
+
+@lru_cache(maxsize=PROFILE_RENDER_CACHE_SIZE)
+def render_profile(name, username, description, followers, following, tweets, created):
+    """List entry of one profile below its number line
+
+    Cached on the displayed fields, so an account followed by many
+    tracked users is only rendered again once its profile changes.
+    """
+    description = escape_markdown(description)
+
+    # Limit description length
+    if len(description) > 100:
+        description = description[:97] + "\\.\\.\\."
+
+    return escape_markdown(name), (
+        f"[@{username}](https://twitter.com/{username})\n"
+        f"_{description}_\n\n"
+        f"👥 {format_number(followers)} • ➕ {format_number(following)} • 📝 {format_number(tweets)}\n"
+        f"📅 {format_date(created)}\n"
+        "━━━━━━━━━━━━━━━━━━\n\n"
+    )
+
+def render_following(idx, user):
+    """Numbered list entry of one followed account"""
+    name, body = render_profile(
+        user.get('name', 'N/A'),
+        user.get('userName', 'N/A'),
+        user.get('description', 'No description'),
+        user.get('followers_count', 0),
+        user.get('following_count', 0),
+        user.get('statuses_count', 0),
+        user.get('created_at', 'N/A')
+    )
+    return f"*{idx}\\. {name}*\n{body}"
+
+def iter_following_list(followings, start=1, header=True):
+    """Messages of format_following_list, rendered one at a time
+
+    Nothing is rendered before the first message is asked for, and
+    each message is rendered only when the previous one was taken.
+    """
+    if not followings:
+        yield "No new following\\."
+        return
+    
+    message = ""
+    if header:
+        message = "*🆕 New Following Detected\\!*\n\n"
+        message += f"Total: *{len(followings)}* new account\n"
+        message += "━━━━━━━━━━━━━━━━━━\n\n"
+    
+    yield from iter_chunks(
+        (render_following(idx, user) for idx, user in enumerate(followings, start)), message
+    )
+
+@traced('format.following_list')
+def format_following_list(followings, start=1, header=True):
+    """Format list of new followings, numbered from start
+
+    With header=False only the entries are rendered, for lists that are
+    sent page by page as they are fetched.
+    """
+    if not followings:
+        return "No new following\\."
+    return list(iter_following_list(followings, start, header))
+
+@traced('format.unfollowed_list')
+def format_unfollowed_list(user_ids):
+    """Format list of unfollowed account IDs"""
+    if not user_ids:
+        return "No unfollow\\."
+    
+    message = "*👋 Unfollow Detected\\!*\n\n"
+    message += f"Total: *{len(user_ids)}* account\n"
+    message += "━━━━━━━━━━━━━━━━━━\n\n"
+    
+    return list(iter_chunks(
+        (f"{idx}\\. [ID {user_id}](https://twitter.com/i/user/{user_id})\n"
+         for idx, user_id in enumerate(user_ids, 1)),
+        message
+    ))
+
+def iter_check_changes(result):
+    """Messages of format_check_changes, rendered one at a time"""
+    if result['new_followings']:
+        yield from iter_following_list(result['new_followings'])
+    if result['unfollowed_ids']:
+        yield from format_unfollowed_list(result['unfollowed_ids'])
+
+@traced('format.check_changes')
+def format_check_changes(result):
+    """Format follow and unfollow lists of a check result"""
+    return list(iter_check_changes(result))
+
+@traced('format.check_summary')
+def format_check_summary(result):
+    """Format summary of a check result with pagination info"""
+    summary = f"✅ *Update Complete*\n\n"
+    summary += f"User: @{result['username']}\n"
+    summary += f"New following: *{len(result['new_followings'])}*\n"
+    summary += f"Unfollowed: *{len(result['unfollowed_ids'])}*\n"
+    summary += f"Total following: *{result['current_following']}*\n"
+    
+    # Add pagination info if multiple pages were fetched
+    if result['pages_fetched'] > 1:
+        summary += f"\n📄 Pages fetched: *{result['pages_fetched']}*"
+        summary += f"\n💳 API calls used: *{result['pages_fetched']}*"
+    
+    if not result['complete']:
+        summary += "\n\n⚠️ Page limit reached, the rest will show on the next check"
+    
+    return summary
+
+def create_user_keyboard(username):
+    """Create inline keyboard for user actions"""
+    keyboard = [
+        [
+            InlineKeyboardButton("🔄 Check Update", callback_data=f"check_{username}"),
+            InlineKeyboardButton("🗑️ Remove", callback_data=f"remove_{username}")
+        ],
+        [
+            InlineKeyboardButton("🔗 View on Twitter", url=f"https://twitter.com/{username}")
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@traced('format.tracked_users')
+def format_tracked_users(users):
+    """Format list of tracked users"""
+    if not users:
+        return "No users are being\\-tracked\\.\n\nUse `/track username` to start tracking\\."
+    
+    msg = "*📋 List of tracked \\-Users*\n\n"
+    
+    for user in users:
+        username = user.get('username', 'N/A')
+        following = user.get('following_count', 0)
+        last_checked = format_datetime(user.get('last_checked', ''))
+        check_count = user.get('check_count', 0)
+        
+        msg += f"• *{username}*\n"
+        msg += f"  Following: {following} \\| Checked: {check_count}x\n"
+        msg += f"  Last: {escape_markdown(last_checked)}\n\n"
+    
+    msg += f"Total: *{len(users)}* user\n"
+    msg += "\nUse `/track username` for check update\\."
+    
+    return msg
+
+def format_slowest_traces(traces):
+    """Format the slowest recent traces with their top spans"""
+    if not traces:
+        return "No traces recorded yet\\."
+    
+    msg = "*🐢 Slowest Recent Requests*\n\n"
+    
+    for idx, trace in enumerate(traces, 1):
+        attrs = ' '.join(str(value) for key, value in trace.attrs.items() if value and key != 'user_id')
+        started = datetime.fromtimestamp(trace.root.started_at).strftime("%d %b %H:%M:%S")
+        
+        msg += f"{idx}\\. *{escape_markdown(trace.name)}* {escape_markdown(attrs)} "
+        msg += f"\\- *{escape_markdown(f'{trace.duration:.2f}')}s*\n"
+        msg += f"  {escape_markdown(started)} \\| `{trace.trace_id}`"
+        if trace.root.error:
+            msg += " \\| ❌"
+        msg += "\n"
+        
+        for name, (total, count) in trace.breakdown()[:3]:
+            msg += f"  • {escape_markdown(name)} ×{count}: {escape_markdown(f'{total:.2f}')}s\n"
+        msg += "\n"
+    
+    return msg
+
+@traced('format.history')
+def format_history(username, events, since, total=None):
+    """Format logged follow events, grouped by day
+
+    total is the number of events in the range when only the newest
+    ones are listed.
+    """
+    since_text = escape_markdown(since.strftime("%d %b %Y, %H:%M"))
+    if not events:
+        return [f"📜 No follow activity logged for @{escape_markdown(username)} since {since_text}\\."]
+    
+    follows = sum(1 for event in events if event['kind'] == 'follow')
+    
+    message = f"*📜 Follow history of @{escape_markdown(username)}*\n\n"
+    message += f"Since {since_text}: ➕ *{follows}* follow \\| ➖ *{len(events) - follows}* unfollow\n"
+    if total and total > len(events):
+        message += f"Showing the newest *{len(events)}* of *{total}* events\n"
+    message += "━━━━━━━━━━━━━━━━━━\n"
+    
+    lines = []
+    day = None
+    for event in events:
+        detected = datetime.fromisoformat(event['detected_at'])
+        line = ""
+        if detected.date() != day:
+            day = detected.date()
+            line += f"\n*{escape_markdown(detected.strftime('%d %b %Y'))}*\n"
+        
+        if event.get('username'):
+            target = f"[@{escape_markdown(event['username'])}](https://twitter.com/{event['username']})"
+            if event.get('name'):
+                target += f" {escape_markdown(event['name'])}"
+        else:
+            target = f"[ID {event['user_id']}](https://twitter.com/i/user/{event['user_id']})"
+        
+        icon = "➕" if event['kind'] == 'follow' else "➖"
+        line += f"{icon} {detected.strftime('%H:%M')} {target}\n"
+        lines.append(line)
+    
+    return list(iter_chunks(lines, message))
+
+def format_trending(trending, since):
+    """Format accounts followed by several tracked users, most followed first"""
+    since_text = escape_markdown(since.strftime("%d %b %Y, %H:%M"))
+    if not trending:
+        return [f"📈 No account was followed by several tracked users since {since_text}\\."]
+    
+    message = f"*📈 Trending follows since {since_text}*\n"
+    message += "━━━━━━━━━━━━━━━━━━\n"
+    
+    lines = []
+    for idx, entry in enumerate(trending, 1):
+        profile = entry.get('profile') or {}
+        if profile.get('userName'):
+            target = f"[@{escape_markdown(profile['userName'])}](https://twitter.com/{profile['userName']})"
+            if profile.get('name'):
+                target += f" {escape_markdown(profile['name'])}"
+        else:
+            target = f"[ID {entry['user_id']}](https://twitter.com/i/user/{entry['user_id']})"
+        
+        followers = ', '.join(f"@{escape_markdown(username)}" for username, _ in entry['followers'])
+        lines.append(f"\n*{idx}\\.* {target}\n👥 *{len(entry['followers'])}* tracked: {followers}\n")
+    
+    return list(iter_chunks(lines, message))
+
+# Result statuses of a bulk run, in summary order
+BULK_STATUSES = [
+    ('tracked', '🆕 Newly tracked'),
+    ('snapshot', '📸 Snapshot saved'),
+    ('changed', '🔔 Changed'),
+    ('unchanged', '✅ Unchanged'),
+    ('failed', '❌ Failed')
+]
+
+def bulk_counts(results):
+    """Number of results per status, failed ones under 'failed'"""
+    counts = {}
+    for result in results:
+        status = result['status'] if result['success'] else 'failed'
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+def format_bulk_progress(title, done, total, counts):
+    """Format the in-place progress message of a bulk run"""
+    filled = done * 10 // total if total else 10
+    msg = f"⏳ *{escape_markdown(title)}*\n\n"
+    msg += f"{'▓' * filled}{'░' * (10 - filled)} {done}/{total}\n"
+    
+    parts = [f"{label.split()[0]} {counts[status]}" for status, label in BULK_STATUSES if counts.get(status)]
+    if parts:
+        msg += escape_markdown(' · '.join(parts)) + "\n"
+    
+    return msg
+
+@traced('format.bulk_summary')
+def format_bulk_summary(title, results, invalid=(), skipped=0):
+    """Format the final summary of a bulk run"""
+    counts = bulk_counts(results)
+    
+    msg = f"✅ *{escape_markdown(title)} complete*\n\n"
+    msg += f"Accounts: *{len(results)}*\n"
+    for status, label in BULK_STATUSES:
+        if counts.get(status):
+            msg += f"{label}: *{counts[status]}*\n"
+    
+    changed = [r for r in results if r['success'] and r['status'] == 'changed']
+    if changed:
+        msg += "\n*Changes:*\n"
+        for result in changed[:20]:
+            msg += f"• @{escape_markdown(result['username'])}: ➕ {len(result['new_followings'])} ➖ {len(result['unfollowed_ids'])}\n"
+        if len(changed) > 20:
+            msg += f"\\.\\.\\. and {len(changed) - 20} more\n"
+    
+    failed = [r for r in results if not r['success']]
+    if failed:
+        msg += "\n*Failed:*\n"
+        for result in failed[:10]:
+            msg += f"• @{escape_markdown(result['username'])}: {escape_markdown(result['error'])}\n"
+        if len(failed) > 10:
+            msg += f"\\.\\.\\. and {len(failed) - 10} more\n"
+    
+    if invalid:
+        shown = ', '.join(invalid[:10]) + (' ...' if len(invalid) > 10 else '')
+        msg += f"\n⚠️ Skipped *{len(invalid)}* invalid name\\(s\\): {escape_markdown(shown)}\n"
+    if skipped:
+        msg += f"\n⚠️ Skipped *{skipped}* account\\(s\\) over the limit of one request\n"
+    
+    return msg
+
+# How each planned action reads in /plan
+PLAN_ACTIONS = {
+    'snapshot': '📸 snapshot',
+    'follows': '➕ new follows',
+    'unfollows': '➖ unfollows',
+    'resume': '⏯ resume',
+    'unchanged': '✅ unchanged'
+}
+
+def format_cost(calls, credits, max_calls, max_credits):
+    """Calls and credits, as a range when the worst case differs"""
+    if max_calls == calls:
+        return f"{calls} calls, {credits:,} credits"
+    return f"{calls}-{max_calls} calls, {credits:,}-{max_credits:,} credits"
+
+@traced('format.plan')
+def format_plan(plans, failed, total, remaining_credits=None):
+    """Format the predicted cost of checking accounts"""
+    msg = "*🧮 Check Plan*\n\n"
+    
+    active = [plan for plan in plans if plan['action'] != 'unchanged']
+    for plan in sorted(active, key=lambda plan: plan['max_credits'], reverse=True)[:20]:
+        line = f"@{plan['username']} {PLAN_ACTIONS[plan['action']]} {plan['difference']:+d}: "
+        line += format_cost(plan['calls'], plan['credits'], plan['max_calls'], plan['max_credits'])
+        if not plan['complete']:
+            line += " (page limit, continues next check)"
+        msg += f"• {escape_markdown(line)}\n"
+    if len(active) > 20:
+        msg += f"\\.\\.\\. and {len(active) - 20} more\n"
+    
+    unchanged = len(plans) - len(active)
+    if unchanged:
+        msg += f"✅ Unchanged: *{unchanged}*\n"
+    for item in failed[:10]:
+        msg += f"❌ @{escape_markdown(item['username'])}: {escape_markdown(item['error'])}\n"
+    
+    msg += "━━━━━━━━━━━━━━━━━━\n"
+    msg += f"Accounts: *{total['accounts']}*, profile lookups: *{total['lookups']}*\n"
+    cost = format_cost(total['calls'], total['credits'], total['max_calls'], total['max_credits'])
+    msg += f"💳 Total: *{escape_markdown(cost)}*\n"
+    if remaining_credits is not None:
+        msg += f"💰 Remaining credits: *{escape_markdown(f'{remaining_credits:,}')}*\n"
+    msg += "\n_Lookups just made are cached briefly, so checking right away reuses them\\._"
+    
+    return msg
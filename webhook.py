@@ -0,0 +1,56 @@
+import hmac
+import logging
+from telegram import Update
+
+from webserver import HTTPServer, Response, json_response
+
+logger = logging.getLogger(__name__)
+
+class WebhookServer(HTTPServer):
+    """Receives Telegram webhook updates and feeds them to the application
+
+    Requests to path must carry the secret token set with set_webhook
+    in X-Telegram-Bot-Api-Secret-Token. GET /health reports whether the
+    application is running, plus whatever stats() returns.
+    """
+
+    def __init__(self, application, host, port, path, secret_token, stats=None):
+        super().__init__(host, port, {
+            ('POST', path): self.receive,
+            ('GET', '/health'): self.health
+        }, name='Webhook')
+        self.application = application
+        self.secret_token = secret_token
+        self.stats = stats
+        self.received = 0
+        self.rejected = 0
+
+    async def receive(self, request):
+        """Queue one update for the application's handlers"""
+        token = request.headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token, self.secret_token):
+            self.rejected += 1
+            return Response(403, 'Forbidden\n')
+
+        try:
+            update = Update.de_json(request.json(), self.application.bot)
+        except ValueError as e:
+            logger.warning(f"Invalid webhook payload: {e}")
+            return Response(400, 'Bad request\n')
+
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return Response(200)
+
+    async def health(self, request):
+        """Liveness and queue depth for load balancers"""
+        running = self.application.running
+        data = {
+            'status': 'ok' if running else 'stopping',
+            'updates_received': self.received,
+            'updates_rejected': self.rejected,
+            'update_queue': self.application.update_queue.qsize()
+        }
+        if self.stats:
+            data.update(self.stats())
+        return json_response(data, 200 if running else 503)
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+READ_TIMEOUT = 30
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable'
+}
+
+class Request:
+    """One parsed HTTP request"""
+
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+class Response:
+    """Status, body and content type to send back"""
+
+    def __init__(self, status=200, body='', content_type='text/plain; charset=utf-8'):
+        self.status = status
+        self.body = body.encode() if isinstance(body, str) else body
+        self.content_type = content_type
+
+def json_response(data, status=200):
+    """Response with a JSON body"""
+    return Response(status, json.dumps(data), 'application/json')
+
+async def read_request(reader):
+    """Read one request from the connection, or None when the client closed it"""
+    request_line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+    if not request_line:
+        return None
+
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError('Malformed request line')
+    method, target, _ = parts
+
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY_SIZE:
+        raise OverflowError('Request body too large')
+    body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b''
+
+    return Request(method, target.split('?')[0], headers, body)
+
+class HTTPServer:
+    """Small HTTP/1.1 server on the running event loop
+
+    routes maps (method, path) to a coroutine taking a Request and
+    returning a Response. Connections are kept alive between requests.
+    """
+
+    def __init__(self, host, port, routes, name='HTTP'):
+        self.host = host
+        self.port = port
+        self.routes = routes
+        self.name = name
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"{self.name} server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def dispatch(self, request):
+        """Response of the route matching a request"""
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self.routes):
+                return Response(405, 'Method not allowed\n')
+            return Response(404, 'Not found\n')
+
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {e}")
+            return Response(500, 'Internal server error\n')
+
+    async def handle(self, reader, writer):
+        """Serve requests on one connection until the client closes it"""
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except OverflowError:
+                    await self.respond(writer, Response(413, 'Payload too large\n'), keep_alive=False)
+                    return
+                except ValueError:
+                    await self.respond(writer, Response(400, 'Bad request\n'), keep_alive=False)
+                    return
+                if request is None:
+                    return
+
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, await self.dispatch(request), keep_alive)
+                if not keep_alive:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, response, keep_alive):
+        """Write a response"""
+        writer.write(
+            f"HTTP/1.1 {response.status} {STATUS_TEXT.get(response.status, '')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + response.body
+        )
+        await writer.drain()